@@ -123,6 +123,8 @@ resource "google_firestore_index" "article" {
 
 }
 
+# Also serves the cursor paging of the diaries of a user, ordered by time_created then __name__ descending.
+# Firestore appends __name__ to a composite index in the direction of its last field, so it is not listed.
 resource "google_firestore_index" "diary" {
   collection = "diary"
 
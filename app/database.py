@@ -1,4 +1,6 @@
 import os
+import threading
+from typing import Callable
 
 from google.cloud import firestore, storage
 from google.cloud import translate_v2 as translate
@@ -8,6 +10,7 @@ from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
 from app import logger
+from app.utils.metrics import metrics
 from config import RunningENV, get_settings
 
 settings = get_settings()
@@ -35,29 +38,78 @@ credentials = service_account.Credentials.from_service_account_file(
 project = settings.google_cloud_project_id
 
 
+class ClientRegistry:
+    """One client of every kind per worker process, shared by all the requests
+
+    The firestore client keeps its gRPC channel and the translate and storage clients keep the
+    keep-alive connections of their http session, instead of opening new ones on every request.
+    A gRPC channel or a connection pool must not be used on both sides of a fork, so the clients
+    created before gunicorn forks a worker (with --preload) are not used in the child and created
+    again on first use. `reused` counts the gets served by a client of the same process, `created`
+    and `rebuilt_after_fork` the clients built in it.
+    """
+
+    def __init__(self, factories: dict[str, Callable[[], object]]):
+        self._factories = factories
+        # The pid that built every client, a client of another pid was built before the fork
+        self._clients: dict[str, tuple[int, object]] = {}
+        # Reentrant, the factory of the bucket gets the storage client
+        self._lock = threading.RLock()
+        self._pid = os.getpid()
+
+    def get(self, name: str):
+        pid = os.getpid()
+        if self._pid != pid:
+            self._after_fork(pid)
+        built = self._clients.get(name)
+        if built is not None and built[0] == pid:
+            metrics.increment(f"google_clients.{name}.reused")
+            return built[1]
+        with self._lock:
+            built = self._clients.get(name)
+            if built is not None and built[0] == pid:
+                metrics.increment(f"google_clients.{name}.reused")
+                return built[1]
+            client = self._factories[name]()
+            self._clients[name] = (pid, client)
+            # A worker building again what the parent built before the fork is not a new client of the pool
+            metrics.increment(f"google_clients.{name}.{'rebuilt_after_fork' if built is not None else 'created'}")
+        return client
+
+    def _after_fork(self, pid: int):
+        # The clients of the parent stay in the registry, never used nor closed here, so their rebuild
+        # is counted apart. The lock may have been held by another thread of the parent while it forked
+        self._lock = threading.RLock()
+        self._pid = pid
+        metrics.increment("google_clients.forks")
+
+    def close(self):
+        with self._lock:
+            clients, self._clients = self._clients, {}
+        for pid, client in clients.values():
+            close = getattr(client, "close", None)
+            if pid == os.getpid() and close is not None:
+                close()
+
+
+google_clients = ClientRegistry({
+    "firestore": lambda: firestore.Client(project=project, credentials=credentials),
+    "translate": lambda: translate.Client(credentials=credentials),
+    "storage": lambda: storage.Client(project=project, credentials=credentials),
+    "bucket": create_bucket})
+
+
 def get_translate_client():
-    translate_client = translate.Client(credentials=credentials)
-    try:
-        yield translate_client
-    finally:
-        pass
+    yield google_clients.get("translate")
 
 
 def get_bucket():
-    storage_client = storage.Client(project=project, credentials=credentials)
-    bucket = storage_client.get_bucket(settings.bucket_name)
-    try:
-        yield bucket
-    finally:
-        pass
+    yield google_clients.get("bucket")
 
 
 def get_fs():
-    fs = firestore.Client(project=project, credentials=credentials)
-    try:
-        yield fs
-    finally:
-        fs.close()
+    # The client is shared by the worker, closed on shutdown instead of after the request
+    yield google_clients.get("firestore")
 
 
 def get_db():
@@ -2,23 +2,144 @@ import os
 import pickle
 from functools import lru_cache
 
-import tensorflow as tf
-from keras.preprocessing.text import Tokenizer
+from app import logger
+from app.services.diary import MAX_SEQUENCE_LENGTH
+from app.utils.batching import MicroBatcher
+from app.utils.classifier import (EmotionClassifier, KerasClassifier,
+                                  TFLiteClassifier, masks_padding)
+from app.utils.cpu import configure_tensorflow_threads, pin_worker_cpus
+from app.utils.model_registry import ModelRegistry
+from app.utils.sidecar import SidecarClassifier
+from app.utils.tokenizer import BatchTokenizer
+from app.utils.vocabulary import Vocabulary
+from config import ClassifierBackend, InferenceMode, get_settings
+
+DEFAULT_MODEL_VERSION = "default"
+# Short sentences of different lengths that warm up a model before it serves requests
+PROBE_SENTENCES = [
+    "I am happy today",
+    "I feel so sad and lonely because my friend left",
+    "Why did he do that to me, I am really angry",
+    "I love spending the whole afternoon with my family at the beach and I can not wait to go back again"]
+
+
+MODELS_DIRECTORY = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'utils', 'models')
+
+
+def get_model_path(filename: str, version: str = DEFAULT_MODEL_VERSION):
+    # The default version is the model next to the tokenizer, other versions are in app/utils/models/<version>/
+    if version == DEFAULT_MODEL_VERSION:
+        return os.path.join(os.path.dirname(os.path.realpath(__file__)), 'utils', filename)
+    return os.path.join(MODELS_DIRECTORY, version, filename)
+
+
+def list_model_versions():
+    versions = sorted(os.listdir(MODELS_DIRECTORY)) if os.path.isdir(MODELS_DIRECTORY) else []
+    return [DEFAULT_MODEL_VERSION] + [version for version in versions
+                                      if os.path.isdir(os.path.join(MODELS_DIRECTORY, version))]
 
 
 @lru_cache(maxsize=1)
-def get_tokenizer():
+def get_pickle_tokenizer():
+    # Unpickling the keras Tokenizer imports keras (and tensorflow) on the first call, not on import
     tokenizer = None
-    filename = 'tokenizer.pickle'
-    full_path_filename = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'utils', filename)
+    full_path_filename = get_model_path('tokenizer.pickle')
     with open(full_path_filename, 'rb') as x:
-        tokenizer: Tokenizer = pickle.load(x)
+        tokenizer = pickle.load(x)
     return tokenizer
 
 
 @lru_cache(maxsize=1)
-def get_model():
-    filename = 'model.h5'
-    full_path_filename = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'utils', filename)
+def get_tokenizer():
+    settings = get_settings()
+    if settings.tokenizer_vocabulary:
+        full_path_filename = get_model_path(settings.tokenizer_vocabulary)
+        if os.path.exists(full_path_filename):
+            return BatchTokenizer(Vocabulary(full_path_filename))
+        logger.warning(f"Vocabulary {full_path_filename} is not found, using tokenizer.pickle")
+    return BatchTokenizer(get_pickle_tokenizer())
+
+
+@lru_cache(maxsize=1)
+def configure_inference_cpu():
+    # Once per worker and before the first model is loaded, the thread pools can not be resized afterwards
+    settings = get_settings()
+    if settings.worker_cpu_cores:
+        pin_worker_cpus(settings.worker_cpu_cores)
+
+
+def load_model(version: str = DEFAULT_MODEL_VERSION):
+    # Tensorflow takes seconds to import, so it is only imported when the model is needed
+    import tensorflow as tf
+
+    settings = get_settings()
+    configure_inference_cpu()
+    configure_tensorflow_threads(settings.tf_intra_op_threads, settings.tf_inter_op_threads)
+    full_path_filename = get_model_path('model.h5', version)
     model = tf.keras.models.load_model(full_path_filename)
     return model
+
+
+@lru_cache(maxsize=1)
+def get_model():
+    return load_model()
+
+
+def load_classifier(version: str = DEFAULT_MODEL_VERSION) -> EmotionClassifier:
+    settings = get_settings()
+    backend = ClassifierBackend(settings.classifier_backend)
+    num_threads = settings.tf_intra_op_threads or None
+    if backend == ClassifierBackend.TFLITE:
+        configure_inference_cpu()
+        return TFLiteClassifier(get_model_path(settings.classifier_tflite_model, version), num_threads)
+    if backend == ClassifierBackend.TFLITE_INT8:
+        configure_inference_cpu()
+        return TFLiteClassifier(get_model_path(settings.classifier_quantized_model, version), num_threads)
+    return KerasClassifier(load_model(version), settings.inference_mode, settings.inference_sequence_buckets)
+
+
+def load_inference_model(version: str):
+    settings = get_settings()
+    classifier = load_classifier(version)
+    if settings.inference_dynamic_padding and not masks_padding(classifier):
+        logger.warning(f"inference_dynamic_padding is on but model {version} does not mask the padding (or it can "
+                       f"not be told), its sentences are padded to {MAX_SEQUENCE_LENGTH} instead")
+    if settings.inference_batching:
+        return MicroBatcher(
+            classifier,
+            window_ms=settings.inference_batch_window_ms,
+            max_batch_size=settings.inference_max_batch_size)
+    return classifier
+
+
+def get_probe_batches():
+    settings = get_settings()
+    tokenizer = get_tokenizer()
+    lengths = [MAX_SEQUENCE_LENGTH]
+    if settings.inference_dynamic_padding or InferenceMode(settings.inference_mode) == InferenceMode.COMPILED:
+        lengths = sorted(set(settings.inference_sequence_buckets + lengths))
+    return [tokenizer.encode(PROBE_SENTENCES, maxlen=length) for length in lengths]
+
+
+@lru_cache(maxsize=1)
+def get_model_registry():
+    settings = get_settings()
+    return ModelRegistry(load_inference_model, settings.model_version, probe=get_probe_batches)
+
+
+def get_local_inference_model():
+    return get_model_registry()
+
+
+@lru_cache(maxsize=1)
+def get_sidecar_classifier():
+    settings = get_settings()
+    return SidecarClassifier(settings.inference_sidecar_socket, fallback=get_local_inference_model)
+
+
+def get_inference_model():
+    settings = get_settings()
+    if settings.inference_sidecar_socket:
+        return get_sidecar_classifier()
+    # The same model is used for the whole request even if another version is swapped in meanwhile
+    return get_model_registry().current()
@@ -1,6 +1,7 @@
 import asyncio
+import time
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
@@ -9,10 +10,14 @@ from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
 from starlette.exceptions import HTTPException as StarletteHTTPException
 
-from app.database import get_db
-from app.routes import article, authentication, diary, example, user
+from app.database import get_db, get_fs, google_clients
+from app.dependencies import get_model_registry
+from app.routes import (article, authentication, diary, example, metrics,
+                        model, user)
 from app.schema.default_response import (HTTPErrorResponseTemplate,
                                          ResponseTemplate, error_reason)
+from app.services.model import start_model_sync
+from app.utils.metrics import collect_stage_timings, server_timing_header
 from app.utils.startup import (create_admin_account_if_not_exists,
                                create_test_account_if_not_exists,
                                generate_database_test, write_openapi_file)
@@ -24,6 +29,20 @@ app.include_router(diary.router)
 app.include_router(user.router)
 app.include_router(article.router)
 app.include_router(example.router)
+app.include_router(metrics.router)
+app.include_router(model.router)
+
+if get_settings().server_timing_header:
+    @app.middleware("http")
+    async def add_server_timing_header(request: Request, call_next):
+        if not request.url.path.startswith("/diaries"):
+            return await call_next(request)
+        start = time.perf_counter()
+        with collect_stage_timings() as timings:
+            response = await call_next(request)
+        timings["total"] = (time.perf_counter() - start) * 1000
+        response.headers["Server-Timing"] = server_timing_header(timings)
+        return response
 
 # CORS
 origins = [
@@ -89,6 +108,15 @@ async def startup():
     asyncio.create_task(create_admin_account_if_not_exists(settings, db))
     asyncio.create_task(create_test_account_if_not_exists(settings, db))
     asyncio.create_task(write_openapi_file(settings, app.openapi()))
+    # With the sidecar the model lives in the sidecar process, which syncs its own version
+    if settings.model_sync_interval_seconds > 0 and not settings.inference_sidecar_socket:
+        start_model_sync(get_model_registry(), next(get_fs()), settings.model_version,
+                         settings.model_sync_interval_seconds)
+
+
+@app.on_event("shutdown")
+def shutdown():
+    google_clients.close()
 
 
 @app.get("/", tags=["Health Check"], status_code=200, response_model=ResponseTemplate)
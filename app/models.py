@@ -2,7 +2,8 @@ import datetime
 import enum
 from uuid import uuid4
 
-from sqlalchemy import Boolean, Column, DateTime, Enum, ForeignKey, String
+from sqlalchemy import (Boolean, Column, DateTime, Enum, ForeignKey, String,
+                        Text)
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import relationship
@@ -67,3 +68,16 @@ class Session(Base):
         default=datetime.datetime.utcnow,
         onupdate=datetime.datetime.utcnow,
         nullable=False)
+
+
+class Translation(Base):
+    """Translate api results, shared by every worker as the second level of the translation cache"""
+    __tablename__ = "translation"
+
+    # sha256 of the target language and the source text
+    key = Column(String(64), primary_key=True)
+    target_language = Column(String, nullable=False)
+    translated_text = Column(Text, nullable=False)
+    detected_source_language = Column(String, nullable=True)
+    time_created = Column(DateTime(timezone=True), default=datetime.datetime.utcnow, nullable=False)
+    time_used = Column(DateTime(timezone=True), default=datetime.datetime.utcnow, nullable=False, index=True)
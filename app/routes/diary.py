@@ -1,43 +1,57 @@
 from typing import Optional
 from uuid import UUID
 
-from fastapi import APIRouter, Depends, HTTPException, Path, Query
+from fastapi import (APIRouter, Depends, Header, HTTPException, Path, Query,
+                     Response)
 from google.cloud.firestore import Client
 from google.cloud.translate_v2 import Client as TranslateClient
 from pydantic import parse_obj_as
 from sqlalchemy.orm import Session
 
-from app.database import get_db, get_fs, get_translate_client
-from app.dependencies import get_model, get_tokenizer
+from app.database import get_db, get_fs
+from app.dependencies import get_inference_model, get_tokenizer
 from app.models import UserRole
 from app.schema.authentication import AccessToken
 from app.schema.default_response import error_reason
 from app.schema.diary import (CreateDiaryBody, CreateDiaryResponse,
                               DeleteDiaryResponse, DiaryResponseWithoutUser,
                               DiaryResponseWithoutUserPlusArticles,
-                              EmotionCategory, GetAllDiaryResponse,
-                              GetEmotionSummaryResponse,
+                              DiaryStatus, EmotionCategory,
+                              GetAllDiaryResponse, GetEmotionSummaryResponse,
                               GetEmotionSummaryResponseData,
-                              GetOneDiaryResponse, UpdateDiaryBody,
+                              GetOneDiaryResponse, PagingMode, UpdateDiaryBody,
                               UpdateDiaryResponse)
 from app.services.article import get_all_articles
-from app.services.diary import (create_diary, delete_diary, get_all_diary,
-                                get_diary_by_id_or_error, get_emotion_summary,
-                                get_user_diary, update_diary)
+from app.services.diary import (classify_pending_diary, create_diary,
+                                create_pending_diary, delete_diary,
+                                get_all_diary, get_all_diary_page,
+                                get_classification_executor,
+                                get_diary_by_id_or_error, get_diary_etag,
+                                get_emotion_summary, get_user_diary,
+                                get_user_diary_page, update_diary)
+from app.services.translation import get_cached_translate_client
 from app.utils.depedencies import get_admin, get_current_user
 from config import get_settings
 
 router = APIRouter(prefix="/diaries",
                    tags=["Diary"])
 settings = get_settings()
+CURSOR_DESCRIPTION = "nextCursor of the previous page, the page after it is returned with cursor paging"
+PAGING_DESCRIPTION = ("cursor pages the diaries newest first with size and cursor, every page costs the same "
+                      "however deep it is. offset (the default) pages with page and size, without page it returns "
+                      "every diary")
 
 
 @ router.post("/",
-              description="Create new diary",
+              description="Create new diary. Send the header \"Prefer: respond-async\" to get 202 right after the "
+              "diary is saved, the emotion is classified in the background and the diary status is pending until then",
               status_code=201,
-              response_model=CreateDiaryResponse)
+              response_model=CreateDiaryResponse,
+              responses={202: {"model": CreateDiaryResponse,
+                               "description": "Diary is saved, poll GET /diaries/{diary_id} for the emotion"}})
 def create_diary_route(
         body: CreateDiaryBody,
+        response: Response,
         translate: Optional[bool] = Query(
             True,
             description="Set false for testing purposes only (so it can limit the translate cost)"),
@@ -47,9 +61,22 @@ def create_diary_route(
         fs: Client = Depends(get_fs),
         db: Session = Depends(get_db),
         tokenizer=Depends(get_tokenizer),
-        model=Depends(get_model),
-        translate_client: TranslateClient = Depends(get_translate_client),
-        current_user: AccessToken = Depends(get_current_user)):
+        model=Depends(get_inference_model),
+        translate_client: TranslateClient = Depends(get_cached_translate_client),
+        current_user: AccessToken = Depends(get_current_user),
+        prefer: Optional[str] = Header(None, description="respond-async to classify the emotion in the background")):
+    if prefer is not None and "respond-async" in prefer and emotion is None:
+        pending_diary = create_pending_diary(body, current_user.id, fs)
+        # The request client is closed after the response, the background task uses its own
+        get_classification_executor().submit(
+            classify_pending_diary, pending_diary, next(get_fs()), translate_client, tokenizer, model, translate)
+        response.status_code = 202
+        response.headers["Location"] = f"/diaries/{pending_diary.id}"
+        response.headers["Preference-Applied"] = "respond-async"
+        data = DiaryResponseWithoutUserPlusArticles(**pending_diary.dict(), articles=[])
+        return CreateDiaryResponse(
+            message="Create diary accepted, the emotion is classified in the background", data=data)
+
     saved_diary = create_diary(
         body,
         current_user.id,
@@ -74,12 +101,18 @@ def get_all_diary_route(page: Optional[int] = Query(None,
                         size: Optional[int] = Query(None,
                                                     gt=0,
                                                     description="The content size per page"),
-
+                        cursor: Optional[str] = Query(None, description=CURSOR_DESCRIPTION),
+                        paging: PagingMode = Query(PagingMode.OFFSET, description=PAGING_DESCRIPTION),
                         current_user: AccessToken = Depends(get_admin), fs: Client = Depends(get_fs)):
-    diaries = get_all_diary(page, size, fs)
+    next_cursor = None
+    # Only an explicit cursor switches to cursor paging, page and size keep their offset paging
+    if cursor is not None or paging == PagingMode.CURSOR:
+        diaries, next_cursor = get_all_diary_page(size or settings.diary_page_size, cursor, fs)
+    else:
+        diaries = get_all_diary(page, size, fs)
     diaries_response = parse_obj_as(list[DiaryResponseWithoutUser], diaries)
     response = GetAllDiaryResponse(
-        message="Successfully get all diaries in database", data=diaries_response)
+        message="Successfully get all diaries in database", data=diaries_response, next_cursor=next_cursor)
     return response
 
 
@@ -107,24 +140,36 @@ def get_user_diary_route(page: Optional[int] = Query(None,
                          size: Optional[int] = Query(None,
                                                      gt=0,
                                                      description="The content size per page"),
+                         cursor: Optional[str] = Query(None, description=CURSOR_DESCRIPTION),
+                         paging: PagingMode = Query(PagingMode.OFFSET, description=PAGING_DESCRIPTION),
                          current_user: AccessToken = Depends(get_current_user),
                          fs: Client = Depends(get_fs)):
-    diaries = get_user_diary(page, size, current_user.id, fs)
+    next_cursor = None
+    # Only an explicit cursor switches to cursor paging, page and size keep their offset paging
+    if cursor is not None or paging == PagingMode.CURSOR:
+        diaries, next_cursor = get_user_diary_page(size or settings.diary_page_size, cursor, current_user.id, fs)
+    else:
+        diaries = get_user_diary(page, size, current_user.id, fs)
     diaries_response = parse_obj_as(list[DiaryResponseWithoutUser], diaries)
     response = GetAllDiaryResponse(
-        message="Successfully get all diaries for user " + current_user.fullname, data=diaries_response)
+        message="Successfully get all diaries for user " + current_user.fullname, data=diaries_response,
+        next_cursor=next_cursor)
     return response
 
 
 @ router.get("/{diary_id}",
-             description="Get diaries by id",
+             description="Get diaries by id. The response has an ETag, send it back in If-None-Match to get 304 "
+             "while the diary did not change, like when polling a pending diary",
              status_code=200,
              response_model=GetOneDiaryResponse,
              response_model_exclude_unset=True,
-             responses={403: error_reason("The user id in bearer is not matching with path and the user is not admin")})
+             responses={304: {"description": "The diary did not change since the ETag in If-None-Match"},
+                        403: error_reason("The user id in bearer is not matching with path and the user is not admin")})
 def get_one_diary_route(
+        response: Response,
         diary_id: UUID = Path(...,
                               description="The diary id in UUID format"),
+        if_none_match: Optional[str] = Header(None, description="ETag of the diary the client already has"),
         current_user: AccessToken = Depends(get_current_user),
         fs: Client = Depends(get_fs)):
 
@@ -134,10 +179,16 @@ def get_one_diary_route(
         raise HTTPException(403, "You are not allowed do this action because you are not the owner of this diary.",
                             headers={"WWW-Authenticate": "Bearer"})
 
+    etag = get_diary_etag(diary)
+    if if_none_match is not None and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    if diary.status == DiaryStatus.PENDING.value:
+        response.headers["Retry-After"] = "1"
+
     data = DiaryResponseWithoutUser(**diary.dict())
-    response = GetOneDiaryResponse(
+    return GetOneDiaryResponse(
         message="Successfully get diary", data=data)
-    return response
 
 
 @ router.patch("/{diary_id}", description="Update diary data", status_code=201, response_model=UpdateDiaryResponse,
@@ -149,10 +200,10 @@ def update_diary_route(
             description="Set false for testing purposes only (so it can limit the translate cost)"),
         diary_id: UUID = Path(...,
                               description="The diary id in UUID format"),
-        translate_client: TranslateClient = Depends(get_translate_client),
+        translate_client: TranslateClient = Depends(get_cached_translate_client),
         current_user: AccessToken = Depends(get_current_user),
         tokenizer=Depends(get_tokenizer),
-        model=Depends(get_model),
+        model=Depends(get_inference_model),
         fs: Client = Depends(get_fs)):
 
     diary = get_diary_by_id_or_error(str(diary_id), fs)
@@ -162,7 +213,9 @@ def update_diary_route(
                             headers={"WWW-Authenticate": "Bearer"})
 
     updated_diary = update_diary(diary, body, fs, tokenizer, model, translate_client, translate)
-    articles = get_all_articles(fs, page=1, size=10, emotions=[updated_diary.emotion])
+    articles = []
+    if updated_diary.emotion is not None:
+        articles = get_all_articles(fs, page=1, size=10, emotions=[updated_diary.emotion])
 
     data = DiaryResponseWithoutUserPlusArticles(**updated_diary.dict(), articles=articles)
     response = UpdateDiaryResponse(
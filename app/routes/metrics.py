@@ -0,0 +1,33 @@
+from fastapi import APIRouter, Depends
+
+from app.schema.authentication import AccessToken
+from app.schema.default_response import error_reason
+from app.schema.metrics import GetMetricsResponse
+from app.utils.depedencies import get_admin
+from app.utils.metrics import STAGE_PREFIX, metrics
+
+router = APIRouter(prefix="/metrics",
+                   tags=["Metrics"])
+
+
+@ router.get("/",
+             description="Get the in-process metrics of the worker that serve this request",
+             status_code=200,
+             response_model=GetMetricsResponse,
+             responses={403: error_reason("Only user with role admin can access this resource.")})
+def get_metrics_route(current_user: AccessToken = Depends(get_admin)):
+    response = GetMetricsResponse(
+        message="Successfully get metrics", data=metrics.snapshot())
+    return response
+
+
+@ router.get("/stages",
+             description="Get the latency histograms of the translate and emotion prediction stages of the worker "
+             "that serve this request",
+             status_code=200,
+             response_model=GetMetricsResponse,
+             responses={403: error_reason("Only user with role admin can access this resource.")})
+def get_stage_metrics_route(current_user: AccessToken = Depends(get_admin)):
+    response = GetMetricsResponse(
+        message="Successfully get stage metrics", data=metrics.snapshot(prefix=STAGE_PREFIX))
+    return response
@@ -0,0 +1,63 @@
+from fastapi import APIRouter, Depends, HTTPException
+from google.cloud.firestore import Client
+
+from app.database import get_fs
+from app.dependencies import get_model_registry, list_model_versions
+from app.schema.authentication import AccessToken
+from app.schema.default_response import error_reason
+from app.schema.model import (GetModelResponse, ModelRegistryStatus,
+                              UpdateModelBody, UpdateModelResponse)
+from app.services.model import (get_model_workers, get_selected_model_version,
+                                report_model_worker, select_model_version)
+from app.utils.depedencies import get_admin
+from config import get_settings
+
+router = APIRouter(prefix="/models",
+                   tags=["Model"])
+settings = get_settings()
+
+
+def get_model_registry_status(fs: Client):
+    # Workers that missed a few checks in a row are most likely stopped
+    stale_after_seconds = max(settings.model_sync_interval_seconds * 3, 60)
+    return ModelRegistryStatus(
+        selected_version=get_selected_model_version(fs, settings.model_version),
+        available_versions=list_model_versions(),
+        workers=get_model_workers(fs, stale_after_seconds))
+
+
+@ router.get("/",
+             description="Get the selected model version and the version served by every worker",
+             status_code=200,
+             response_model=GetModelResponse,
+             responses={403: error_reason("Only user with role admin can access this resource.")})
+def get_model_route(current_user: AccessToken = Depends(get_admin), fs: Client = Depends(get_fs)):
+    if not settings.inference_sidecar_socket:
+        report_model_worker(get_model_registry(), fs)
+    response = GetModelResponse(
+        message="Successfully get model versions", data=get_model_registry_status(fs))
+    return response
+
+
+@ router.put("/",
+             description="Select the model version to serve, every worker loads it in the background and "
+             "swaps it in once it is warm",
+             status_code=202,
+             response_model=UpdateModelResponse,
+             responses={403: error_reason("Only user with role admin can access this resource."),
+                        404: error_reason("The model version is not found")})
+def update_model_route(body: UpdateModelBody,
+                       current_user: AccessToken = Depends(get_admin),
+                       fs: Client = Depends(get_fs)):
+    if body.version not in list_model_versions():
+        raise HTTPException(404, f"Model version {body.version} is not found")
+
+    select_model_version(body.version, fs)
+    # This worker starts right away, the others (and the sidecar) pick it up on their next check
+    if not settings.inference_sidecar_socket:
+        registry = get_model_registry()
+        registry.swap(body.version)
+        report_model_worker(registry, fs)
+    response = UpdateModelResponse(
+        message="Successfully select model version", data=get_model_registry_status(fs))
+    return response
@@ -8,6 +8,9 @@ from pydantic import Field
 from app.schema.default_response import ResponseTemplate
 from app.schema.user import UserResponse
 from app.utils.schema import TemplateModel, convert_enum_to_string
+from config import get_settings
+
+settings = get_settings()
 
 
 class EmotionCategory(enum.Enum):
@@ -19,6 +22,17 @@ class EmotionCategory(enum.Enum):
     SURPRISE = "surprise"
 
 
+class DiaryStatus(enum.Enum):
+    PENDING = "pending"
+    DONE = "done"
+    FAILED = "failed"
+
+
+class PagingMode(enum.Enum):
+    OFFSET = "offset"
+    CURSOR = "cursor"
+
+
 class ArticleLanguage(enum.Enum):
     ID = "id"
     EN = "en"
@@ -69,12 +83,20 @@ class BaseDiary(TemplateModel):
 
 class DiaryResponseBase(BaseDiary):
     id: str = Field(..., description="Diary id in UUID format")
-    translated_content: str = Field(...,
-                                    description="The diary content in english after translating with google translate")
-    emotion: EmotionCategory = Field(
+    translated_content: Optional[str] = Field(
         ...,
-        description="Diary emotion based on machine learning output, possible values: " +
+        description="The diary content in english after translating with google translate, null while pending")
+    emotion: Optional[EmotionCategory] = Field(
+        ...,
+        description="Diary emotion based on machine learning output, null while pending, possible values: " +
         convert_enum_to_string(EmotionCategory))
+    status: DiaryStatus = Field(
+        DiaryStatus.DONE.value,
+        description="Whether the emotion is classified yet, possible values: " + convert_enum_to_string(DiaryStatus))
+    emotion_scores: Optional[dict[str, float]] = Field(
+        None,
+        description="Mean probability of every emotion over the diary sentences, null if the emotion is not predicted",
+        example={"sadness": 0.05, "joy": 0.8, "anger": 0.05, "fear": 0.04, "love": 0.05, "surprise": 0.01})
     user_id: str = Field(..., description="The user id in UUID format that owns this diary")
     time_created: datetime = Field(..., description="The time this object is created, represented in ISO 8601 format",
                                    example="2022-05-12T14:30:28.304902+07:00")
@@ -109,11 +131,17 @@ class DiaryResponseWithoutUserPlusArticles(DiaryResponseWithoutUser):
 
 
 class DiaryDatabase(DiaryResponseBase):
-    pass
+    model_version: Optional[str] = Field(None, description="The version of the model that predicted the emotion")
+    detected_source_language: Optional[str] = Field(
+        None, description="Language of the content, from the translate api or the local language identifier")
+    needs_retranslation: bool = Field(
+        False, description="The translate api was not available, the emotion is predicted from the untranslated content")
+    translation_alignment: Optional[dict[str, str]] = Field(
+        None, description="Translation of every sentence of the content, by the key of the source sentence")
 
 
 class CreateDiaryBody(BaseDiary):
-    pass
+    content: str = Field(..., description="The diary content", max_length=settings.diary_content_max_length)
 
 
 class CreateDiaryResponse(ResponseTemplate):
@@ -122,6 +150,8 @@ class CreateDiaryResponse(ResponseTemplate):
 
 class GetAllDiaryResponse(ResponseTemplate):
     data: list[DiaryResponseWithoutUser]
+    next_cursor: Optional[str] = Field(
+        None, description="Send it back as cursor to get the next page, null on the last page and with offset paging")
 
 
 class GetOneDiaryResponse(ResponseTemplate):
@@ -130,7 +160,8 @@ class GetOneDiaryResponse(ResponseTemplate):
 
 class UpdateDiaryBody(CreateDiaryBody):
     title: Optional[str] = Field(None, description="The diary title")
-    content: Optional[str] = Field(None, description="The diary content")
+    content: Optional[str] = Field(None, description="The diary content",
+                                   max_length=settings.diary_content_max_length)
 
 
 class UpdateDiaryResponse(ResponseTemplate):
@@ -143,8 +174,12 @@ class DeleteDiaryResponse(ResponseTemplate):
 
 class TranslateResponse(TemplateModel):
     translated_text: str
-    detected_source_language: str
+    detected_source_language: Optional[str]
     input: str
+    # The translate api was not available, translated_text is the input itself
+    needs_retranslation: bool = False
+    # Translation of every sentence by the key of the source sentence, to reuse on the next edit
+    alignment: Optional[dict[str, str]] = None
 
 
 class GetAllArticleResponse(ResponseTemplate):
@@ -0,0 +1,7 @@
+from pydantic import Field
+
+from app.schema.default_response import ResponseTemplate
+
+
+class GetMetricsResponse(ResponseTemplate):
+    data: dict = Field(..., description="Counters, gauges and histograms collected by the worker that served this request")
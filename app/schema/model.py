@@ -0,0 +1,35 @@
+from datetime import datetime
+from typing import Optional
+
+from pydantic import Field
+
+from app.schema.default_response import ResponseTemplate
+from app.utils.schema import TemplateModel
+
+
+class ModelWorker(TemplateModel):
+    worker_id: str = Field(..., description="Host name and process id of the worker")
+    version: Optional[str] = Field(None, description="The model version this worker is serving, null if not loaded yet")
+    loaded_at: Optional[datetime] = Field(None, description="The time the served model was loaded")
+    loading_version: Optional[str] = Field(None, description="The model version being loaded in the background")
+    error: Optional[str] = Field(None, description="Why the last model swap failed")
+    time_updated: datetime = Field(..., description="The last time this worker reported its model")
+    stale: bool = Field(False, description="The worker has not reported for a while, it may be stopped")
+
+
+class ModelRegistryStatus(TemplateModel):
+    selected_version: str = Field(..., description="The model version every worker should serve")
+    available_versions: list[str] = Field(..., description="Model versions that can be selected")
+    workers: list[ModelWorker]
+
+
+class UpdateModelBody(TemplateModel):
+    version: str = Field(..., description="The model version to serve", example="default")
+
+
+class GetModelResponse(ResponseTemplate):
+    data: ModelRegistryStatus
+
+
+class UpdateModelResponse(ResponseTemplate):
+    data: ModelRegistryStatus
@@ -1,69 +1,428 @@
+import base64
 import enum
+import hashlib
 import html
+import json
 import os
 import pickle
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import lru_cache
+from itertools import groupby, islice
+from typing import Optional
 from uuid import uuid4
 
+import numpy as np
 import six
-import tensorflow as tf
+from cachetools import LRUCache
 from fastapi import HTTPException
+from google.api_core.exceptions import FailedPrecondition
 from google.cloud.firestore import Client
 from google.cloud.translate_v2 import Client as TranslateClient
-from keras.preprocessing.text import Tokenizer
-from tensorflow.keras.preprocessing.sequence import pad_sequences
 
-from app.schema.diary import (CreateDiaryBody, DiaryDatabase, EmotionCategory,
-                              TranslateResponse, UpdateDiaryBody)
+from app import logger
+from app.schema.diary import (CreateDiaryBody, DiaryDatabase, DiaryStatus,
+                              EmotionCategory, TranslateResponse,
+                              UpdateDiaryBody)
+from app.utils.classifier import masks_padding
 from app.utils.firestore import document_to_diary
-
-
-def translate_content(input: str, translate_client: TranslateClient, translate: bool, target_language: str = "en"):
+from app.utils.language import get_language_identifier
+from app.utils.metrics import metrics, timed
+from app.utils.resilience import Unavailable
+from app.utils.sequence import predict_by_bucket
+from app.utils.tokenizer import BatchTokenizer
+from config import get_settings
+
+settings = get_settings()
+MAX_SEQUENCE_LENGTH = 400
+DOCUMENT_ID = "__name__"
+SENTENCE_END = re.compile('[?.!]')
+# A sentence with its end marks and the whitespace after them
+TRANSLATION_SENTENCE = re.compile(r'[^?.!]+[?.!]*\s*|[?.!]+\s*')
+
+
+def iter_text_chunks(input: str, max_length: int):
+    """Cut a text into pieces of at most max_length characters, on a sentence end whenever possible"""
+    start = 0
+    while len(input) - start > max_length:
+        end = start + max_length
+        # The last sentence end (or whitespace) of the window keeps a sentence in one piece
+        cut = max((match.end() for match in SENTENCE_END.finditer(input, start, end)), default=-1)
+        if cut == -1:
+            cut = input.rfind(" ", start, end) + 1 or end
+        yield input[start:cut]
+        start = cut
+    yield input[start:]
+
+
+def pack_translate_requests(segments: list[str], max_segments: int, max_characters: int):
+    """Group the segment indices, in order, into as few translate requests as the limits allow"""
+    requests = []
+    request = []
+    characters = 0
+    for index, segment in enumerate(segments):
+        if request and (len(request) >= max_segments or characters + len(segment) > max_characters):
+            requests.append(request)
+            request = []
+            characters = 0
+        request.append(index)
+        characters += len(segment)
+    if request:
+        requests.append(request)
+    return requests
+
+
+def detect_untranslated(input: str, target_language: str):
+    """The response of a text the local language identifier is confident is already in the target language"""
+    if not settings.language_detection:
+        return None
+    with timed("detect_language"):
+        language, confidence = get_language_identifier().detect(input)
+    skip = language == target_language and confidence >= settings.language_detection_min_confidence
+    metrics.increment("translate.language_detection.skipped" if skip else "translate.language_detection.translated")
+    skipped = metrics.get_counter("translate.language_detection.skipped")
+    translated = metrics.get_counter("translate.language_detection.translated")
+    metrics.set_gauge("translate.language_detection.skip_rate", skipped / (skipped + translated))
+    if not skip:
+        return None
+    return TranslateResponse(translated_text=input, detected_source_language=language, input=input)
+
+
+def translate_texts(inputs: list[str], translate_client: TranslateClient, target_language: str = "en"):
+    """Translate many texts with as few api calls as possible, the responses are in the order of the inputs
+
+    A text the language identifier finds already in the target language is not sent at all. A text
+    longer than translate_chunk_length is sent as several segments on sentence ends and
+    joined back together, the segments of every text are packed into requests of at most
+    translate_batch_max_segments values and translate_batch_max_characters characters.
+    """
+    inputs = [input.decode("utf-8") if isinstance(input, six.binary_type) else input for input in inputs]
+    translate_responses = [detect_untranslated(input, target_language) for input in inputs]
+
+    segments = []
+    owners = []
+    for index, input in enumerate(inputs):
+        if translate_responses[index] is not None:
+            continue
+        for chunk in iter_text_chunks(input, settings.translate_chunk_length):
+            segments.append(chunk)
+            owners.append(index)
+
+    results = [None] * len(segments)
+    requests = pack_translate_requests(
+        segments, settings.translate_batch_max_segments, settings.translate_batch_max_characters)
+    for request in requests:
+        responses = translate_client.translate([segments[index] for index in request], target_language=target_language)
+        for index, response in zip(request, responses):
+            results[index] = response
+    metrics.increment("translate.requests", len(requests))
+    metrics.increment("translate.segments", len(segments))
+    metrics.increment("translate.characters", sum(len(segment) for segment in segments))
+
+    start = 0
+    for index, group in groupby(owners):
+        end = start + len(list(group))
+        texts = [html.unescape(result["translatedText"]) for result in results[start:end]]
+        translate_responses[index] = TranslateResponse(
+            translated_text=" ".join(text.strip() for text in texts) if len(texts) > 1 else texts[0],
+            detected_source_language=results[start]["detectedSourceLanguage"],
+            input=inputs[index])
+        start = end
+    return translate_responses
+
+
+def split_translation_sentences(input: str):
+    """The sentences of the text with their end marks and the whitespace after them, they join back into the text"""
+    return TRANSLATION_SENTENCE.findall(input)
+
+
+def get_sentence_key(sentence: str, target_language: str):
+    return hashlib.sha1(f"{target_language}\n{sentence}".encode("utf-8")).hexdigest()
+
+
+def translate_sentences(
+        input: str,
+        translate_client: TranslateClient,
+        target_language: str = "en",
+        alignment: Optional[dict[str, str]] = None):
+    """Translate the text sentence by sentence, only the sentences missing from the alignment reach the api
+
+    The alignment maps the key of every source sentence of the previous version of the text to its
+    translation, so an edit only sends its new or changed sentences. The language is detected per
+    sentence, a sentence in another language inside a text mostly in the target language is still
+    translated. The returned response has the alignment of this version.
+    """
+    pieces = split_translation_sentences(input)
+    sentences = [piece.strip() for piece in pieces]
+    sentences = [sentence for sentence in sentences if sentence]
+    keys = [get_sentence_key(sentence, target_language) for sentence in sentences]
+    alignment = alignment or {}
+    missing = {}
+    for key, sentence in zip(keys, sentences):
+        if key not in alignment:
+            missing.setdefault(key, sentence)
+
+    responses = translate_texts(list(missing.values()), translate_client, target_language)
+    translations = {key: alignment[key] for key in keys if key in alignment}
+    translations.update({key: response.translated_text for key, response in zip(missing, responses)})
+    metrics.increment("translate.sentences.reused", len(keys) - len(missing))
+    metrics.increment("translate.sentences.translated", len(missing))
+
+    # The language of the text is the first one that is not the target, the target if every sentence is in it
+    languages = [response.detected_source_language for response in responses]
+    detected_source_language = next((language for language in languages if language != target_language),
+                                    languages[0] if languages else None)
+    # Every translation takes the place of its sentence between the same whitespace, so the line breaks and
+    # paragraphs of the diary are kept
+    translated = iter([translations[key] for key in keys])
+    parts = []
+    for piece in pieces:
+        sentence = piece.strip()
+        start = piece.find(sentence)
+        parts.append(piece[:start] + next(translated) + piece[start + len(sentence):] if sentence else piece)
+    return TranslateResponse(
+        translated_text="".join(parts),
+        detected_source_language=detected_source_language,
+        input=input,
+        alignment=translations)
+
+
+def translate_content(
+        input: str,
+        translate_client: TranslateClient,
+        translate: bool,
+        target_language: str = "en",
+        alignment: Optional[dict[str, str]] = None):
     if isinstance(input, six.binary_type):
         input = input.decode("utf-8")
 
-    if translate:
-        response: dict = translate_client.translate(input, target_language="en")
-        translate_response = TranslateResponse(**response)
-        translate_response.translated_text = html.unescape(translate_response.translated_text)
-    else:
-        translate_response = TranslateResponse(
-            translated_text=input,
-            detected_source_language="id",
-            input=input)
+    with timed("translate"):
+        if translate:
+            try:
+                translate_response = translate_sentences(input, translate_client, target_language, alignment)
+            except Unavailable as e:
+                # The diary is still saved and classified, the re-translation job translates it later
+                logger.warning(f"Classifying an untranslated diary: {e}")
+                metrics.increment("translate.fallbacks")
+                translate_response = TranslateResponse(
+                    translated_text=input,
+                    detected_source_language=None,
+                    input=input,
+                    needs_retranslation=True,
+                    alignment=alignment)
+        else:
+            translate_response = TranslateResponse(
+                translated_text=input,
+                detected_source_language="id",
+                input=input)
     return translate_response
 
 
-def prediction(input: str, tokenizer, model) -> EmotionCategory:
-    arrayInput = re.split('[?.!]', input)
+# Output order of the model
+EMOTION_LABELS = [
+    EmotionCategory.SADNESS.value,
+    EmotionCategory.JOY.value,
+    EmotionCategory.FEAR.value,
+    EmotionCategory.ANGER.value,
+    EmotionCategory.LOVE.value,
+    EmotionCategory.SURPRISE.value]
+
+
+class EmotionTally:
+    """Running majority vote and probability sum, so the sentences can be predicted chunk by chunk"""
+
+    def __init__(self):
+        self.votes = np.zeros(len(EMOTION_LABELS), dtype="int64")
+        self.totals = np.zeros(len(EMOTION_LABELS), dtype="float64")
+        self.count = 0
+
+    def add(self, predictions: np.ndarray):
+        predictions = np.asarray(predictions)
+        self.votes += np.bincount(predictions.argmax(axis=1), minlength=len(EMOTION_LABELS))
+        self.totals += predictions.sum(axis=0, dtype="float64")
+        self.count += len(predictions)
+
+    def result(self):
+        # argmax returns the first maximum, so ties go to the emotion that comes first like before
+        emotion = EMOTION_LABELS[min(int(self.votes.argmax()), len(EMOTION_LABELS) - 1)]
+        scores = self.totals / self.count
+        emotion_scores = {label: float(score) for label, score in zip(EMOTION_LABELS, scores)}
+        return emotion, emotion_scores
+
+
+def aggregate_predictions(predictions: np.ndarray):
+    """Majority vote of the sentence labels plus the mean probability of every emotion"""
+    tally = EmotionTally()
+    tally.add(predictions)
+    return tally.result()
+
+
+def split_sentences(input: str):
+    return SENTENCE_END.split(input)
+
 
-    # Secara berurutan array dimulai dari kiri menghitung sad, joy, fear, love, surprise
-    emotionPrediction = [0, 0, 0, 0, 0, 0]
+def iter_sentences(input: str):
+    """Same sentences as split_sentences, without building the whole list"""
+    start = 0
+    for match in SENTENCE_END.finditer(input):
+        yield input[start:match.start()]
+        start = match.end()
+    yield input[start:]
 
-    tokenizedArrayInput = tokenizer.texts_to_sequences(arrayInput)
-    paddedInput = pad_sequences(tokenizedArrayInput, padding="post", truncating="post", maxlen=400)
 
-    predictions = model.predict(paddedInput)
+def predict_sentences(sentences: list[str], tokenizer: BatchTokenizer, model, dynamic_padding: bool):
+    if dynamic_padding:
+        # Each sentence is only padded up to its length bucket instead of the full maxlen
+        with timed("tokenize"):
+            tokenizedSentences = tokenizer.texts_to_sequences(sentences)
+        with timed("pad_and_predict"):
+            return predict_by_bucket(
+                model, tokenizedSentences, settings.inference_sequence_buckets, maxlen=MAX_SEQUENCE_LENGTH)
 
-    for prediction in predictions:
-        prediction = prediction.tolist()
-        maxIndex = prediction.index(max(prediction))
-        emotionPrediction[maxIndex] += 1
+    # texts_to_sequences and pad_sequences are one vectorized step of the batch tokenizer
+    with timed("tokenize_and_pad"):
+        paddedInput = tokenizer.encode(sentences, maxlen=MAX_SEQUENCE_LENGTH)
+    with timed("predict"):
+        return model.predict(paddedInput)
 
-    emotion = emotionPrediction.index(max(emotionPrediction))
-    if emotion == 0:
-        return EmotionCategory.SADNESS.value
-    elif emotion == 1:
-        return EmotionCategory.JOY.value
-    elif emotion == 2:
-        return EmotionCategory.FEAR.value
-    elif emotion == 3:
-        return EmotionCategory.ANGER.value
-    elif emotion == 4:
-        return EmotionCategory.LOVE.value
 
-    return EmotionCategory.SURPRISE.value
+def get_prediction_keys(sentences: list[str], tokenizer: BatchTokenizer, model_version: str):
+    """Model version and hash of the token ids of every sentence, only sentences the model can not tell apart match"""
+    ids, lengths = tokenizer.tokenize(sentences)
+    ends = np.cumsum(lengths)
+    return [(model_version, hashlib.sha1(ids[end - length:end].tobytes()).hexdigest())
+            for end, length in zip(ends.tolist(), lengths.tolist())]
+
+
+class PredictionCache:
+    """Probabilities of every emotion for a sentence, by model version and hash of its token ids"""
+
+    def __init__(self, max_sentences: int):
+        self._cache = LRUCache(maxsize=max_sentences)
+        self._lock = threading.Lock()
+
+    def get_many(self, keys: list):
+        with self._lock:
+            rows = [self._cache.get(key) for key in keys]
+        hits = sum(row is not None for row in rows)
+        metrics.increment("prediction_cache.hits", hits)
+        metrics.increment("prediction_cache.misses", len(rows) - hits)
+        return rows
+
+    def put_many(self, keys: list, rows: np.ndarray):
+        with self._lock:
+            for key, row in zip(keys, rows):
+                # A copy, so the cache does not keep the whole batch of predictions alive
+                self._cache[key] = np.array(row)
+            metrics.set_gauge("prediction_cache.sentences", self._cache.currsize)
+
+
+@lru_cache(maxsize=1)
+def get_prediction_cache():
+    return PredictionCache(settings.prediction_cache_max_sentences)
+
+
+def predict_cached_sentences(
+        sentences: list[str],
+        tokenizer: BatchTokenizer,
+        model,
+        dynamic_padding: bool,
+        cache: PredictionCache,
+        model_version: str):
+    """Same predictions as predict_sentences, only the sentences missing from the cache reach the model"""
+    keys = get_prediction_keys(sentences, tokenizer, model_version)
+    rows = cache.get_many(keys)
+    missing = {}
+    for index, (key, row) in enumerate(zip(keys, rows)):
+        if row is None:
+            missing.setdefault(key, []).append(index)
+
+    if missing:
+        predictions = predict_sentences([sentences[indices[0]] for indices in missing.values()],
+                                        tokenizer, model, dynamic_padding)
+        # The sidecar tells the version with every response, a swap meanwhile must not cache under the old one
+        if getattr(model, "version", None) == model_version:
+            cache.put_many(list(missing), predictions)
+        for row, indices in zip(predictions, missing.values()):
+            for index in indices:
+                rows[index] = row
+    return np.stack(rows)
+
+
+def predict_emotions(
+        inputs: list[str],
+        tokenizer: BatchTokenizer,
+        model,
+        dynamic_padding: bool = None,
+        chunk_sentences: int = None,
+        cache: PredictionCache = None):
+    """Predict many diaries with as few forward passes over all of their sentences as possible
+
+    The sentences are predicted chunk_sentences at a time and voted into a tally per diary, so a
+    very long diary never needs more than one chunk of padded rows and predictions in memory.
+    A sentence already predicted by the same model version comes from the prediction cache, a
+    model without a version is never cached.
+    """
+    if dynamic_padding is None:
+        # The votes of a model that does not mask the padding change with it, so it keeps the fixed padding
+        dynamic_padding = settings.inference_dynamic_padding and bool(masks_padding(model))
+    if chunk_sentences is None:
+        chunk_sentences = settings.prediction_chunk_sentences
+    model_version = getattr(model, "version", None)
+    if cache is None and settings.prediction_cache and model_version is not None:
+        cache = get_prediction_cache()
+
+    tallies = [EmotionTally() for _ in inputs]
+    pending = ((index, sentence) for index, input in enumerate(inputs) for sentence in iter_sentences(input))
+    while True:
+        with timed("split"):
+            chunk = list(islice(pending, chunk_sentences))
+        if not chunk:
+            break
+        owners, sentences = zip(*chunk)
+        if cache is not None and model_version is not None:
+            predictions = predict_cached_sentences(list(sentences), tokenizer, model, dynamic_padding,
+                                                   cache, model_version)
+        else:
+            predictions = predict_sentences(list(sentences), tokenizer, model, dynamic_padding)
+
+        with timed("vote"):
+            # The sentences of a diary are next to each other in the chunk
+            start = 0
+            for owner, rows in groupby(owners):
+                end = start + len(list(rows))
+                tallies[owner].add(predictions[start:end])
+                start = end
+    return [tally.result() for tally in tallies]
+
+
+def predict_emotion(
+        input: str,
+        tokenizer: BatchTokenizer,
+        model,
+        dynamic_padding: bool = None,
+        chunk_sentences: int = None,
+        cache: PredictionCache = None):
+    return predict_emotions([input], tokenizer, model, dynamic_padding, chunk_sentences, cache)[0]
+
+
+def prediction(input: str, tokenizer: BatchTokenizer, model, dynamic_padding: bool = None) -> EmotionCategory:
+    emotion, _ = predict_emotion(input, tokenizer, model, dynamic_padding)
+    return emotion
+
+
+def label_agreement(inputs: list[str], tokenizer: BatchTokenizer, reference_model, candidate_model):
+    """Fraction of the diaries that get the same emotion from both models, with the diaries that do not"""
+    disagreements = []
+    for input in inputs:
+        expected = prediction(input, tokenizer, reference_model)
+        actual = prediction(input, tokenizer, candidate_model)
+        if expected != actual:
+            disagreements.append((input, expected, actual))
+    return 1 - len(disagreements) / len(inputs), disagreements
 
 
 def create_diary(
@@ -78,8 +437,11 @@ def create_diary(
 
     translate_response = translate_content(input.content, translate_client, translate=translate)
 
+    emotion_scores = None
+    model_version = None
     if emotion is None:
-        emotion = prediction(translate_response.translated_text, tokenizer, model)
+        emotion, emotion_scores = predict_emotion(translate_response.translated_text, tokenizer, model)
+        model_version = getattr(model, "version", None)
 
     id = str(uuid4())
     time_created = datetime.now()
@@ -89,7 +451,12 @@ def create_diary(
         title=input.title,
         content=input.content,
         translated_content=translate_response.translated_text,
+        detected_source_language=translate_response.detected_source_language,
+        needs_retranslation=translate_response.needs_retranslation,
+        translation_alignment=translate_response.alignment,
         emotion=emotion,
+        emotion_scores=emotion_scores,
+        model_version=model_version,
         user_id=user_id,
         time_created=time_created,
         time_updated=time_updated)
@@ -97,6 +464,77 @@ def create_diary(
     return data
 
 
+def create_pending_diary(input: CreateDiaryBody, user_id: str, fs: Client):
+    """Save the diary without translation and emotion, `classify_pending_diary` fills them in later"""
+    id = str(uuid4())
+    time_created = datetime.now()
+    data = DiaryDatabase(
+        id=id,
+        title=input.title,
+        content=input.content,
+        translated_content=None,
+        emotion=None,
+        status=DiaryStatus.PENDING,
+        user_id=user_id,
+        time_created=time_created,
+        time_updated=time_created)
+    fs.collection('diary').document(id).set(data.dict(exclude={"id"}))
+    return data
+
+
+@lru_cache(maxsize=1)
+def get_classification_executor():
+    return ThreadPoolExecutor(max_workers=settings.diary_classification_workers,
+                              thread_name_prefix="diary-classification")
+
+
+def classify_pending_diary(
+        diary: DiaryDatabase,
+        fs: Client,
+        translate_client: TranslateClient,
+        tokenizer,
+        model,
+        translate: bool = True):
+    start = time.monotonic()
+    try:
+        translate_response = translate_content(diary.content, translate_client, translate=translate)
+        emotion, emotion_scores = predict_emotion(translate_response.translated_text, tokenizer, model)
+        data = {
+            "translated_content": translate_response.translated_text,
+            "detected_source_language": translate_response.detected_source_language,
+            "needs_retranslation": translate_response.needs_retranslation,
+            "translation_alignment": translate_response.alignment,
+            "emotion": emotion,
+            "emotion_scores": emotion_scores,
+            "model_version": getattr(model, "version", None),
+            "status": DiaryStatus.DONE.value}
+    except Exception:
+        logger.exception(f"Failed to classify diary {diary.id}")
+        metrics.increment("diary.classification.failed")
+        data = {"status": DiaryStatus.FAILED.value}
+
+    reference = fs.collection('diary').document(diary.id)
+    data["time_updated"] = datetime.now()
+    # A write between the read and the update (a title-only edit) only needs the diary read again
+    for attempt in range(2):
+        document = reference.get()
+        # A content edited (or a diary deleted) meanwhile is already handled by that request
+        if not document.exists or document.get("content") != diary.content:
+            break
+        try:
+            # Fails if the diary was written after the read above, so an edit is never overwritten
+            reference.update(data, option=fs.write_option(last_update_time=document.update_time))
+        except FailedPrecondition:
+            continue
+        metrics.observe("diary.classification.time_ms", (time.monotonic() - start) * 1000)
+        return
+    metrics.increment("diary.classification.stale")
+
+
+def get_diary_etag(diary: DiaryDatabase):
+    return '"' + hashlib.sha1(diary.json().encode("utf-8")).hexdigest() + '"'
+
+
 def get_all_diary(page: int, size: int, fs: Client):
     ref = fs.collection('diary').order_by("user_id").order_by(
         "time_created", "DESCENDING")
@@ -119,9 +557,52 @@ def get_user_diary(page: int, size: int, user_id: str, fs: Client):
     return diaries
 
 
+def encode_diary_cursor(document):
+    """Opaque cursor to the page after this document, it only holds the keys the pages are ordered by"""
+    cursor = json.dumps({"time_created": document.get("time_created").isoformat(), "id": document.id})
+    return base64.urlsafe_b64encode(cursor.encode("utf-8")).decode("ascii")
+
+
+def decode_diary_cursor(cursor: str):
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return datetime.fromisoformat(data["time_created"]), str(data["id"])
+    except (ValueError, TypeError, KeyError):
+        raise HTTPException(400, "The cursor is not valid, use the nextCursor of the previous page")
+
+
+def get_diary_page(collection, query, size: int, cursor: Optional[str]):
+    """One page of diaries after the cursor, with the cursor of the next page or None on the last page
+
+    The page starts right after the (time_created, id) of the cursor, so Firestore only reads the
+    documents of this page however deep it is, where an offset reads and bills every skipped one.
+    """
+    query = query.order_by("time_created", "DESCENDING").order_by(DOCUMENT_ID, "DESCENDING")
+    if cursor is not None:
+        time_created, id = decode_diary_cursor(cursor)
+        query = query.start_after({"time_created": time_created, DOCUMENT_ID: collection.document(id)})
+    # One more document tells whether there is a next page
+    documents = list(query.limit(size + 1).stream())
+    next_cursor = encode_diary_cursor(documents[size - 1]) if len(documents) > size else None
+    diaries = [document_to_diary(document) for document in documents[:size]]
+    return [diary for diary in diaries if diary is not None], next_cursor
+
+
+def get_all_diary_page(size: int, cursor: Optional[str], fs: Client):
+    collection = fs.collection('diary')
+    return get_diary_page(collection, collection, size, cursor)
+
+
+def get_user_diary_page(size: int, cursor: Optional[str], user_id: str, fs: Client):
+    collection = fs.collection('diary')
+    return get_diary_page(collection, collection.where("user_id", "==", user_id), size, cursor)
+
+
 def get_emotion_summary(diaries: list[DiaryDatabase]):
     emotion_freq = {}
     for diary in diaries:
+        if diary.emotion is None:
+            continue
         if diary.emotion not in emotion_freq:
             emotion_freq[diary.emotion] = 1
         else:
@@ -166,16 +647,41 @@ def update_diary(
         translate_client: TranslateClient,
         translate=True):
     data = body.dict(exclude_none=True)
+    # Only a new content needs the translate api and the model, a title-only update keeps the old result
+    content_changed = "content" in data and data["content"] != diary.content
 
     for key, value in data.items():
         setattr(diary, key, value)
 
-    translate_response = translate_content(diary.content, translate_client, translate=translate)
-    diary.emotion = prediction(translate_response.translated_text, tokenizer, model)
+    if content_changed:
+        # The sentences already in the previous alignment are not sent to the translate api again
+        translate_response = translate_content(diary.content, translate_client, translate=translate,
+                                               alignment=diary.translation_alignment)
+        diary.emotion, diary.emotion_scores = predict_emotion(translate_response.translated_text, tokenizer, model)
+        diary.translated_content = translate_response.translated_text
+        # An edit that only reuses sentences gets no language from the api, the previous one still holds
+        diary.detected_source_language = (translate_response.detected_source_language
+                                          or diary.detected_source_language)
+        diary.needs_retranslation = translate_response.needs_retranslation
+        diary.translation_alignment = translate_response.alignment
+        diary.model_version = getattr(model, "version", None)
+        diary.status = DiaryStatus.DONE.value
+        data["emotion"] = diary.emotion
+        data["emotion_scores"] = diary.emotion_scores
+        data["model_version"] = diary.model_version
+        data["status"] = diary.status
+        data["translated_content"] = diary.translated_content
+        data["detected_source_language"] = diary.detected_source_language
+        data["needs_retranslation"] = diary.needs_retranslation
+        data["translation_alignment"] = diary.translation_alignment
+        metrics.increment("diary.update.reclassified")
+    else:
+        metrics.increment("diary.update.reclassify_skipped")
+
     diary.time_updated = datetime.now()
-    diary.translated_content = translate_response.translated_text
+    data["time_updated"] = diary.time_updated
 
-    fs.collection('diary').document(diary.id).update(diary.dict(exclude={"id"}))
+    fs.collection('diary').document(diary.id).update(data)
     return diary
 
 
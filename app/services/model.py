@@ -0,0 +1,70 @@
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from google.cloud.firestore import Client
+
+from app import logger
+from app.schema.model import ModelWorker
+from app.utils.model_registry import ModelRegistry
+
+MODEL_COLLECTION = "models"
+SELECTED_MODEL_DOCUMENT = "selected"
+WORKER_COLLECTION = "model_workers"
+
+
+def get_worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def get_selected_model_version(fs: Client, default_version: str):
+    document = fs.collection(MODEL_COLLECTION).document(SELECTED_MODEL_DOCUMENT).get()
+    if not document.exists:
+        return default_version
+    return document.to_dict()["version"]
+
+
+def select_model_version(version: str, fs: Client):
+    fs.collection(MODEL_COLLECTION).document(SELECTED_MODEL_DOCUMENT).set({
+        "version": version,
+        "time_updated": datetime.now(timezone.utc)})
+
+
+def report_model_worker(registry: ModelRegistry, fs: Client):
+    data = ModelWorker(worker_id=get_worker_id(), time_updated=datetime.now(timezone.utc), **registry.status())
+    fs.collection(WORKER_COLLECTION).document(data.worker_id).set(data.dict(exclude={"worker_id", "stale"}))
+
+
+def sync_model_version(registry: ModelRegistry, fs: Client, default_version: str):
+    """Start loading the selected version if this worker serves another one, then report the worker"""
+    registry.swap(get_selected_model_version(fs, default_version))
+    report_model_worker(registry, fs)
+
+
+def get_model_workers(fs: Client, stale_after_seconds: float):
+    stale_before = datetime.now(timezone.utc) - timedelta(seconds=stale_after_seconds)
+    workers = []
+    for document in fs.collection(WORKER_COLLECTION).stream():
+        worker = ModelWorker(worker_id=document.id, **document.to_dict())
+        worker.stale = worker.time_updated < stale_before
+        workers.append(worker)
+    return sorted(workers, key=lambda worker: worker.worker_id)
+
+
+def start_model_sync(registry: ModelRegistry, fs: Client, default_version: str, interval_seconds: float):
+    # Report as soon as a swap is done instead of waiting for the next check
+    registry.listeners.append(lambda registry: report_model_worker(registry, fs))
+
+    def run():
+        while True:
+            try:
+                sync_model_version(registry, fs, default_version)
+            except Exception:
+                logger.exception("Failed to sync the model version")
+            time.sleep(interval_seconds)
+
+    thread = threading.Thread(target=run, name="model-sync", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,266 @@
+"""Re-run the emotion model over every stored diary, used after shipping a new model
+
+Documents are streamed from the `diary` collection in pages ordered by document id, the
+translated contents of a page are predicted in large batches and only the diaries whose
+emotion, scores or model version changed are written back with batched writes. The position is saved to a
+checkpoint file after every page so a stopped job resumes where it left off.
+
+`retranslate_diaries` is the job of the diaries classified untranslated while the translate api
+was not available, they are translated sentence by sentence and classified again in batches. `retry_pending_diaries`
+classifies the diaries the classification pool left pending (the worker died) or failed.
+"""
+import json
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+from google.api_core.exceptions import FailedPrecondition
+from google.cloud.firestore import Client
+from pydantic import BaseModel
+
+from app import logger
+from app.schema.diary import DiaryStatus
+from app.services.diary import (classify_pending_diary, predict_emotions,
+                                translate_content)
+from app.utils.firestore import document_to_diary
+
+DOCUMENT_ID = "__name__"
+# Firestore does not accept more than 500 writes in one batch
+MAX_BATCH_WRITES = 500
+SCORE_TOLERANCE = 1e-6
+
+
+class ReclassifyReport(BaseModel):
+    processed: int = 0
+    updated: int = 0
+    # Diaries edited between the read and the write, they keep the edit
+    stale: int = 0
+    invalid: int = 0
+    pages: int = 0
+    last_document_id: Optional[str] = None
+    elapsed_seconds: float = 0
+    finished: bool = False
+
+    @property
+    def documents_per_second(self):
+        return self.processed / self.elapsed_seconds if self.elapsed_seconds else 0.0
+
+
+def load_checkpoint(path: Optional[str]):
+    if path is None or not os.path.exists(path):
+        return ReclassifyReport()
+    return ReclassifyReport.parse_file(path)
+
+
+def save_checkpoint(path: Optional[str], report: ReclassifyReport):
+    if path is None:
+        return
+    # Write then rename, so a job killed in the middle never leaves a half written checkpoint
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "w") as f:
+        json.dump(report.dict(), f)
+    os.replace(temporary_path, path)
+
+
+def scores_changed(old: Optional[dict], new: dict):
+    if old is None or old.keys() != new.keys():
+        return True
+    return any(abs(old[label] - score) > SCORE_TOLERANCE for label, score in new.items())
+
+
+def commit_updates(fs: Client, updates: list[tuple], dry_run: bool = False):
+    """Write the (document snapshot, changed fields) in batches, return the number of stale ones skipped
+
+    Every write has a precondition on the update time of the snapshot, a diary the user edited
+    after it was read keeps its edit instead of getting the result computed from the old content.
+    """
+    if dry_run:
+        return 0
+    stale = 0
+    for start in range(0, len(updates), MAX_BATCH_WRITES):
+        chunk = updates[start:start + MAX_BATCH_WRITES]
+        batch = fs.batch()
+        for document, data in chunk:
+            batch.update(document.reference, data, option=fs.write_option(last_update_time=document.update_time))
+        try:
+            batch.commit()
+        except FailedPrecondition:
+            # The batch is atomic, write the diaries one by one so only the edited ones are skipped
+            for document, data in chunk:
+                try:
+                    document.reference.update(data, option=fs.write_option(last_update_time=document.update_time))
+                except FailedPrecondition:
+                    stale += 1
+    return stale
+
+
+def reclassify_page(documents: list, tokenizer, model, batch_size: int):
+    """Return the (document snapshot, changed fields) of the page and the number of invalid documents"""
+    diaries = []
+    for document in documents:
+        diary = document_to_diary(document)
+        if diary is not None and diary.translated_content is not None:
+            diaries.append((document, diary))
+
+    updates = []
+    model_version = getattr(model, "version", None)
+    for start in range(0, len(diaries), batch_size):
+        batch = diaries[start:start + batch_size]
+        results = predict_emotions([diary.translated_content for _, diary in batch], tokenizer, model)
+        for (document, diary), (emotion, emotion_scores) in zip(batch, results):
+            if diary.emotion != emotion or scores_changed(diary.emotion_scores, emotion_scores) or \
+                    diary.model_version != model_version:
+                # time_updated is left alone, the diary itself was not edited by the user
+                updates.append((document, {
+                    "emotion": emotion,
+                    "emotion_scores": emotion_scores,
+                    "model_version": model_version}))
+    # Pending and failed diaries are counted as invalid, retry_pending_diaries takes care of them
+    return updates, len(documents) - len(diaries)
+
+
+def reclassify_diaries(
+        fs: Client,
+        tokenizer,
+        model,
+        page_size: int = 500,
+        batch_size: int = 256,
+        checkpoint_path: str = None,
+        dry_run: bool = False,
+        max_pages: int = None):
+    report = load_checkpoint(checkpoint_path)
+    if report.finished:
+        logger.info(f"Checkpoint {checkpoint_path} is already finished, remove it to run the job again")
+        return report
+
+    collection = fs.collection('diary')
+    pages = 0
+    while max_pages is None or pages < max_pages:
+        started = time.perf_counter()
+        query = collection.order_by(DOCUMENT_ID).limit(page_size)
+        if report.last_document_id is not None:
+            query = query.start_after({DOCUMENT_ID: collection.document(report.last_document_id)})
+
+        documents = list(query.stream())
+        if not documents:
+            report.finished = True
+            save_checkpoint(checkpoint_path, report)
+            break
+
+        updates, invalid = reclassify_page(documents, tokenizer, model, batch_size)
+        stale = commit_updates(fs, updates, dry_run)
+
+        pages += 1
+        report.pages += 1
+        report.processed += len(documents)
+        report.updated += len(updates) - stale
+        report.stale += stale
+        report.invalid += invalid
+        report.last_document_id = documents[-1].id
+        report.elapsed_seconds += time.perf_counter() - started
+        save_checkpoint(checkpoint_path, report)
+        logger.info(f"Page {report.pages}: {report.processed} diaries processed, {report.updated} updated, "
+                    f"{report.documents_per_second:.1f} docs/sec")
+
+    return report
+
+
+def retranslate_diaries(fs: Client, translate_client, tokenizer, model, page_size: int = 100, max_pages: int = None):
+    report = ReclassifyReport()
+    query = fs.collection('diary').where("needs_retranslation", "==", True).limit(page_size)
+    model_version = getattr(model, "version", None)
+    while max_pages is None or report.pages < max_pages:
+        started = time.perf_counter()
+        documents = list(query.stream())
+        if not documents:
+            report.finished = True
+            break
+
+        diaries = []
+        updates = []
+        for document in documents:
+            diary = document_to_diary(document)
+            if diary is None:
+                # Clear the flag anyway, otherwise the job reads this document forever
+                updates.append((document, {"needs_retranslation": False}))
+            else:
+                diaries.append((document, diary))
+
+        translate_responses = []
+        for _, diary in diaries:
+            # Only the sentences missing from the alignment of the diary reach the translate api
+            response = translate_content(diary.content, translate_client, translate=True,
+                                         alignment=diary.translation_alignment)
+            if response.needs_retranslation:
+                break
+            translate_responses.append(response)
+        if len(translate_responses) < len(diaries):
+            logger.warning("Stopping the re-translation, the translate api is still not available")
+            break
+        results = predict_emotions([response.translated_text for response in translate_responses], tokenizer, model)
+        for (document, _), response, (emotion, emotion_scores) in zip(diaries, translate_responses, results):
+            updates.append((document, {
+                "translated_content": response.translated_text,
+                "detected_source_language": response.detected_source_language,
+                "needs_retranslation": False,
+                "translation_alignment": response.alignment,
+                "emotion": emotion,
+                "emotion_scores": emotion_scores,
+                "model_version": model_version}))
+        stale = commit_updates(fs, updates)
+
+        report.pages += 1
+        report.processed += len(documents)
+        report.updated += len(diaries) - stale
+        report.stale += stale
+        report.invalid += len(documents) - len(diaries)
+        report.last_document_id = documents[-1].id
+        report.elapsed_seconds += time.perf_counter() - started
+        logger.info(f"Page {report.pages}: {report.updated} diaries re-translated")
+    return report
+
+
+def retry_pending_diaries(
+        fs: Client,
+        translate_client,
+        tokenizer,
+        model,
+        older_than_minutes: float = 10,
+        page_size: int = 100,
+        max_pages: int = None):
+    """Classify the pending and failed diaries not updated for older_than_minutes
+
+    A diary stays pending when the worker classifying it in the background died, and failed when
+    its classification raised. The recent ones are left alone, their worker may still be on them.
+    """
+    report = ReclassifyReport()
+    collection = fs.collection('diary')
+    query = collection.where("status", "in", [DiaryStatus.PENDING.value, DiaryStatus.FAILED.value]).order_by(
+        DOCUMENT_ID).limit(page_size)
+    # Diaries are saved with naive local times, Firestore gives them back with a utc timezone
+    cutoff = datetime.now() - timedelta(minutes=older_than_minutes)
+    while max_pages is None or report.pages < max_pages:
+        started = time.perf_counter()
+        page = query
+        if report.last_document_id is not None:
+            page = query.start_after({DOCUMENT_ID: collection.document(report.last_document_id)})
+        documents = list(page.stream())
+        if not documents:
+            report.finished = True
+            break
+
+        for document in documents:
+            diary = document_to_diary(document)
+            if diary is None:
+                report.invalid += 1
+            elif diary.time_updated.replace(tzinfo=None) <= cutoff:
+                classify_pending_diary(diary, fs, translate_client, tokenizer, model)
+                report.updated += 1
+
+        report.pages += 1
+        report.processed += len(documents)
+        report.last_document_id = documents[-1].id
+        report.elapsed_seconds += time.perf_counter() - started
+        logger.info(f"Page {report.pages}: {report.updated} pending or failed diaries classified")
+    return report
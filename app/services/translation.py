@@ -0,0 +1,210 @@
+"""Two level cache in front of the translate api
+
+The first level is a least recently used cache in the memory of every worker, bounded by the
+characters of translated text it holds. The second level is the `translation` table shared by
+every worker, bounded by its number of rows. Both are keyed by a hash of the target language and
+the source text, so re-saved diaries, retries and duplicated sentences are translated only once.
+A translate call reads the table once and writes it once for all of its texts.
+The calls that miss both levels go through the deadline, hedging and circuit breaker of
+app/utils/resilience.py.
+"""
+import hashlib
+import threading
+from datetime import datetime
+from functools import lru_cache
+from typing import Optional, Union
+
+from cachetools import LRUCache
+from fastapi import Depends
+from google.cloud.translate_v2 import Client as TranslateClient
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import SQLAlchemyError
+
+from app import logger
+from app.database import SessionLocal, get_translate_client
+from app.models import Translation
+from app.utils.metrics import metrics
+from app.utils.resilience import CircuitBreaker, ResilientCaller
+from config import get_settings
+
+settings = get_settings()
+
+
+def get_translation_key(text: str, target_language: str):
+    return hashlib.sha256(f"{target_language}\n{text}".encode("utf-8")).hexdigest()
+
+
+class MemoryTranslationCache(LRUCache):
+    def __init__(self, max_characters: int):
+        super().__init__(maxsize=max_characters, getsizeof=lambda value: max(len(value["translatedText"]), 1))
+
+    def popitem(self):
+        item = super().popitem()
+        metrics.increment("translation_cache.memory.evictions")
+        return item
+
+
+class TranslationCache:
+    def __init__(self, session_factory, max_characters: int, max_rows: int, eviction_interval: int = 100):
+        self.session_factory = session_factory
+        self.max_rows = max_rows
+        self.eviction_interval = eviction_interval
+        self._memory = MemoryTranslationCache(max_characters)
+        self._lock = threading.Lock()
+        self._inserts = 0
+
+    def get_many(self, texts: list[str], target_language: str) -> list[Optional[dict]]:
+        """The cached results of the texts, None for a miss, with one database round trip for all of them"""
+        keys = [get_translation_key(text, target_language) for text in texts]
+        with self._lock:
+            found = {key: self._memory[key] for key in set(keys) if key in self._memory}
+        missing = [key for key in dict.fromkeys(keys) if key not in found]
+        memory_misses = sum(key not in found for key in keys)
+        metrics.increment("translation_cache.memory.hits", len(keys) - memory_misses)
+        metrics.increment("translation_cache.memory.misses", memory_misses)
+
+        if missing:
+            rows = {}
+            try:
+                with self.session_factory() as session:
+                    for translation in session.query(Translation).filter(Translation.key.in_(missing)):
+                        rows[translation.key] = {
+                            "translatedText": translation.translated_text,
+                            "detectedSourceLanguage": translation.detected_source_language}
+                    if rows:
+                        session.query(Translation).filter(Translation.key.in_(list(rows))).update(
+                            {Translation.time_used: datetime.utcnow()}, synchronize_session=False)
+                        session.commit()
+            except SQLAlchemyError:
+                # The database only saves translate calls, a failing one must not fail the diary
+                logger.exception("Failed to read the translation cache")
+                metrics.increment("translation_cache.database.errors")
+            metrics.increment("translation_cache.database.hits", len(rows))
+            metrics.increment("translation_cache.database.misses", len(missing) - len(rows))
+            for key, value in rows.items():
+                self._remember(key, value)
+            found.update(rows)
+
+        return [{**found[key], "input": text} if key in found else None for key, text in zip(keys, texts)]
+
+    def put_many(self, texts: list[str], target_language: str, results: list[dict]):
+        """Save the results of the texts with a single upsert"""
+        values = {}
+        for text, result in zip(texts, results):
+            key = get_translation_key(text, target_language)
+            value = {
+                "translatedText": result["translatedText"],
+                "detectedSourceLanguage": result.get("detectedSourceLanguage")}
+            self._remember(key, value)
+            values[key] = value
+        if not values:
+            return
+
+        now = datetime.utcnow()
+        statement = insert(Translation).values([{
+            "key": key,
+            "target_language": target_language,
+            "translated_text": value["translatedText"],
+            "detected_source_language": value["detectedSourceLanguage"],
+            "time_created": now,
+            "time_used": now} for key, value in values.items()])
+        # Another worker can insert the same text at the same time, both have the same translation
+        statement = statement.on_conflict_do_update(index_elements=[Translation.key], set_={
+            "translated_text": statement.excluded.translated_text,
+            "detected_source_language": statement.excluded.detected_source_language,
+            "time_used": statement.excluded.time_used})
+        try:
+            with self.session_factory() as session:
+                session.execute(statement)
+                session.commit()
+                with self._lock:
+                    previous = self._inserts
+                    self._inserts += len(values)
+                    evict = previous // self.eviction_interval != self._inserts // self.eviction_interval
+                if evict:
+                    self.evict(session)
+        except SQLAlchemyError:
+            logger.exception("Failed to save into the translation cache")
+            metrics.increment("translation_cache.database.errors")
+
+    def evict(self, session):
+        """Delete the least recently used rows over max_rows"""
+        cutoff = session.query(Translation.time_used).order_by(
+            Translation.time_used.desc()).offset(self.max_rows).limit(1).scalar()
+        if cutoff is None:
+            return 0
+        deleted = session.query(Translation).filter(Translation.time_used <= cutoff).delete(synchronize_session=False)
+        session.commit()
+        metrics.increment("translation_cache.database.evictions", deleted)
+        return deleted
+
+    def _remember(self, key: str, value: dict):
+        with self._lock:
+            try:
+                self._memory[key] = value
+            except ValueError:
+                # A single translation larger than the whole memory cache only goes to the database
+                pass
+            metrics.set_gauge("translation_cache.memory.characters", self._memory.currsize)
+
+
+class CachedTranslateClient:
+    """Same `translate` interface as the translate client it wraps, only the uncached texts reach the api"""
+
+    def __init__(self, client: TranslateClient, cache: TranslationCache):
+        self.client = client
+        self.cache = cache
+
+    def translate(self, values: Union[str, list[str]], target_language: str = None, **kwargs):
+        single = isinstance(values, str)
+        texts = [values] if single else list(values)
+        target_language = target_language or "en"
+
+        results = self.cache.get_many(texts, target_language)
+        missing = [index for index, result in enumerate(results) if result is None]
+        if missing:
+            responses = self.client.translate([texts[index] for index in missing],
+                                              target_language=target_language, **kwargs)
+            self.cache.put_many([texts[index] for index in missing], target_language, responses)
+            for index, response in zip(missing, responses):
+                results[index] = response
+        return results[0] if single else results
+
+
+class ResilientTranslateClient:
+    """Same `translate` interface, every call has a deadline, can be hedged and goes through the circuit breaker
+
+    Raises `Unavailable` instead of waiting on a stalled api, `translate_content` then falls back
+    to the untranslated text.
+    """
+
+    def __init__(self, client: TranslateClient, caller: ResilientCaller):
+        self.client = client
+        self.caller = caller
+
+    def translate(self, values: Union[str, list[str]], target_language: str = None, **kwargs):
+        return self.caller.call(self.client.translate, values, target_language=target_language, **kwargs)
+
+
+@lru_cache(maxsize=1)
+def get_translate_caller():
+    breaker = CircuitBreaker("translate", settings.translate_breaker_failures, settings.translate_breaker_reset_seconds)
+    return ResilientCaller("translate", settings.translate_deadline_seconds, breaker,
+                           hedge_percentile=settings.translate_hedge_percentile,
+                           max_workers=settings.translate_max_concurrency)
+
+
+def get_resilient_translate_client(translate_client: TranslateClient = Depends(get_translate_client)):
+    return ResilientTranslateClient(translate_client, get_translate_caller())
+
+
+@lru_cache(maxsize=1)
+def get_translation_cache():
+    return TranslationCache(SessionLocal, settings.translation_cache_memory_characters,
+                            settings.translation_cache_max_rows, settings.translation_cache_eviction_interval)
+
+
+def get_cached_translate_client(translate_client: TranslateClient = Depends(get_resilient_translate_client)):
+    if not settings.translation_cache:
+        return translate_client
+    return CachedTranslateClient(translate_client, get_translation_cache())
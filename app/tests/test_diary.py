@@ -1,7 +1,17 @@
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
 from essential_generators import DocumentGenerator
 from fastapi.testclient import TestClient
 
+from app.dependencies import get_tokenizer
 from app.schema.diary import EmotionCategory
+from app.services.diary import (EMOTION_LABELS, classify_pending_diary,
+                                get_all_diary_page, get_diary_by_id,
+                                get_user_diary, get_user_diary_page)
+from app.utils.fake_firestore import FakeFirestore
+from app.utils.fake_translate import FakeTranslateClient
 from app.utils.test import (DIARY_RESPONSE_KEYS,
                             decrypt_access_token_without_verification,
                             have_base_templates, have_correct_data_properties,
@@ -133,6 +143,8 @@ async def test_create_translated_diaries_admin(test_db, admin_token, client: Tes
     assert data["content"] == data["content"]
     assert data["translatedContent"] == "I'm so mad at my friend"
     assert data["emotion"] == "anger"
+    assert set(data["emotionScores"]) == {e.value for e in EmotionCategory}
+    assert max(data["emotionScores"], key=data["emotionScores"].get) == "anger"
     assert isinstance(data["articles"], list)
     assert len(data["articles"]) > 0
     for article in data["articles"]:
@@ -143,19 +155,163 @@ async def test_create_translated_diaries_admin(test_db, admin_token, client: Tes
     translated_diaries.append(data)
 
 
+async def test_create_diary_async_admin(test_db, admin_token, client: TestClient):
+    body = {
+        "title": main.sentence(),
+        "content": "I am so happy today. I passed the exam"
+    }
+    headers = {"Authorization": "bearer " + admin_token}
+    response = client.post(f"/diaries/", headers={**headers, "Prefer": "respond-async"}, json=body,
+                           params={"translate": False})
+    have_correct_status_and_message(response, 202, "create diary")
+    have_minimum_data_properties(response, DIARY_RESPONSE_KEYS)
+    data = response.json()["data"]
+    assert data["status"] == "pending"
+    assert data["emotion"] is None
+    assert data["articles"] == []
+    assert response.headers["location"] == f"/diaries/{data['id']}"
+
+    etag = None
+    for _ in range(100):
+        response = client.get(f"/diaries/{data['id']}", headers={**headers, "If-None-Match": etag or ""})
+        if response.status_code == 304:
+            time.sleep(0.2)
+            continue
+        have_correct_status(response, 200)
+        etag = response.headers["etag"]
+        if response.json()["data"]["status"] != "pending":
+            break
+        time.sleep(0.2)
+
+    data = response.json()["data"]
+    assert data["status"] == "done"
+    assert data["emotion"] in [e.value for e in EmotionCategory]
+    assert data["translatedContent"] == body["content"]
+
+    response = client.get(f"/diaries/{data['id']}", headers={**headers, "If-None-Match": etag})
+    have_correct_status(response, 304)
+
+    diaries.append(data)
+    admin_diaries.append(data)
+
+
 async def test_get_all_diaries(test_db, admin_token, client: TestClient):
     response = client.get("/diaries/all", headers={"Authorization": "bearer " + admin_token})
     resp = response.json()
     print(resp)
 
     assert isinstance(resp["data"], list)
-    common_var["many_diary"] = len(resp["data"]) - (DIARY_COUNT * 2 + 1)
+    common_var["many_diary"] = len(resp["data"]) - (DIARY_COUNT * 2 + 2)
 
     have_base_templates(response)
     have_data_list_with_exact_properties(response, DIARY_RESPONSE_KEYS)
     have_correct_status_and_message(response, 200, "get all diaries")
 
 
+async def test_get_all_diaries_cursor(test_db, admin_token, client: TestClient):
+    headers = {"Authorization": "bearer " + admin_token}
+    # A size without page keeps returning every diary like before the cursor paging
+    response = client.get("/diaries/all", headers=headers, params={"size": 1})
+    have_correct_status(response, 200)
+    assert len(response.json()["data"]) > 1
+    assert response.json()["nextCursor"] is None
+
+    response = client.get("/diaries/all", headers=headers, params={"size": 1, "paging": "cursor"})
+    have_correct_status_and_message(response, 200, "get all diaries")
+    resp = response.json()
+    assert len(resp["data"]) == 1
+    assert resp["nextCursor"] is not None
+
+    response = client.get("/diaries/all", headers=headers, params={"size": 1, "cursor": resp["nextCursor"]})
+    have_correct_status(response, 200)
+    assert response.json()["data"][0]["id"] != resp["data"][0]["id"]
+
+    response = client.get("/diaries/all", headers=headers, params={"cursor": "not a cursor"})
+    have_correct_status(response, 400)
+    have_error_message(response)
+
+
+async def test_cursor_pages_read_only_their_diaries():
+    fs = FakeFirestore()
+    time_created = datetime(2022, 5, 12)
+    for i in range(30):
+        # Every other diary has the same time as the previous one, the id breaks the tie
+        fs.collection('diary').document(f"diary-{i:03d}").set({
+            "title": f"Diary {i}",
+            "content": "Aku senang hari ini",
+            "translated_content": "I happy day this",
+            "emotion": "joy",
+            "user_id": "user" if i % 3 else "other",
+            "time_created": time_created - timedelta(minutes=i // 2),
+            "time_updated": time_created})
+
+    ids = []
+    cursor = None
+    while True:
+        fs.reads = 0
+        diaries, cursor = get_user_diary_page(4, cursor, "user", fs)
+        assert fs.reads <= 5
+        ids += [diary.id for diary in diaries]
+        if cursor is None:
+            break
+    assert ids == [diary.id for diary in get_user_diary(None, None, "user", fs)]
+    assert len(ids) == len(set(ids)) == 20
+
+    diaries, cursor = get_all_diary_page(30, None, fs)
+    assert len(diaries) == 30
+    assert cursor is None
+
+
+class TitleEditFirestore(FakeFirestore):
+    """A title-only edit lands between the read and the write of the background classification"""
+
+    def __init__(self, edits: int):
+        super().__init__()
+        self.edits = edits
+
+    def write_option(self, last_update_time: datetime):
+        if self.edits:
+            self.edits -= 1
+            self.collection('diary').document("diary").update({"title": "Edited title"})
+        return super().write_option(last_update_time)
+
+
+class FirstEmotionModel:
+    def predict(self, inputs: np.ndarray):
+        return np.eye(len(EMOTION_LABELS), dtype="float32")[[0] * len(inputs)]
+
+
+async def test_classify_pending_diary_after_title_edit():
+    for edits, status in [(1, "done"), (2, "pending")]:
+        fs = TitleEditFirestore(edits)
+        fs.collection('diary').document("diary").set({
+            "title": "Diary",
+            "content": "Aku senang hari ini",
+            "translated_content": None,
+            "emotion": None,
+            "status": "pending",
+            "user_id": "user",
+            "time_created": datetime.now(),
+            "time_updated": datetime.now()})
+        classify_pending_diary(get_diary_by_id("diary", fs), fs, FakeTranslateClient(), get_tokenizer(),
+                               FirstEmotionModel())
+        # The edit is kept, the classification is written on the next try unless the diary keeps changing
+        data = fs.collection('diary').document("diary").get().to_dict()
+        assert data["title"] == "Edited title"
+        assert data["status"] == status
+
+
+async def test_error_create_diary_too_long(test_db, user_token, client: TestClient):
+    data = {
+        "title": main.sentence(),
+        "content": "a" * (settings.diary_content_max_length + 1)
+    }
+    response = client.post("/diaries", headers={"Authorization": "bearer " + user_token},
+                           params={"translate": False}, json=data)
+    have_correct_status(response, 400)
+    have_error_message(response)
+
+
 async def test_error_get_all_diaries_without_admin(test_db, user_token, client: TestClient):
     response = client.get("/diaries/all")
     resp = response.json()
@@ -331,6 +487,32 @@ async def test_update_translated_diary_admin(test_db, admin_token, user_token, c
     have_minimum_data_properties(response, DIARY_RESPONSE_KEYS)
 
 
+async def test_update_title_only_keep_emotion(test_db, admin_token, client: TestClient):
+    diary = translated_diaries[0]
+    response = client.get(f"/diaries/{diary['id']}", headers={"Authorization": "bearer " + admin_token})
+    before = response.json()["data"]
+
+    new_title = "My renamed diary"
+    response = client.patch(
+        f"/diaries/{diary['id']}",
+        headers={
+            "Authorization": "bearer " +
+            admin_token},
+        json={"title": new_title})
+    resp = response.json()
+    print(resp)
+    have_correct_status_and_message(response, 201, "update diary")
+    assert resp["data"]["title"] == new_title
+    assert resp["data"]["content"] == before["content"]
+    assert resp["data"]["translatedContent"] == before["translatedContent"]
+    assert resp["data"]["emotion"] == before["emotion"]
+
+    response = client.get(f"/diaries/{diary['id']}", headers={"Authorization": "bearer " + admin_token})
+    resp = response.json()
+    assert resp["data"]["title"] == new_title
+    assert resp["data"]["translatedContent"] == before["translatedContent"]
+
+
 async def test_update_diary_forbidden(test_db, user_token, client: TestClient):
     decrypt_access_token_without_verification(user_token)
     for diary in admin_diaries:
@@ -1,8 +1,37 @@
+import os
+
 from fastapi.testclient import TestClient
 
+from app.database import ClientRegistry
+from app.utils.metrics import metrics
+
 
 async def test_health_check(client: TestClient):
     response = client.get("/")
     assert response.status_code == 200
     assert response.json() == {
         "message": "Server is ok", "data": None}
+
+
+async def test_client_registry_reuse_and_fork():
+    registry = ClientRegistry({"test_client": object})
+    first = registry.get("test_client")
+    assert registry.get("test_client") is first
+    assert metrics.get_counter("google_clients.test_client.created") == 1
+    assert metrics.get_counter("google_clients.test_client.reused") == 1
+
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        # A forked worker creates its own client instead of using the one of the parent, counted apart
+        client = registry.get("test_client")
+        rebuilt = (client is not first and
+                   metrics.get_counter("google_clients.test_client.rebuilt_after_fork") == 1 and
+                   metrics.get_counter("google_clients.test_client.created") == 1 and
+                   metrics.get_counter("google_clients.test_client.reused") == 1)
+        os.write(write, b"1" if rebuilt and registry.get("test_client") is client else b"0")
+        os._exit(0)
+    os.waitpid(pid, 0)
+    assert os.read(read, 1) == b"1"
+    assert registry.get("test_client") is first
+    assert metrics.get_counter("google_clients.test_client.reused") == 2
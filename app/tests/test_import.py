@@ -0,0 +1,25 @@
+import json
+import subprocess
+import sys
+
+IMPORT_TIME_BUDGET_SECONDS = 5
+IMPORT_APP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import app.main
+print(json.dumps({
+    "seconds": time.perf_counter() - start,
+    "eager_modules": [m for m in ("tensorflow", "keras") if m in sys.modules]}))
+"""
+
+
+def import_app_in_new_process():
+    # A fresh interpreter is needed because this test session may have imported tensorflow already
+    output = subprocess.run([sys.executable, "-c", IMPORT_APP_SCRIPT], capture_output=True, text=True, check=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+async def test_import_app_without_tensorflow():
+    result = import_app_in_new_process()
+    assert result["eager_modules"] == []
+    assert result["seconds"] < IMPORT_TIME_BUDGET_SECONDS
@@ -0,0 +1,131 @@
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from fastapi.testclient import TestClient
+
+from app.dependencies import get_tokenizer
+from app.services.diary import EMOTION_LABELS, prediction
+from app.utils.batching import MicroBatcher
+from app.utils.metrics import (collect_stage_timings, metrics,
+                               server_timing_header, timed)
+from app.utils.test import (have_base_templates, have_correct_status,
+                            have_correct_status_and_message,
+                            have_error_message)
+
+
+class UniformModel:
+    def predict(self, inputs: np.ndarray):
+        return np.full((len(inputs), len(EMOTION_LABELS)), 1 / len(EMOTION_LABELS), dtype="float32")
+
+
+def run_timed(stage: str):
+    with timed(stage):
+        pass
+
+
+class CountingModel:
+    def __init__(self):
+        self.calls = 0
+
+    def predict(self, inputs: np.ndarray):
+        self.calls += 1
+        return inputs.sum(axis=1, keepdims=True).astype("float32")
+
+
+async def test_get_metrics_admin(test_db, admin_token, client: TestClient):
+    response = client.get("/metrics", headers={"Authorization": "bearer " + admin_token})
+    have_correct_status_and_message(response, 200, "get metrics")
+    have_base_templates(response)
+    data = response.json()["data"]
+    assert "counters" in data
+    assert "histograms" in data
+
+
+async def test_error_get_metrics_without_admin(test_db, user_token, client: TestClient):
+    response = client.get("/metrics")
+    have_correct_status(response, 401)
+    have_error_message(response)
+
+    response = client.get("/metrics", headers={"Authorization": "bearer " + user_token})
+    have_correct_status(response, 403)
+    have_error_message(response)
+
+
+async def test_get_stage_metrics_admin(test_db, admin_token, client: TestClient):
+    prediction("I am happy. I am sad", get_tokenizer(), UniformModel(), dynamic_padding=False)
+    response = client.get("/metrics/stages", headers={"Authorization": "bearer " + admin_token})
+    have_correct_status_and_message(response, 200, "get stage metrics")
+    histograms = response.json()["data"]["histograms"]
+    for stage in ["split", "tokenize_and_pad", "predict", "vote"]:
+        assert histograms[f"stage.{stage}_ms"]["count"] > 0
+    assert not response.json()["data"]["counters"]
+
+
+async def test_stage_timings_collected_across_threads():
+    with collect_stage_timings() as timings:
+        with timed("test_outside"):
+            pass
+        # Sync routes run in a threadpool with a copy of the request context
+        context = contextvars.copy_context()
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            executor.submit(context.run, run_timed, "test_inside").result()
+    with timed("test_after"):
+        pass
+
+    assert set(timings) == {"test_outside", "test_inside"}
+    assert server_timing_header({"split": 1.234, "total": 10}) == "split;dur=1.23, total;dur=10.00"
+    assert metrics.get_histogram("stage.test_after_ms").count == 1
+
+
+async def test_micro_batcher_merge_concurrent_requests():
+    model = CountingModel()
+    batcher = MicroBatcher(model, window_ms=50, max_batch_size=64, name="test_batching")
+    inputs = [np.full((i + 1, 4), i, dtype="int32") for i in range(8)]
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        outputs = list(executor.map(batcher.predict, inputs))
+    batcher.close()
+
+    for i, output in enumerate(outputs):
+        assert output.shape == (i + 1, 1)
+        assert (output == i * 4).all()
+    assert model.calls < len(inputs)
+    assert metrics.get_histogram("test_batching.batch_size").count == model.calls
+
+
+class NoOutputModel:
+    """Returns nothing the batcher can split, which fails outside the prediction of a batch"""
+
+    def __init__(self):
+        self.broken = True
+
+    def predict(self, inputs: np.ndarray):
+        return None if self.broken else np.zeros((len(inputs), 1), dtype="float32")
+
+
+async def test_micro_batcher_fail_requests_instead_of_hanging():
+    model = NoOutputModel()
+    batcher = MicroBatcher(model, window_ms=20, name="test_batching_errors")
+    errors = []
+
+    def predict():
+        try:
+            batcher.predict(np.ones((2, 4), dtype="int32"))
+        except TypeError as e:
+            errors.append(e)
+
+    # Daemon threads, a request that hangs fails the test instead of blocking it
+    threads = [threading.Thread(target=predict, daemon=True) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=5)
+    assert len(errors) == len(threads)
+
+    # The worker keeps serving the next requests
+    model.broken = False
+    assert batcher.predict(np.ones((3, 4), dtype="int32")).shape == (3, 1)
+    batcher.close()
+    assert metrics.get_counter("test_batching_errors.worker_errors") >= 1
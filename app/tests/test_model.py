@@ -0,0 +1,162 @@
+import threading
+import time
+
+import numpy as np
+from fastapi.testclient import TestClient
+
+from app.services.model import (get_model_workers, report_model_worker,
+                                sync_model_version)
+from app.utils.fake_firestore import FakeFirestore
+from app.utils.model_registry import ModelRegistry
+from app.utils.test import (have_base_templates, have_correct_status,
+                            have_correct_status_and_message,
+                            have_error_message)
+
+
+class VersionModel:
+    def __init__(self, version: str):
+        self.value = float(version.lstrip("v")) if version != "broken" else np.nan
+        self.closed = False
+
+    def predict(self, inputs: np.ndarray):
+        return np.full((len(inputs), 1), self.value, dtype="float32")
+
+    def close(self):
+        self.closed = True
+
+
+def probe():
+    return [np.ones((2, 4), dtype="int32")]
+
+
+def wait_for_swap(registry: ModelRegistry):
+    while registry.loading_version is not None:
+        time.sleep(0.01)
+
+
+async def test_get_models_admin(test_db, admin_token, client: TestClient):
+    response = client.get("/models", headers={"Authorization": "bearer " + admin_token})
+    have_correct_status_and_message(response, 200, "get model versions")
+    have_base_templates(response)
+    data = response.json()["data"]
+    assert "default" in data["availableVersions"]
+    assert data["selectedVersion"] in data["availableVersions"]
+    assert isinstance(data["workers"], list)
+
+
+async def test_error_update_model_not_found(test_db, admin_token, client: TestClient):
+    response = client.put("/models", json={"version": "../../model"},
+                          headers={"Authorization": "bearer " + admin_token})
+    have_correct_status(response, 404)
+    have_error_message(response)
+
+
+async def test_error_models_without_admin(test_db, user_token, client: TestClient):
+    response = client.get("/models", headers={"Authorization": "bearer " + user_token})
+    have_correct_status(response, 403)
+    have_error_message(response)
+
+    response = client.put("/models", json={"version": "default"}, headers={"Authorization": "bearer " + user_token})
+    have_correct_status(response, 403)
+    have_error_message(response)
+
+
+async def test_model_registry_swap_after_warm_up():
+    started = threading.Event()
+    release = threading.Event()
+
+    def loader(version: str):
+        if version == "v2":
+            started.set()
+            release.wait()
+        return VersionModel(version)
+
+    registry = ModelRegistry(loader, "v1", probe=probe, retire_seconds=0)
+    previous = registry.current()
+    assert previous.predict(np.ones((1, 4)))[0, 0] == 1
+
+    assert registry.swap("v2")
+    started.wait()
+    # Requests keep being served by the old version while the new one loads
+    assert registry.version == "v1"
+    assert registry.loading_version == "v2"
+    assert not registry.swap("v2")
+
+    release.set()
+    wait_for_swap(registry)
+    assert registry.version == "v2"
+    assert registry.predict(np.ones((3, 4))).tolist() == [[2], [2], [2]]
+    assert not registry.swap("v2")
+    # The previous model is closed once the requests that took it are done
+    time.sleep(0.1)
+    assert previous.model.closed
+
+
+async def test_model_registry_load_once_on_boot():
+    loads = []
+
+    def loader(version: str):
+        loads.append(version)
+        time.sleep(0.1)
+        return VersionModel(version)
+
+    registry = ModelRegistry(loader, "v1", probe=probe)
+    assert registry.swap("v1")
+    # Requests that come while the boot load runs wait for it instead of loading a second copy
+    threads = [threading.Thread(target=registry.current) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert registry.version == "v1"
+    assert loads == ["v1"]
+
+
+async def test_model_registry_current_while_swap_starts():
+    errors = []
+
+    def current(registry: ModelRegistry, go: threading.Event):
+        go.wait()
+        try:
+            registry.current()
+        except Exception as e:
+            errors.append(e)
+
+    # Requests that race the swap must never find a loading thread they can not wait for
+    for _ in range(20):
+        registry = ModelRegistry(VersionModel, "v1", probe=probe)
+        go = threading.Event()
+        threads = [threading.Thread(target=current, args=(registry, go)) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        go.set()
+        registry.swap("v1")
+        for thread in threads:
+            thread.join()
+        assert registry.version == "v1"
+    assert errors == []
+
+
+async def test_model_registry_keep_model_when_probe_fail():
+    registry = ModelRegistry(VersionModel, "v1", probe=probe)
+    assert registry.swap("broken", wait=True)
+    assert registry.version == "v1"
+    assert "broken" in registry.status()["error"]
+
+
+async def test_model_sync_report_every_worker_version():
+    fs = FakeFirestore()
+    registry = ModelRegistry(VersionModel, "v1", probe=probe)
+    registry.current()
+
+    report_model_worker(registry, fs)
+    fs.collection("models").document("selected").set({"version": "v3"})
+    sync_model_version(registry, fs, "v1")
+    wait_for_swap(registry)
+    report_model_worker(registry, fs)
+
+    workers = get_model_workers(fs, stale_after_seconds=60)
+    assert len(workers) == 1
+    assert workers[0].version == "v3"
+    assert workers[0].loading_version is None
+    assert not workers[0].stale
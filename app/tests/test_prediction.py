@@ -0,0 +1,250 @@
+import os
+import random
+import string
+import threading
+
+import numpy as np
+import pytest
+from essential_generators import DocumentGenerator
+
+from app.dependencies import (get_model, get_model_path, get_pickle_tokenizer,
+                              get_tokenizer)
+from app.services.diary import (EMOTION_LABELS, MAX_SEQUENCE_LENGTH,
+                                PredictionCache, aggregate_predictions,
+                                iter_sentences, iter_text_chunks,
+                                label_agreement, predict_emotion, prediction,
+                                split_sentences)
+from app.utils.classifier import (KerasClassifier, TFLiteClassifier,
+                                  convert_to_tflite, masks_padding)
+from app.utils.model_registry import LoadedModel
+from app.utils.sequence import pad_by_bucket, pad_sequences, predict_by_bucket
+from app.utils.sidecar import InferenceServer, SidecarClassifier
+from app.utils.tokenizer import BatchTokenizer
+from app.utils.vocabulary import Vocabulary, write_vocabulary
+from config import get_settings
+
+main = DocumentGenerator()
+PARITY_DIARY_COUNT = 20
+
+
+class LengthModel:
+    def predict(self, inputs: np.ndarray):
+        return np.count_nonzero(inputs, axis=1)[:, None]
+
+
+async def test_pad_by_bucket_only_pad_to_bucket_length():
+    sequences = [[1] * 3, [2] * 40, [], [3] * 500, [4] * 32]
+    groups = pad_by_bucket(sequences, [32, 64, 128, 400], maxlen=400)
+    lengths = {padded.shape[1]: indices for indices, padded in groups}
+    assert lengths == {32: [0, 2, 4], 64: [1], 400: [3]}
+
+
+async def test_predict_by_bucket_keep_input_order():
+    sequences = [[1] * length for length in [5, 300, 40, 1, 70, 0, 450]]
+    predictions = predict_by_bucket(LengthModel(), sequences, [32, 64, 128, 400], maxlen=400)
+    assert predictions[:, 0].tolist() == [5, 300, 40, 1, 70, 0, 400]
+
+
+async def test_dynamic_padding_same_emotion():
+    tokenizer = get_tokenizer()
+    model = get_model()
+    if not masks_padding(model):
+        pytest.skip("The model does not mask the padding, dynamic padding is opt-in for a model that does")
+    for _ in range(PARITY_DIARY_COUNT):
+        diary = main.paragraph()
+        assert prediction(diary, tokenizer, model, dynamic_padding=True) == \
+            prediction(diary, tokenizer, model, dynamic_padding=False)
+
+
+class UnmaskedModel(LengthModel):
+    """A keras-like model without mask_zero, with the width of every batch it predicted"""
+
+    layers = []
+
+    def __init__(self):
+        self.widths = []
+
+    def predict(self, inputs: np.ndarray):
+        self.widths.append(inputs.shape[1])
+        return super().predict(inputs)
+
+
+async def test_dynamic_padding_setting_ignored_without_mask(monkeypatch):
+    monkeypatch.setattr(get_settings(), "inference_dynamic_padding", True)
+    model = UnmaskedModel()
+    predict_emotion("I am happy today. My friend is sad", get_tokenizer(), model)
+    assert set(model.widths) == {MAX_SEQUENCE_LENGTH}
+
+
+async def test_chunked_prediction_same_emotion():
+    tokenizer = get_tokenizer()
+    model = get_model()
+    diary = " ".join(main.paragraph() for _ in range(10))
+    assert list(iter_sentences(diary)) == split_sentences(diary)
+
+    expected_emotion, expected_scores = predict_emotion(diary, tokenizer, model, chunk_sentences=10 ** 6)
+    for chunk_sentences in [1, 7]:
+        emotion, scores = predict_emotion(diary, tokenizer, model, chunk_sentences=chunk_sentences)
+        assert emotion == expected_emotion
+        assert np.allclose(list(scores.values()), list(expected_scores.values()), atol=1e-5)
+
+
+class VersionedModel:
+    """Scores from the first token of every row, and the rows it was asked to predict"""
+
+    def __init__(self, version: str):
+        self.version = version
+        self.rows = 0
+
+    def predict(self, inputs: np.ndarray):
+        self.rows += len(inputs)
+        scores = np.zeros((len(inputs), len(EMOTION_LABELS)), dtype="float32")
+        scores[np.arange(len(inputs)), inputs[:, 0] % len(EMOTION_LABELS)] = 1
+        return scores
+
+
+async def test_prediction_cache_only_predict_new_sentences():
+    tokenizer = get_tokenizer()
+    cache = PredictionCache(max_sentences=100)
+    model = VersionedModel("v1")
+    diary = "I am happy today. My friend is sad. We are angry"
+    expected = predict_emotion(diary, tokenizer, model, cache=cache)
+    assert model.rows == 3
+
+    edited = "I am happy today.  MY FRIEND is sad. We are angry. I love my family"
+    assert predict_emotion(edited, tokenizer, model, cache=cache)[0] == \
+        predict_emotion(edited, tokenizer, VersionedModel("v1"), cache=PredictionCache(max_sentences=100))[0]
+    assert model.rows == 4
+    assert predict_emotion(diary, tokenizer, model, cache=cache) == expected
+    assert model.rows == 4
+
+    # The tokenizer only splits on spaces and its filters, these have other tokens than "i am happy today"
+    predict_emotion("i am happy today", tokenizer, model, cache=cache)
+    rows = model.rows
+    for sentence in ["i am\rhappy\xa0today", "I  am happy\u3000today"]:
+        predict_emotion(sentence, tokenizer, model, cache=cache)
+        rows += 1
+        assert model.rows == rows
+
+    # Another model version never gets the predictions of the previous one
+    swapped = VersionedModel("v2")
+    predict_emotion(diary, tokenizer, swapped, cache=cache)
+    assert swapped.rows == 3
+
+
+async def test_text_chunks_cut_on_sentence_end():
+    # The generator can make a run-on sentence longer than a chunk, which is cut on whitespace, so end them here
+    diary = "".join(main.sentence()[:200].rstrip(" ?.!") + ". " for _ in range(200))
+    chunks = list(iter_text_chunks(diary, 500))
+    assert "".join(chunks) == diary
+    assert all(len(chunk) <= 500 for chunk in chunks)
+    assert all(chunk.rstrip()[-1] in "?.!" for chunk in chunks[:-1])
+    assert list(iter_text_chunks("a" * 1200, 500)) == ["a" * 500, "a" * 500, "a" * 200]
+
+
+async def test_tflite_backend_parity(tmp_path):
+    tokenizer = get_tokenizer()
+    keras_classifier = KerasClassifier(get_model())
+    tflite_classifier = TFLiteClassifier(convert_to_tflite(get_model(), str(tmp_path / "model.tflite")))
+    for _ in range(PARITY_DIARY_COUNT):
+        diary = main.paragraph()
+        assert prediction(diary, tokenizer, keras_classifier) == prediction(diary, tokenizer, tflite_classifier)
+
+        sequences = tokenizer.texts_to_sequences(diary.split("."))
+        padded = pad_sequences(sequences, maxlen=400)
+        assert np.allclose(keras_classifier.predict(padded), tflite_classifier.predict(padded), atol=1e-4)
+
+
+async def test_quantized_tflite_accuracy_gate(tmp_path):
+    tokenizer = get_tokenizer()
+    calibration = [sentence for _ in range(20) for sentence in split_sentences(main.paragraph())]
+    quantized_path = convert_to_tflite(get_model(), str(tmp_path / "model-int8.tflite"), quantization="int8",
+                                       representative_inputs=tokenizer.encode(calibration, maxlen=400))
+    quantized_classifier = TFLiteClassifier(quantized_path)
+    assert os.path.getsize(quantized_path) < os.path.getsize(get_model_path("model.h5")) / 2
+
+    diaries = [main.paragraph() for _ in range(PARITY_DIARY_COUNT)]
+    agreement, _ = label_agreement(diaries, tokenizer, KerasClassifier(get_model()), quantized_classifier)
+    assert agreement >= 0.9
+
+
+async def test_sidecar_roundtrip_and_fallback(tmp_path):
+    socket_path = str(tmp_path / "inference.sock")
+    server = InferenceServer(socket_path, LoadedModel("v2", LengthModel()))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def fallback():
+        return LoadedModel("v1", LengthModel())
+
+    classifier = SidecarClassifier(socket_path, fallback=fallback)
+    inputs = pad_sequences([[1] * length for length in [3, 0, 12]], maxlen=16)
+    # The diaries keep the version of the model that ran in the sidecar
+    assert classifier.version == "v2"
+    assert classifier.predict(inputs)[:, 0].tolist() == [3, 0, 12]
+    assert classifier.version == "v2"
+
+    server.shutdown()
+    server.server_close()
+    missing = SidecarClassifier(str(tmp_path / "missing.sock"), fallback=fallback)
+    assert missing.predict(inputs)[:, 0].tolist() == [3, 0, 12]
+    assert missing.version == "v1"
+
+
+async def test_vocabulary_same_ids_as_pickle(tmp_path):
+    tokenizer = get_pickle_tokenizer()
+    corpus = [main.paragraph() for _ in range(200)] + [main.sentence().upper() + " <OOV> zzzqqq" for _ in range(50)]
+    expected = tokenizer.texts_to_sequences(corpus)
+
+    converted = Vocabulary(write_vocabulary(tokenizer, str(tmp_path / "vocabulary.bin")))
+    assert converted.texts_to_sequences(corpus) == expected
+
+    shipped = Vocabulary(get_model_path("vocabulary.bin"))
+    assert shipped.num_words == tokenizer.num_words
+    assert shipped.texts_to_sequences(corpus) == expected
+
+
+def fuzzed_corpus(words: list[str], size: int, seed: int = 0):
+    rng = random.Random(seed)
+    alphabet = string.printable + "ÄéßΣİı\u00a0\u3000"
+    separators = [" ", "  ", ",", ". ", "!", "\t", "\n", "-", "'", ""]
+    corpus = []
+    for _ in range(size):
+        tokens = []
+        for _ in range(rng.choice([0, 1, 5, 30, 500])):
+            if rng.random() < 0.8:
+                token = rng.choice(words)
+                token = token.upper() if rng.random() < 0.1 else token
+            else:
+                token = "".join(rng.choice(alphabet) for _ in range(rng.randint(1, 8)))
+            tokens.append(token + rng.choice(separators))
+        corpus.append("".join(tokens))
+    return corpus
+
+
+async def test_batch_tokenizer_same_as_keras():
+    from tensorflow.keras.preprocessing.sequence import \
+        pad_sequences as keras_pad_sequences
+
+    tokenizer = get_pickle_tokenizer()
+    corpus = fuzzed_corpus(list(tokenizer.word_index), 2000)
+    expected = tokenizer.texts_to_sequences(corpus)
+    expected_padded = keras_pad_sequences(expected, padding="post", truncating="post", maxlen=400)
+
+    for base in [tokenizer, Vocabulary(get_model_path("vocabulary.bin"))]:
+        batch_tokenizer = BatchTokenizer(base)
+        assert batch_tokenizer.texts_to_sequences(corpus) == expected
+        assert (batch_tokenizer.encode(corpus, maxlen=400) == expected_padded).all()
+
+
+async def test_aggregate_predictions_same_vote_as_loop():
+    rng = np.random.default_rng(0)
+    for _ in range(500):
+        # Rounded probabilities so ties inside a row and between votes do happen
+        predictions = rng.integers(0, 4, size=(rng.integers(1, 8), len(EMOTION_LABELS))).astype("float32")
+        votes = [0] * len(EMOTION_LABELS)
+        for row in predictions.tolist():
+            votes[row.index(max(row))] += 1
+
+        emotion, scores = aggregate_predictions(predictions)
+        assert emotion == EMOTION_LABELS[votes.index(max(votes))]
+        assert np.allclose(list(scores.values()), predictions.mean(axis=0))
@@ -0,0 +1,165 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from app.dependencies import get_tokenizer
+from app.services.diary import EMOTION_LABELS, predict_emotion
+from app.services.reclassify import (load_checkpoint, reclassify_diaries,
+                                     retranslate_diaries,
+                                     retry_pending_diaries)
+from app.utils.fake_firestore import FakeFirestore
+from app.utils.fake_translate import FakeTranslateClient
+from app.utils.resilience import Unavailable
+
+DIARY_COUNT = 23
+
+
+class SentenceCountModel:
+    """Every sentence votes for the emotion at the index of its number of words"""
+
+    def __init__(self, shift: int = 0):
+        self.shift = shift
+
+    def predict(self, inputs: np.ndarray):
+        labels = (np.count_nonzero(inputs, axis=1) + self.shift) % len(EMOTION_LABELS)
+        return np.eye(len(EMOTION_LABELS), dtype="float32")[labels]
+
+
+def create_fake_diaries(fs: FakeFirestore, model):
+    tokenizer = get_tokenizer()
+    for i in range(DIARY_COUNT):
+        translated_content = " ".join(["today"] * (i % 7 + 1)) + ". I am happy"
+        emotion, emotion_scores = predict_emotion(translated_content, tokenizer, model)
+        fs.collection('diary').document(f"diary-{i:03d}").set({
+            "title": f"Diary {i}",
+            "content": translated_content,
+            "translated_content": translated_content,
+            "emotion": emotion,
+            "emotion_scores": emotion_scores,
+            "user_id": "user",
+            "time_created": datetime.now(),
+            "time_updated": datetime.now()})
+    fs.collection('diary').document("invalid").set({"title": "No content"})
+    fs.writes = 0
+
+
+async def test_reclassify_only_write_changed_diaries():
+    fs = FakeFirestore()
+    create_fake_diaries(fs, SentenceCountModel())
+
+    report = reclassify_diaries(fs, get_tokenizer(), SentenceCountModel(), page_size=5, batch_size=3)
+    assert report.finished
+    assert report.processed == DIARY_COUNT + 1
+    assert report.invalid == 1
+    assert report.updated == 0
+    assert fs.writes == 0
+
+    report = reclassify_diaries(fs, get_tokenizer(), SentenceCountModel(shift=1), page_size=5, batch_size=3)
+    assert report.updated == DIARY_COUNT
+    assert fs.writes == DIARY_COUNT
+    assert fs.commits == report.pages
+
+    tokenizer = get_tokenizer()
+    for document in fs.collection('diary').where("user_id", "==", "user").stream():
+        data = document.to_dict()
+        assert (data["emotion"], data["emotion_scores"]) == \
+            predict_emotion(data["translated_content"], tokenizer, SentenceCountModel(shift=1))
+
+
+class EditingModel(SentenceCountModel):
+    """Edits a diary while the page is predicted, like a user between the read and the write of the job"""
+
+    def __init__(self, fs: FakeFirestore, shift: int = 0):
+        super().__init__(shift)
+        self.fs = fs
+
+    def predict(self, inputs: np.ndarray):
+        self.fs.collection('diary').document("diary-001").update({
+            "content": "Edited", "translated_content": "Edited", "emotion": "joy"})
+        return super().predict(inputs)
+
+
+async def test_reclassify_keep_diary_edited_meanwhile():
+    fs = FakeFirestore()
+    create_fake_diaries(fs, SentenceCountModel())
+
+    report = reclassify_diaries(fs, get_tokenizer(), EditingModel(fs, shift=1), page_size=5, batch_size=5,
+                                max_pages=1)
+    assert report.stale == 1
+    assert report.updated == 4
+    assert fs.collection('diary').document("diary-001").get().to_dict()["emotion"] == "joy"
+    assert fs.collection('diary').document("diary-002").get().to_dict()["emotion"] == \
+        predict_emotion(" ".join(["today"] * 3) + ". I am happy", get_tokenizer(), SentenceCountModel(shift=1))[0]
+
+
+async def test_reclassify_resume_from_checkpoint(tmp_path):
+    fs = FakeFirestore()
+    create_fake_diaries(fs, SentenceCountModel())
+    checkpoint_path = str(tmp_path / "reclassify.json")
+
+    report = reclassify_diaries(fs, get_tokenizer(), SentenceCountModel(shift=2), page_size=4,
+                                checkpoint_path=checkpoint_path, max_pages=2)
+    assert not report.finished
+    assert load_checkpoint(checkpoint_path).last_document_id == "diary-007"
+
+    fs.reads = 0
+    report = reclassify_diaries(fs, get_tokenizer(), SentenceCountModel(shift=2), page_size=4,
+                                checkpoint_path=checkpoint_path)
+    assert report.finished
+    assert report.processed == DIARY_COUNT + 1
+    assert report.updated == DIARY_COUNT
+    # The diaries before the checkpoint are not read again
+    assert fs.reads == DIARY_COUNT + 1 - 8
+
+
+async def test_retranslate_flagged_diaries():
+    fs = FakeFirestore()
+    create_fake_diaries(fs, SentenceCountModel())
+    for i in range(3):
+        fs.collection('diary').document(f"diary-{i:03d}").update({
+            "content": "Aku sangat sedih hari ini",
+            "translated_content": "Aku sangat sedih hari ini",
+            "needs_retranslation": True})
+
+    api = FakeTranslateClient()
+    api.error = Unavailable("translate api is down")
+    report = retranslate_diaries(fs, api, get_tokenizer(), SentenceCountModel(), page_size=2)
+    assert not report.finished
+    assert report.updated == 0
+
+    api.error = None
+    report = retranslate_diaries(fs, api, get_tokenizer(), SentenceCountModel(), page_size=2)
+    assert report.finished
+    assert report.updated == 3
+    assert report.pages == 2
+    for i in range(3):
+        data = fs.collection('diary').document(f"diary-{i:03d}").get().to_dict()
+        assert data["translated_content"] == "I very sad day this"
+        assert not data["needs_retranslation"]
+        # The next edit of the diary only translates its changed sentences
+        assert list(data["translation_alignment"].values()) == ["I very sad day this"]
+
+
+async def test_retry_pending_and_failed_diaries():
+    fs = FakeFirestore()
+    create_fake_diaries(fs, SentenceCountModel())
+    long_ago = datetime.now() - timedelta(hours=1)
+    for i, (status, time_updated) in enumerate([("pending", long_ago), ("failed", long_ago),
+                                                ("pending", datetime.now())]):
+        fs.collection('diary').document(f"diary-{i:03d}").update({
+            "content": "Aku sangat sedih hari ini",
+            "translated_content": None,
+            "emotion": None,
+            "emotion_scores": None,
+            "status": status,
+            "time_updated": time_updated})
+
+    report = retry_pending_diaries(fs, FakeTranslateClient(), get_tokenizer(), SentenceCountModel(), page_size=2)
+    assert report.finished
+    assert report.updated == 2
+    for i in range(2):
+        data = fs.collection('diary').document(f"diary-{i:03d}").get().to_dict()
+        assert data["status"] == "done"
+        assert data["translated_content"] == "I very sad day this"
+    # Its worker may still be classifying it
+    assert fs.collection('diary').document("diary-002").get().to_dict()["status"] == "pending"
@@ -0,0 +1,210 @@
+import time
+from uuid import uuid4
+
+from app.database import SessionLocal
+from app.models import Translation
+from app.services.diary import translate_content, translate_texts
+from app.services.translation import (CachedTranslateClient,
+                                      ResilientTranslateClient,
+                                      TranslationCache, get_translation_key)
+from app.utils.fake_translate import FakeTranslateClient
+from app.utils.language import get_language_identifier
+from app.utils.metrics import metrics
+from app.utils.resilience import (BREAKER_STATES, MIN_HEDGE_SAMPLES,
+                                  CircuitBreaker, ResilientCaller)
+from config import get_settings
+
+settings = get_settings()
+
+
+def new_cache(max_characters: int = 10000, max_rows: int = 1000, eviction_interval: int = 100):
+    return TranslationCache(SessionLocal, max_characters, max_rows, eviction_interval)
+
+
+async def test_translation_cache_translate_once(test_db):
+    api = FakeTranslateClient()
+    text = f"Aku senang hari ini {uuid4()}"
+    database_hits = metrics.snapshot()["counters"].get("translation_cache.database.hits", 0)
+
+    first = translate_content(text, CachedTranslateClient(api, new_cache()), translate=True)
+    second = translate_content(text, CachedTranslateClient(api, new_cache()), translate=True)
+    assert first == second
+    assert api.calls == [[text]]
+    # The second client has an empty memory cache, the translation comes from the table
+    assert metrics.snapshot()["counters"]["translation_cache.database.hits"] == database_hits + 1
+
+    client = CachedTranslateClient(api, new_cache())
+    results = client.translate([text, f"{text} lagi", text], target_language="en")
+    assert [result["input"] for result in results] == [text, f"{text} lagi", text]
+    assert api.calls == [[text], [f"{text} lagi"]]
+
+
+async def test_translation_cache_one_round_trip_per_call(test_db):
+    sessions = []
+
+    def session_factory():
+        sessions.append(SessionLocal())
+        return sessions[-1]
+
+    api = FakeTranslateClient()
+    cache = TranslationCache(session_factory, 10000, 1000)
+    content = " ".join(f"Aku senang hari ini {uuid4()}." for _ in range(5))
+    translate_content(content, CachedTranslateClient(api, cache), translate=True)
+    # One read for the five sentences and one upsert of their translations
+    assert len(sessions) == 2
+
+    sessions.clear()
+    response = translate_content(content, CachedTranslateClient(api, new_cache()), translate=True)
+    assert len(api.calls) == 1
+    assert response.translated_text.startswith("I happy day this")
+
+
+async def test_translation_cache_bounded(test_db):
+    api = FakeTranslateClient()
+    cache = new_cache(max_characters=100, max_rows=3, eviction_interval=1)
+    client = CachedTranslateClient(api, cache)
+    texts = [f"kalimat {index} {uuid4()}" for index in range(5)]
+    for text in texts:
+        client.translate(text, target_language="en")
+
+    assert cache._memory.currsize <= 100
+    with SessionLocal() as session:
+        assert session.query(Translation).count() <= 3
+        assert session.get(Translation, get_translation_key(texts[-1], "en")) is not None
+
+
+async def test_translate_texts_pack_requests():
+    api = FakeTranslateClient()
+    inputs = [f"Aku senang hari ini {index}. Dia sedih & marah" for index in range(300)]
+    inputs.append("Aku takut. " * 2000)
+
+    responses = translate_texts(inputs, api)
+    # Strings of the schemas are stripped
+    assert [response.input for response in responses] == [input.strip() for input in inputs]
+    assert responses[0].translated_text == "I happy day this 0. they sad & angry"
+    assert responses[-1].translated_text.startswith("I afraid. I afraid.")
+
+    for values in api.calls:
+        assert len(values) <= settings.translate_batch_max_segments
+        assert sum(len(value) for value in values) <= settings.translate_batch_max_characters
+    segments = sum(len(values) for values in api.calls)
+    characters = sum(len(input) for input in inputs)
+    assert len(api.calls) == max(-(-segments // settings.translate_batch_max_segments),
+                                 -(-characters // settings.translate_batch_max_characters))
+
+
+async def test_english_diary_skip_translation():
+    api = FakeTranslateClient()
+    english = "Today I went to the park with my friends and we had a wonderful time together"
+    indonesian = "Hari ini aku sangat senang karena bisa bertemu dengan teman lama di sekolah"
+    mixed = "I was so happy today. Tapi aku sedih karena temanku tidak lulus ujian dan dia menangis terus"
+
+    responses = translate_texts([english, indonesian, mixed], api)
+    assert responses[0].translated_text == english
+    assert responses[0].detected_source_language == "en"
+    assert responses[1].detected_source_language == "id"
+    assert api.calls == [[indonesian, mixed]]
+    assert 0 < metrics.snapshot()["gauges"]["translate.language_detection.skip_rate"] < 1
+
+
+async def test_edited_diary_translate_changed_sentences():
+    api = FakeTranslateClient()
+    content = "Aku senang hari ini. Dia sedih dan marah! Aku takut?"
+    first = translate_content(content, api, translate=True)
+    assert first.translated_text == "I happy day this. they sad and angry! I afraid?"
+
+    api.calls.clear()
+    edited = "Aku senang hari ini. Dia sangat marah! Aku takut? Aku senang hari ini."
+    second = translate_content(edited, api, translate=True, alignment=first.alignment)
+    assert api.calls == [["Dia sangat marah!"]]
+    assert second.translated_text == "I happy day this. they very angry! I afraid? I happy day this."
+    # Only the sentences of the current content are kept
+    assert len(second.alignment) == 3
+
+    # The line breaks and paragraphs stay where they were
+    paragraphs = "Aku senang hari ini.\nDia sedih dan marah!\n\n\tAku takut?"
+    response = translate_content(paragraphs, api, translate=True, alignment=first.alignment)
+    assert response.translated_text == "I happy day this.\nthey sad and angry!\n\n\tI afraid?"
+
+
+async def test_mostly_english_diary_translate_other_sentences():
+    api = FakeTranslateClient()
+    english = "I was so tired after the long exam at school and I stayed quiet the whole afternoon."
+    response = translate_content(f"{english} Capek banget, aku sedih.", api, translate=True)
+    assert api.calls == [["Capek banget, aku sedih."]]
+    assert response.translated_text == f"{english} Capek banget, I sad."
+    assert response.detected_source_language == "id"
+
+
+async def test_language_identifier():
+    identifier = get_language_identifier()
+    assert identifier.detect("I feel so sad because my grandmother passed away last night")[0] == "en"
+    assert identifier.detect("Aku kesel banget sama dia, udah janji mau datang tapi gak datang")[0] == "id"
+    # Too short to tell, and a language that is not profiled
+    assert identifier.detect("Ok") == (None, 0.0)
+    assert identifier.detect("Hoy fui al parque con mis amigos y pasamos un tiempo maravilloso juntos")[1] < \
+        settings.language_detection_min_confidence
+
+
+def new_resilient_client(api: FakeTranslateClient, deadline_seconds: float = 0.2, failures: int = 2,
+                         hedge_percentile: float = 0):
+    breaker = CircuitBreaker("test_translate", failure_threshold=failures, reset_seconds=0.2)
+    return ResilientTranslateClient(api, ResilientCaller("test_translate", deadline_seconds, breaker,
+                                                         hedge_percentile=hedge_percentile))
+
+
+async def test_translate_deadline_fall_back_to_untranslated():
+    api = FakeTranslateClient(delay_seconds=1)
+    text = "Aku sangat marah pada temanku"
+    start = time.monotonic()
+    response = translate_content(text, new_resilient_client(api), translate=True)
+    assert time.monotonic() - start < 0.5
+    assert response.translated_text == text
+    assert response.needs_retranslation
+
+
+async def test_translate_circuit_breaker():
+    api = FakeTranslateClient()
+    api.error = RuntimeError("translate api is down")
+    client = new_resilient_client(api)
+    for _ in range(2):
+        assert translate_content("Aku sangat marah pada temanku", client, translate=True).needs_retranslation
+    assert client.caller.breaker.state == "open"
+    assert metrics.snapshot()["gauges"]["test_translate.circuit_breaker.state"] == BREAKER_STATES["open"]
+
+    # An open breaker does not even call the api
+    assert translate_content("Aku sangat senang hari ini", client, translate=True).needs_retranslation
+    assert len(api.calls) == 2
+
+    time.sleep(0.2)
+    api.error = None
+    response = translate_content("Aku sangat senang hari ini", client, translate=True)
+    assert response.translated_text == "I very happy day this"
+    assert client.caller.breaker.state == "closed"
+
+
+class StallOnceTranslateClient(FakeTranslateClient):
+    def __init__(self):
+        super().__init__(delay_seconds=0.01)
+        self.stall_next = False
+
+    def translate(self, values, target_language: str = None, **kwargs):
+        if self.stall_next:
+            self.stall_next = False
+            time.sleep(1)
+        return super().translate(values, target_language, **kwargs)
+
+
+async def test_translate_hedged_request():
+    api = StallOnceTranslateClient()
+    client = new_resilient_client(api, deadline_seconds=2, hedge_percentile=0.9)
+    for index in range(MIN_HEDGE_SAMPLES):
+        client.translate(f"kalimat {index}", target_language="en")
+    hedge_wins = metrics.get_counter("test_translate.hedge_wins")
+
+    # Only the first attempt stalls, the hedged one answers first
+    api.stall_next = True
+    start = time.monotonic()
+    assert client.translate("Aku senang", target_language="en")["translatedText"] == "I happy"
+    assert time.monotonic() - start < 0.5
+    assert metrics.get_counter("test_translate.hedge_wins") == hedge_wins + 1
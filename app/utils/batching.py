@@ -0,0 +1,144 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+
+from app import logger
+from app.utils.metrics import SIZE_BUCKETS, metrics
+
+
+class _PendingRequest:
+    __slots__ = ("inputs", "future", "enqueued_at")
+
+    def __init__(self, inputs: np.ndarray):
+        self.inputs = inputs
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+class MicroBatcher:
+    """Collect the padded sentences of concurrent requests and run them in one forward pass.
+
+    The batcher has the same `predict` interface as the model it wraps, so `prediction()`
+    does not need to know whether it is talking to the model directly or to the batcher.
+    """
+
+    def __init__(self, model, window_ms: float = 5, max_batch_size: int = 64, name: str = "batching"):
+        self.model = model
+        self.window = window_ms / 1000
+        self.max_batch_size = max_batch_size
+        self.name = name
+        self._pending: deque[_PendingRequest] = deque()
+        self._pending_rows = 0
+        self._condition = threading.Condition()
+        self._closed = False
+        self._thread = None
+
+    def predict(self, inputs: np.ndarray):
+        request = _PendingRequest(np.asarray(inputs))
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("The batcher is already closed")
+            self._ensure_worker()
+            self._pending.append(request)
+            self._pending_rows += len(request.inputs)
+            metrics.set_gauge(f"{self.name}.queue_depth", len(self._pending))
+            self._condition.notify()
+        return request.future.result()
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _ensure_worker(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name=f"{self.name}-worker", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = None
+            try:
+                batch = self._next_batch()
+                if batch is None:
+                    return
+                self._process(batch)
+            except BaseException as e:
+                # The requests waiting on this worker would never get their result otherwise
+                logger.exception(f"{self.name} worker failed, failing its pending requests")
+                metrics.increment(f"{self.name}.worker_errors")
+                self._fail(batch or [], e)
+                if not isinstance(e, Exception):
+                    raise
+
+    def _fail(self, batch: list[_PendingRequest], error: BaseException):
+        with self._condition:
+            requests = batch + list(self._pending)
+            self._pending.clear()
+            self._pending_rows = 0
+            metrics.set_gauge(f"{self.name}.queue_depth", 0)
+        for request in requests:
+            if not request.future.done():
+                request.future.set_exception(error)
+
+    def _next_batch(self):
+        with self._condition:
+            while not self._pending and not self._closed:
+                self._condition.wait()
+            if not self._pending:
+                return None
+
+            # Wait for more requests until the window of the oldest request is over or the batch is full
+            deadline = self._pending[0].enqueued_at + self.window
+            while self._pending_rows < self.max_batch_size and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+
+            batch: list[_PendingRequest] = []
+            rows = 0
+            while self._pending:
+                request_rows = len(self._pending[0].inputs)
+                if batch and rows + request_rows > self.max_batch_size:
+                    break
+                request = self._pending.popleft()
+                batch.append(request)
+                rows += request_rows
+            self._pending_rows -= rows
+            metrics.set_gauge(f"{self.name}.queue_depth", len(self._pending))
+            return batch
+
+    def _process(self, batch: list[_PendingRequest]):
+        now = time.monotonic()
+        for request in batch:
+            metrics.observe(f"{self.name}.wait_time_ms", (now - request.enqueued_at) * 1000)
+
+        # Sentences can only be stacked together if they have the same padded length
+        groups: dict[tuple, list[_PendingRequest]] = {}
+        for request in batch:
+            groups.setdefault(request.inputs.shape[1:], []).append(request)
+
+        for requests in groups.values():
+            try:
+                inputs = np.concatenate([r.inputs for r in requests])
+                metrics.observe(f"{self.name}.batch_size", len(inputs), buckets=SIZE_BUCKETS)
+                metrics.observe(f"{self.name}.requests_per_batch", len(requests), buckets=SIZE_BUCKETS)
+                start = time.monotonic()
+                outputs = self.model.predict(inputs)
+                metrics.observe(f"{self.name}.inference_time_ms", (time.monotonic() - start) * 1000)
+            except Exception as e:
+                for request in requests:
+                    request.future.set_exception(e)
+                continue
+
+            offset = 0
+            for request in requests:
+                rows = len(request.inputs)
+                request.future.set_result(outputs[offset:offset + rows])
+                offset += rows
@@ -0,0 +1,124 @@
+import threading
+
+import numpy as np
+
+from config import InferenceMode
+
+# "dynamic" only stores the weights as int8, "int8" also runs the activations in int8 and
+# needs sample inputs to calibrate their ranges
+QUANTIZATIONS = ("dynamic", "int8")
+
+
+class EmotionClassifier:
+    """Interface of the emotion model backends.
+
+    `predict` takes a batch of padded token ids and returns the probability of every emotion class
+    for each row, in the same order as the training labels.
+    """
+
+    backend: str = None
+
+    def predict(self, inputs: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+
+class KerasClassifier(EmotionClassifier):
+    backend = "keras"
+
+    def __init__(self, model, mode: InferenceMode = InferenceMode.PREDICT, sequence_buckets=(32, 64, 128, 400)):
+        self.model = model
+        self.mode = InferenceMode(mode)
+        self._serving = model
+        if self.mode == InferenceMode.COMPILED:
+            from app.utils.compiled_model import CompiledModel
+            self._serving = CompiledModel(model, sequence_buckets)
+
+    def predict(self, inputs: np.ndarray) -> np.ndarray:
+        return np.asarray(self._serving.predict(inputs))
+
+
+def masks_padding(model):
+    """Whether the keras model ignores the padding zeros, None if it can not be told (tflite, sidecar)
+
+    Only then padding a sentence to its length bucket instead of maxlen keeps its predictions.
+    """
+    # Through the wrappers (LoadedModel, MicroBatcher, KerasClassifier) down to the keras model
+    while not hasattr(model, "layers") and hasattr(model, "model"):
+        model = model.model
+    layers = getattr(model, "layers", None)
+    if layers is None:
+        return None
+    return any(getattr(layer, "mask_zero", False) for layer in layers)
+
+
+def load_tflite_interpreter(path: str, num_threads: int = None):
+    # tflite-runtime is a few MB and does not pull tensorflow in, fall back to the full tensorflow if it is not installed
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        from tensorflow.lite import Interpreter
+    return Interpreter(model_path=path, num_threads=num_threads)
+
+
+class TFLiteClassifier(EmotionClassifier):
+    backend = "tflite"
+
+    def __init__(self, path: str, num_threads: int = None):
+        self.path = path
+        self.interpreter = load_tflite_interpreter(path, num_threads)
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        # The interpreter owns its tensors, so only one thread can run it at a time
+        self._lock = threading.Lock()
+
+    @property
+    def quantized(self):
+        return any(details["quantization"][0] for details in (self._input, self._output))
+
+    def predict(self, inputs: np.ndarray) -> np.ndarray:
+        inputs = quantize(np.asarray(inputs), self._input)
+        with self._lock:
+            if tuple(self.interpreter.get_input_details()[0]["shape"]) != inputs.shape:
+                self.interpreter.resize_tensor_input(self._input["index"], inputs.shape, strict=False)
+                self.interpreter.allocate_tensors()
+            self.interpreter.set_tensor(self._input["index"], inputs)
+            self.interpreter.invoke()
+            outputs = self.interpreter.get_tensor(self._output["index"]).copy()
+        return dequantize(outputs, self._output)
+
+
+def quantize(values: np.ndarray, details: dict):
+    # A scale of 0 means the tensor is not quantized, like the int32 token ids of the embedding
+    scale, zero_point = details["quantization"]
+    if scale:
+        info = np.iinfo(details["dtype"])
+        values = np.clip(np.round(values / scale + zero_point), info.min, info.max)
+    return values.astype(details["dtype"])
+
+
+def dequantize(values: np.ndarray, details: dict):
+    scale, zero_point = details["quantization"]
+    if scale:
+        return (values.astype("float32") - zero_point) * scale
+    return values
+
+
+def convert_to_tflite(model, output_path: str, quantization: str = None, representative_inputs: np.ndarray = None):
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantization is not None:
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Quantization must be one of {QUANTIZATIONS}")
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == "int8":
+        if representative_inputs is None:
+            raise ValueError("int8 quantization needs representative inputs to calibrate the activations")
+        input_dtype = model.inputs[0].dtype.as_numpy_dtype
+        # Operations without an int8 kernel stay in float, the model input and output are kept as they are
+        converter.representative_dataset = lambda: ([row[None].astype(input_dtype)] for row in representative_inputs)
+    flatbuffer = converter.convert()
+    with open(output_path, "wb") as f:
+        f.write(flatbuffer)
+    return output_path
@@ -0,0 +1,38 @@
+import numpy as np
+import tensorflow as tf
+
+
+class CompiledModel:
+    """Serve a keras model through traced concrete functions instead of `model.predict`.
+
+    `model.predict` builds a data adapter and an execution loop on every call, which costs more than
+    the forward pass itself for the handful of sentences in a diary. Here one concrete function is
+    traced per sequence length bucket with a dynamic batch dimension, so serving a diary is a single
+    graph call. Inputs are padded with zeros up to the nearest bucket length.
+    """
+
+    def __init__(self, model, sequence_buckets=(32, 64, 128, 400)):
+        self.model = model
+        self.sequence_buckets = tuple(sorted(sequence_buckets))
+        self.dtype = model.inputs[0].dtype if getattr(model, "inputs", None) else tf.float32
+
+        function = tf.function(lambda inputs: model(inputs, training=False))
+        self._functions = {
+            length: function.get_concrete_function(tf.TensorSpec([None, length], self.dtype))
+            for length in self.sequence_buckets}
+
+    def bucket_length(self, length: int):
+        for bucket in self.sequence_buckets:
+            if length <= bucket:
+                return bucket
+        raise ValueError(f"Sequence length {length} is longer than the biggest bucket {self.sequence_buckets[-1]}")
+
+    def predict(self, inputs: np.ndarray):
+        inputs = np.asarray(inputs)
+        length = inputs.shape[1]
+        bucket = self.bucket_length(length)
+        if bucket != length:
+            inputs = np.pad(inputs, ((0, 0), (0, bucket - length)))
+
+        outputs = self._functions[bucket](tf.constant(inputs, dtype=self.dtype))
+        return outputs.numpy()
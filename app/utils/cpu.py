@@ -0,0 +1,69 @@
+"""Keep the tensorflow thread pools of several workers from fighting over the same cores
+
+Every gunicorn worker loads its own model and tensorflow sizes its pools to every core of the
+instance by default, so four workers predicting at the same time run four times more threads
+than there are cores. The pools can be limited per worker and every worker can be pinned to its
+own cores: workers claim a slot by locking a file, the lock is released when the worker exits.
+"""
+import fcntl
+import os
+import tempfile
+
+from app import logger
+
+SLOT_DIRECTORY = os.path.join(tempfile.gettempdir(), "emodiary-cpu-slots")
+
+
+def configure_tensorflow_threads(intra_op_threads: int, inter_op_threads: int):
+    import tensorflow as tf
+
+    try:
+        if intra_op_threads:
+            tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+        if inter_op_threads:
+            tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+    except RuntimeError:
+        # Only possible before the first op runs
+        logger.warning("Tensorflow is already initialized, the thread settings are not applied")
+
+
+def claim_cpu_slot(slot_count: int):
+    """Lock the first free slot file and keep it open, None if every slot is taken"""
+    os.makedirs(SLOT_DIRECTORY, exist_ok=True)
+    for slot in range(slot_count):
+        file = open(os.path.join(SLOT_DIRECTORY, f"slot-{slot}.lock"), "w")
+        try:
+            fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            file.close()
+            continue
+        return slot, file
+    return None, None
+
+
+_slot_file = None
+
+
+def pin_worker_cpus(cores_per_worker: int):
+    """Pin every thread of this process to the cores of a free slot, returns the cores or None"""
+    global _slot_file
+    cores = sorted(os.sched_getaffinity(0))
+    slot_count = len(cores) // cores_per_worker
+    if slot_count == 0:
+        logger.warning(f"Only {len(cores)} cores are available, the worker is not pinned")
+        return None
+
+    slot, _slot_file = claim_cpu_slot(slot_count)
+    if slot is None:
+        logger.warning(f"All {slot_count} cpu slots are taken by other workers, the worker is not pinned")
+        return None
+
+    pinned = cores[slot * cores_per_worker:(slot + 1) * cores_per_worker]
+    # The affinity is per thread on linux, the threads created afterwards inherit it
+    for thread_id in os.listdir("/proc/self/task"):
+        try:
+            os.sched_setaffinity(int(thread_id), pinned)
+        except (ProcessLookupError, PermissionError):
+            pass
+    logger.info(f"Worker {os.getpid()} is pinned to cores {pinned}")
+    return pinned
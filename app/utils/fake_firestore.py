@@ -0,0 +1,227 @@
+"""In-memory stand-in for the parts of `google.cloud.firestore.Client` used by the services
+
+Used by the tests and benchmarks that have to run without a Firestore project or emulator.
+Documents read by a query are counted in `reads`, including the ones skipped by `offset`,
+the same way Firestore bills them. Every write sets the update time of the document, so the
+`last_update_time` preconditions of `write_option` fail like in Firestore.
+"""
+import copy
+from datetime import datetime, timedelta
+from functools import cmp_to_key
+
+from google.api_core.exceptions import FailedPrecondition
+
+DOCUMENT_ID = "__name__"
+MAX_BATCH_WRITES = 500
+
+
+class FakeWriteOption:
+    def __init__(self, last_update_time: datetime):
+        self.last_update_time = last_update_time
+
+
+class FakeDocumentSnapshot:
+    def __init__(self, reference, data, update_time: datetime = None):
+        self.reference = reference
+        self.id = reference.id
+        self.update_time = update_time
+        self._data = data
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def get(self, field: str):
+        if field == DOCUMENT_ID:
+            return self.id
+        return self._data[field]
+
+    def to_dict(self):
+        return copy.deepcopy(self._data)
+
+
+class FakeDocumentReference:
+    def __init__(self, client, collection: str, id: str):
+        self._client = client
+        self._collection = collection
+        self.id = id
+
+    @property
+    def _documents(self):
+        return self._client._collections.setdefault(self._collection, {})
+
+    @property
+    def _key(self):
+        return self._collection, self.id
+
+    @property
+    def update_time(self):
+        return self._client._update_times.get(self._key)
+
+    def get(self):
+        self._client.reads += 1
+        return FakeDocumentSnapshot(self, copy.deepcopy(self._documents.get(self.id)), self.update_time)
+
+    def check(self, option: FakeWriteOption = None):
+        if option is not None and option.last_update_time != self.update_time:
+            raise FailedPrecondition(f"{self._collection}/{self.id} was updated after {option.last_update_time}")
+
+    def set(self, data: dict):
+        self._client.writes += 1
+        self._documents[self.id] = copy.deepcopy(data)
+        self._client._touch(self._key)
+
+    def update(self, data: dict, option: FakeWriteOption = None):
+        if self.id not in self._documents:
+            raise KeyError(f"No document to update: {self._collection}/{self.id}")
+        self.check(option)
+        self._client.writes += 1
+        self._documents[self.id].update(copy.deepcopy(data))
+        self._client._touch(self._key)
+
+    def delete(self):
+        self._client.writes += 1
+        self._documents.pop(self.id, None)
+        self._client._update_times.pop(self._key, None)
+
+
+def _compare(a, b):
+    return (a > b) - (a < b)
+
+
+class FakeQuery:
+    def __init__(self, client, collection: str, filters=(), orders=(), limit=None, offset=0, start_after=None):
+        self._client = client
+        self._collection = collection
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit
+        self._offset = offset
+        self._start_after = start_after
+
+    def _copy(self, **kwargs):
+        values = dict(filters=self._filters, orders=self._orders, limit=self._limit,
+                      offset=self._offset, start_after=self._start_after)
+        values.update(kwargs)
+        return FakeQuery(self._client, self._collection, **values)
+
+    def document(self, id: str):
+        return FakeDocumentReference(self._client, self._collection, id)
+
+    def where(self, field: str, op: str, value):
+        return self._copy(filters=self._filters + ((field, op, value),))
+
+    def order_by(self, field: str, direction: str = "ASCENDING"):
+        return self._copy(orders=self._orders + ((field, direction),))
+
+    def limit(self, count: int):
+        return self._copy(limit=count)
+
+    def offset(self, count: int):
+        return self._copy(offset=count)
+
+    def start_after(self, cursor):
+        if isinstance(cursor, FakeDocumentSnapshot):
+            fields = [field for field, _ in self._orders] + [DOCUMENT_ID]
+            cursor = {field: cursor.get(field) for field in fields}
+        cursor = {field: value.id if isinstance(value, FakeDocumentReference) else value
+                  for field, value in cursor.items()}
+        return self._copy(start_after=cursor)
+
+    @staticmethod
+    def _compare_snapshot(orders, snapshot: FakeDocumentSnapshot, values: dict):
+        for field, direction in orders:
+            result = _compare(snapshot.get(field), values[field])
+            if result:
+                return -result if direction == "DESCENDING" else result
+        return 0
+
+    def _matches(self, data: dict):
+        for field, op, value in self._filters:
+            if op == "==" and data.get(field) != value:
+                return False
+            if op == "in" and data.get(field) not in value:
+                return False
+        return True
+
+    def stream(self):
+        documents = self._client._collections.get(self._collection, {})
+        snapshots = [FakeDocumentSnapshot(self.document(id), copy.deepcopy(data),
+                                          self._client._update_times.get((self._collection, id)))
+                     for id, data in documents.items() if self._matches(data)]
+        # Firestore always orders by the document id last
+        orders = self._orders
+        if all(field != DOCUMENT_ID for field, _ in orders):
+            orders += ((DOCUMENT_ID, orders[-1][1] if orders else "ASCENDING"),)
+        snapshots.sort(key=cmp_to_key(lambda a, b: self._compare_snapshot(
+            orders, a, {field: b.get(field) for field, _ in orders})))
+
+        if self._start_after is not None:
+            cursor_orders = [(field, direction) for field, direction in orders if field in self._start_after]
+            snapshots = [s for s in snapshots if self._compare_snapshot(cursor_orders, s, self._start_after) > 0]
+
+        end = None if self._limit is None else self._offset + self._limit
+        snapshots = snapshots[:end]
+        self._client.reads += len(snapshots)
+        return iter(snapshots[self._offset:])
+
+    def get(self):
+        return list(self.stream())
+
+
+class FakeWriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def _add(self, write, check=None):
+        if len(self._writes) >= MAX_BATCH_WRITES:
+            raise ValueError(f"A batch can not have more than {MAX_BATCH_WRITES} writes")
+        self._writes.append((write, check))
+
+    def set(self, reference: FakeDocumentReference, data: dict):
+        self._add(lambda: reference.set(data))
+
+    def update(self, reference: FakeDocumentReference, data: dict, option: FakeWriteOption = None):
+        self._add(lambda: reference.update(data), lambda: reference.check(option))
+
+    def delete(self, reference: FakeDocumentReference):
+        self._add(reference.delete)
+
+    def commit(self):
+        # Atomic like Firestore, one failed precondition and nothing of the batch is written
+        writes, self._writes = self._writes, []
+        for _, check in writes:
+            if check is not None:
+                check()
+        self._client.commits += 1
+        for write, _ in writes:
+            write()
+
+
+class FakeFirestore:
+    def __init__(self):
+        self._collections: dict[str, dict[str, dict]] = {}
+        self.reads = 0
+        self.writes = 0
+        self.commits = 0
+        self._update_times: dict[tuple, datetime] = {}
+        self._clock = datetime(2022, 1, 1)
+
+    def _touch(self, key: tuple):
+        # Strictly increasing, two writes in the same microsecond still get different update times
+        self._clock = max(self._clock + timedelta(microseconds=1), datetime.now())
+        self._update_times[key] = self._clock
+
+    def collection(self, name: str):
+        return FakeQuery(self, name)
+
+    @staticmethod
+    def write_option(last_update_time: datetime):
+        return FakeWriteOption(last_update_time)
+
+    def batch(self):
+        return FakeWriteBatch(self)
+
+    def close(self):
+        pass
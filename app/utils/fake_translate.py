@@ -0,0 +1,61 @@
+"""In-memory stand-in of the translate_v2 client, for running the translation code without google cloud
+
+Only the `translate` call is implemented. The words of a small indonesian dictionary are
+translated and every other word is kept, the result is html escaped like the real api does.
+The request limits of the api are enforced so a caller that sends too much fails here too, and
+a delay or an error can be set to play a slow or broken api.
+"""
+import html
+import re
+import time
+
+# Limits of one translate request of the api
+MAX_SEGMENTS = 128
+MAX_CHARACTERS = 30000
+WORDS = {
+    "aku": "I",
+    "saya": "I",
+    "kamu": "you",
+    "dia": "they",
+    "senang": "happy",
+    "bahagia": "happy",
+    "sedih": "sad",
+    "marah": "angry",
+    "takut": "afraid",
+    "cinta": "love",
+    "kaget": "surprised",
+    "hari": "day",
+    "ini": "this",
+    "sangat": "very",
+    "tidak": "not",
+    "dan": "and",
+}
+WORD = re.compile(r"\w+")
+
+
+class FakeTranslateClient:
+    def __init__(self, detected_source_language: str = "id", delay_seconds: float = 0):
+        self.detected_source_language = detected_source_language
+        self.delay_seconds = delay_seconds
+        self.error = None
+        # The values of every call, to check how the texts were packed into requests
+        self.calls: list[list[str]] = []
+
+    def translate(self, values, target_language: str = None, **kwargs):
+        single = isinstance(values, str)
+        values = [values] if single else list(values)
+        if len(values) > MAX_SEGMENTS:
+            raise ValueError(f"A translate request can not have more than {MAX_SEGMENTS} values")
+        if sum(len(value) for value in values) > MAX_CHARACTERS:
+            raise ValueError(f"A translate request can not have more than {MAX_CHARACTERS} characters")
+        self.calls.append(values)
+        if self.delay_seconds:
+            time.sleep(self.delay_seconds)
+        if self.error is not None:
+            raise self.error
+
+        results = [{
+            "translatedText": html.escape(WORD.sub(lambda match: WORDS.get(match.group().lower(), match.group()), value)),
+            "detectedSourceLanguage": self.detected_source_language,
+            "input": value} for value in values]
+        return results[0] if single else results
@@ -0,0 +1,88 @@
+"""Character trigram language identifier, to tell an english diary apart without the translate api
+
+Every language has a trigram profile built from a word list ranked by frequency, a word of rank
+r counts 1 / r times like in a real text. A text is scored with the mean log likelihood of its
+trigrams under every profile and the confidence is the posterior of the best language over those
+per-trigram likelihoods, so it does not go to 1 just because the text is long. A text that fits
+the best profile much worse than the profile's own entropy (another language than the profiled
+ones) gets no answer.
+"""
+import math
+import os
+import re
+from collections import Counter
+from functools import lru_cache
+
+from app.utils.vocabulary import Vocabulary
+
+WORD = re.compile(r"[^\W\d_]+")
+NGRAM = 3
+# The zipf weights of a profile are scaled to this many trigrams before the add-one smoothing
+PROFILE_SIZE = 100000
+UTILS_DIRECTORY = os.path.dirname(os.path.realpath(__file__))
+
+
+def iter_ngrams(text: str):
+    for word in WORD.findall(text.lower()):
+        padded = f" {word} "
+        for start in range(len(padded) - NGRAM + 1):
+            yield padded[start:start + NGRAM]
+
+
+def build_profile(words: list[str]):
+    """Trigram counts of words ranked by frequency, weighted by zipf's law"""
+    counts = Counter()
+    for rank, word in enumerate(words, start=1):
+        for ngram in iter_ngrams(word):
+            counts[ngram] += 1 / rank
+    return counts
+
+
+class LanguageIdentifier:
+    def __init__(self, profiles: dict[str, Counter], min_ngrams: int = 20, max_divergence: float = 1.0):
+        self.min_ngrams = min_ngrams
+        self.max_divergence = max_divergence
+        self._log_probabilities = {}
+        self._unseen = {}
+        self._entropy = {}
+        for language, counts in profiles.items():
+            scale = PROFILE_SIZE / sum(counts.values())
+            total = PROFILE_SIZE + len(counts) + 1
+            log_probabilities = {ngram: math.log((count * scale + 1) / total) for ngram, count in counts.items()}
+            self._log_probabilities[language] = log_probabilities
+            self._unseen[language] = math.log(1 / total)
+            self._entropy[language] = -sum(math.exp(value) * value for value in log_probabilities.values())
+
+    @property
+    def languages(self):
+        return list(self._log_probabilities)
+
+    def detect(self, text: str):
+        """Return the most likely language and its confidence, (None, 0) if the text can not be told"""
+        ngrams = Counter(iter_ngrams(text))
+        ngram_count = sum(ngrams.values())
+        if ngram_count < self.min_ngrams:
+            return None, 0.0
+
+        likelihoods = {}
+        for language, log_probabilities in self._log_probabilities.items():
+            unseen = self._unseen[language]
+            likelihoods[language] = sum(count * log_probabilities.get(ngram, unseen)
+                                        for ngram, count in ngrams.items()) / ngram_count
+        language = max(likelihoods, key=likelihoods.get)
+        best = likelihoods[language]
+        if best + self._entropy[language] < -self.max_divergence:
+            return None, 0.0
+        confidence = 1 / sum(math.exp(likelihood - best) for likelihood in likelihoods.values())
+        return language, confidence
+
+
+@lru_cache(maxsize=1)
+def get_language_identifier():
+    """English from the tokenizer vocabulary (ids are frequency ranks) and indonesian from words-id.txt"""
+    vocabulary = Vocabulary(os.path.join(UTILS_DIRECTORY, "vocabulary.bin"))
+    with open(os.path.join(UTILS_DIRECTORY, "words-id.txt"), encoding="utf-8") as f:
+        indonesian_words = [line.strip() for line in f if line.strip()]
+    return LanguageIdentifier({
+        "en": build_profile(vocabulary.words_by_id()),
+        "id": build_profile(indonesian_words)})
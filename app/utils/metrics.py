@@ -0,0 +1,139 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+# Upper bounds of the histogram buckets, the last bucket is everything above the last bound
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q: float):
+        # Approximated with the upper bound of the bucket where the percentile falls in
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count > 0:
+                if i < len(self.buckets):
+                    return min(self.buckets[i], self.max)
+                return self.max
+        return self.max
+
+    def snapshot(self):
+        upper_bounds = [str(b) for b in self.buckets] + ["+Inf"]
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "mean": self.total / self.count if self.count else None,
+            "max": self.max,
+            "p50": self.percentile(0.5),
+            "p90": self.percentile(0.9),
+            "p99": self.percentile(0.99),
+            "buckets": dict(zip(upper_bounds, self.counts)),
+        }
+
+
+class MetricsRegistry:
+    """In-process counters, gauges and histograms, every gunicorn worker has its own registry"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: dict[str, float] = {}
+        self._gauges: dict[str, float] = {}
+        self._histograms: dict[str, Histogram] = {}
+
+    def increment(self, name: str, value: float = 1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def set_gauge(self, name: str, value: float):
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name: str, value: float, buckets=LATENCY_BUCKETS_MS):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram(buckets)
+            histogram.observe(value)
+
+    def get_counter(self, name: str):
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def get_histogram(self, name: str):
+        with self._lock:
+            return self._histograms.get(name)
+
+    def snapshot(self, prefix: str = ""):
+        with self._lock:
+            return {
+                "pid": os.getpid(),
+                "counters": {name: v for name, v in self._counters.items() if name.startswith(prefix)},
+                "gauges": {name: v for name, v in self._gauges.items() if name.startswith(prefix)},
+                "histograms": {name: h.snapshot() for name, h in self._histograms.items() if name.startswith(prefix)},
+            }
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+
+metrics = MetricsRegistry()
+
+
+STAGE_PREFIX = "stage."
+# Stage durations of the current request, only set while a request collects them for the Server-Timing header
+_stage_timings: ContextVar[Optional[dict[str, float]]] = ContextVar("stage_timings", default=None)
+
+
+@contextmanager
+def timed(stage: str):
+    """Time a stage of the pipeline into the `stage.<name>_ms` histogram and the request timings"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = (time.perf_counter() - start) * 1000
+        metrics.observe(f"{STAGE_PREFIX}{stage}_ms", elapsed)
+        timings = _stage_timings.get()
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0) + elapsed
+
+
+@contextmanager
+def collect_stage_timings():
+    # The dict is shared with the copies of the context made for the threadpool, so stages timed there show up
+    timings: dict[str, float] = {}
+    token = _stage_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _stage_timings.reset(token)
+
+
+def server_timing_header(timings: dict[str, float]):
+    return ", ".join(f"{stage};dur={duration:.2f}" for stage, duration in timings.items())
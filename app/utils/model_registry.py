@@ -0,0 +1,136 @@
+"""Versioned emotion models that can be swapped without restarting the worker
+
+The registry holds the model that serves the requests. `swap()` loads another version in a
+background thread, runs the probe batches through it so the first real request does not pay
+the warm-up, and only then replaces the active model with a single reference assignment.
+Requests that already took the previous model keep using it, it is closed after a grace period.
+"""
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Optional
+
+import numpy as np
+
+from app import logger
+from app.utils.metrics import metrics
+
+
+class LoadedModel:
+    """A model with the version it was loaded from, it has the same `predict` as the model"""
+
+    def __init__(self, version: str, model):
+        self.version = version
+        self.model = model
+        self.loaded_at = datetime.now()
+
+    def predict(self, inputs: np.ndarray):
+        return self.model.predict(inputs)
+
+
+class ModelRegistry:
+    def __init__(
+            self,
+            loader: Callable[[str], object],
+            initial_version: str,
+            probe: Callable[[], list[np.ndarray]] = None,
+            retire_seconds: float = 60):
+        self.initial_version = initial_version
+        self.retire_seconds = retire_seconds
+        self._loader = loader
+        self._probe = probe
+        self._active: Optional[LoadedModel] = None
+        self._lock = threading.Lock()
+        self._loading_version: Optional[str] = None
+        self._loading_thread: Optional[threading.Thread] = None
+        self.last_error: Optional[str] = None
+        self.listeners: list[Callable[["ModelRegistry"], None]] = []
+
+    def current(self) -> LoadedModel:
+        """The model to use for the whole request, so its version matches the predictions"""
+        active = self._active
+        while active is None:
+            with self._lock:
+                active = self._active
+                thread = self._loading_thread
+                if active is None and thread is None:
+                    self._active = active = self._load(self.initial_version)
+            if active is None:
+                # Wait for the background load started on boot instead of loading a second copy, if it
+                # fails the next turn loads the initial version here
+                thread.join()
+        return active
+
+    def predict(self, inputs: np.ndarray):
+        return self.current().predict(inputs)
+
+    @property
+    def version(self):
+        return self.current().version
+
+    @property
+    def loading_version(self):
+        return self._loading_version
+
+    def _load(self, version: str):
+        start = time.monotonic()
+        loaded = LoadedModel(version, self._loader(version))
+        for inputs in self._probe() if self._probe is not None else []:
+            outputs = np.asarray(loaded.predict(inputs))
+            if len(outputs) != len(inputs) or not np.isfinite(outputs).all():
+                raise ValueError(f"Model {version} gave an invalid output for the probe batch")
+        metrics.observe("model_registry.load_time_ms", (time.monotonic() - start) * 1000)
+        logger.info(f"Model {version} is loaded in {time.monotonic() - start:.1f}s")
+        return loaded
+
+    def swap(self, version: str, wait: bool = False):
+        """Load the version in the background, False if it is already active or being loaded"""
+        with self._lock:
+            active_version = self._active.version if self._active is not None else None
+            if version in (active_version, self._loading_version):
+                return False
+            self._loading_version = version
+            # Set and started with the version, so a request that finds no active model can join this thread
+            thread = threading.Thread(target=self._swap, args=(version,), name=f"model-registry-{version}",
+                                      daemon=True)
+            self._loading_thread = thread
+            thread.start()
+        if wait:
+            thread.join()
+        return True
+
+    def _swap(self, version: str):
+        try:
+            loaded = self._load(version)
+        except Exception as e:
+            logger.exception(f"Model {version} can not be loaded, keep serving the current model")
+            metrics.increment("model_registry.failed_swaps")
+            self.last_error = f"{version}: {e}"
+        else:
+            with self._lock:
+                previous, self._active = self._active, loaded
+            metrics.increment("model_registry.swaps")
+            self.last_error = None
+            if previous is not None:
+                self._retire(previous)
+        finally:
+            with self._lock:
+                self._loading_version = None
+                self._loading_thread = None
+            for listener in self.listeners:
+                listener(self)
+
+    def _retire(self, previous: LoadedModel):
+        close = getattr(previous.model, "close", None)
+        if close is not None:
+            timer = threading.Timer(self.retire_seconds, close)
+            timer.daemon = True
+            timer.start()
+
+    def status(self):
+        active = self._active
+        return {
+            "version": active.version if active is not None else None,
+            "loaded_at": active.loaded_at if active is not None else None,
+            "loading_version": self._loading_version,
+            "error": self.last_error}
@@ -0,0 +1,155 @@
+"""Deadline, hedged request and circuit breaker around the calls to an external api
+
+A call runs in a thread of its own pool so the caller stops waiting at the deadline even if the
+api never answers. When the first attempt is slower than a percentile of the recent latencies a
+second one is sent and the first answer wins. Consecutive failures open the circuit breaker: the
+calls fail right away without reaching the api until reset_seconds later, then one trial call
+decides whether it closes again.
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from app.utils.metrics import metrics
+
+# Value of the <name>.circuit_breaker.state gauge
+BREAKER_STATES = {"closed": 0, "half-open": 1, "open": 2}
+LATENCY_WINDOW = 256
+# Recent latencies needed before the percentile is trusted for hedging
+MIN_HEDGE_SAMPLES = 20
+
+
+class Unavailable(Exception):
+    """The call failed, timed out or was not even tried because the circuit breaker is open"""
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int = 5, reset_seconds: float = 30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._publish()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        if self._state == "open" and time.monotonic() - self._opened_at >= self.reset_seconds:
+            self._state = "half-open"
+            self._trial_running = False
+            self._publish()
+        return self._state
+
+    def allow(self):
+        with self._lock:
+            state = self._current_state()
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._trial_running = False
+            if self._state != "closed":
+                self._state = "closed"
+                self._publish()
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if self._state == "half-open" or (self._state == "closed" and self._failures >= self.failure_threshold):
+                self._state = "open"
+                self._opened_at = time.monotonic()
+                metrics.increment(f"{self.name}.circuit_breaker.opened")
+                self._publish()
+
+    def _publish(self):
+        metrics.set_gauge(f"{self.name}.circuit_breaker.state", BREAKER_STATES[self._state])
+
+
+class ResilientCaller:
+    def __init__(
+            self,
+            name: str,
+            deadline_seconds: float,
+            breaker: CircuitBreaker,
+            hedge_percentile: float = 0,
+            max_workers: int = 16):
+        self.name = name
+        self.deadline = deadline_seconds
+        self.breaker = breaker
+        self.hedge_percentile = hedge_percentile
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+
+    def hedge_delay(self):
+        """Seconds to wait for the first attempt before sending the second one, None to never hedge"""
+        if not self.hedge_percentile:
+            return None
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if len(latencies) < MIN_HEDGE_SAMPLES:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * self.hedge_percentile))]
+
+    def call(self, function, *args, **kwargs):
+        if not self.breaker.allow():
+            metrics.increment(f"{self.name}.rejected")
+            raise Unavailable(f"The {self.name} circuit breaker is open")
+
+        start = time.monotonic()
+        attempts = [self._executor.submit(function, *args, **kwargs)]
+        pending = set(attempts)
+        hedge_delay = self.hedge_delay()
+        hedge_at = start + hedge_delay if hedge_delay is not None and hedge_delay < self.deadline else None
+
+        error = None
+        while pending:
+            now = time.monotonic()
+            remaining = start + self.deadline - now
+            if remaining <= 0:
+                break
+            timeout = remaining if hedge_at is None else min(remaining, max(hedge_at - now, 0))
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    latency = time.monotonic() - start
+                    with self._lock:
+                        self._latencies.append(latency)
+                    metrics.observe(f"{self.name}.time_ms", latency * 1000)
+                    if future is not attempts[0]:
+                        metrics.increment(f"{self.name}.hedge_wins")
+                    self.breaker.record_success()
+                    return future.result()
+                error = future.exception()
+
+            if hedge_at is not None and pending and time.monotonic() >= hedge_at:
+                # The first attempt is slower than the percentile, the first of the two answers wins
+                hedge_at = None
+                metrics.increment(f"{self.name}.hedged")
+                attempts.append(self._executor.submit(function, *args, **kwargs))
+                pending.add(attempts[-1])
+
+        # The attempts still running finish in the pool, only their result is ignored
+        for future in pending:
+            future.cancel()
+        self.breaker.record_failure()
+        if error is None:
+            metrics.increment(f"{self.name}.deadline_exceeded")
+            raise Unavailable(f"{self.name} did not answer within {self.deadline}s")
+        metrics.increment(f"{self.name}.errors")
+        raise Unavailable(f"{self.name} failed: {error}") from error
@@ -0,0 +1,43 @@
+import numpy as np
+
+
+def pad_sequences(sequences: list[list[int]], maxlen: int, dtype="int32"):
+    """Same output as keras `pad_sequences(padding="post", truncating="post")` without importing tensorflow"""
+    padded = np.zeros((len(sequences), maxlen), dtype=dtype)
+    for i, sequence in enumerate(sequences):
+        sequence = sequence[:maxlen]
+        padded[i, :len(sequence)] = sequence
+    return padded
+
+
+def bucket_length(length: int, buckets: list[int], maxlen: int):
+    for bucket in sorted(buckets):
+        if length <= bucket <= maxlen:
+            return bucket
+    return maxlen
+
+
+def pad_by_bucket(sequences: list[list[int]], buckets: list[int], maxlen: int, dtype="int32"):
+    """Group the sequences by length bucket and pad every group only up to its bucket length.
+
+    Padding and truncating are done at the end of the sequence, like `pad_sequences(padding="post",
+    truncating="post")`. Returns a list of (row indices in the input, padded array) tuples.
+    """
+    groups: dict[int, list[int]] = {}
+    for i, sequence in enumerate(sequences):
+        length = min(len(sequence), maxlen)
+        groups.setdefault(bucket_length(length, buckets, maxlen), []).append(i)
+
+    return [(indices, pad_sequences([sequences[i] for i in indices], length, dtype))
+            for length, indices in sorted(groups.items())]
+
+
+def predict_by_bucket(model, sequences: list[list[int]], buckets: list[int], maxlen: int):
+    """Run every length bucket as its own sub-batch and merge the predictions back in input order"""
+    predictions = None
+    for indices, padded in pad_by_bucket(sequences, buckets, maxlen):
+        output = np.asarray(model.predict(padded))
+        if predictions is None:
+            predictions = np.empty((len(sequences),) + output.shape[1:], dtype=output.dtype)
+        predictions[indices] = output
+    return predictions
@@ -0,0 +1,171 @@
+"""Inference sidecar that owns the only copy of the emotion model on the instance
+
+Every gunicorn worker loads its own model by default. When `inference_sidecar_socket` is set,
+start the sidecar next to gunicorn and the workers send their padded sentences to it instead:
+
+    python -m app.utils.sidecar & gunicorn -w 4 -k uvicorn.workers.UvicornWorker app.main:app
+
+Frames are little endian. A request is the magic, the number of rows and columns, then the token
+ids as int32. A response is a status byte, rows and columns, the length of the model version, the
+utf-8 version, then the probabilities as float32. A request without rows only asks the version.
+An error response has status 1, the message length in place of the rows and the utf-8 message.
+"""
+import os
+import socket
+import socketserver
+import struct
+import threading
+
+import numpy as np
+
+from app import logger
+from app.utils.classifier import EmotionClassifier
+from app.utils.metrics import metrics
+
+MAGIC = b"EMO2"
+REQUEST_HEADER = struct.Struct("<4sII")
+RESPONSE_HEADER = struct.Struct("<BIIH")
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+
+class SidecarError(Exception):
+    pass
+
+
+def recv_exactly(sock: socket.socket, size: int):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:], size - received)
+        if count == 0:
+            raise ConnectionError("The inference sidecar closed the connection")
+        received += count
+    return bytes(buffer)
+
+
+class _InferenceHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        # A worker keeps its connection open, so serve frames until it disconnects
+        while True:
+            try:
+                magic, rows, cols = REQUEST_HEADER.unpack(recv_exactly(self.request, REQUEST_HEADER.size))
+            except ConnectionError:
+                return
+            if magic != MAGIC:
+                logger.warning("Inference sidecar received an invalid frame, closing the connection")
+                return
+
+            payload = recv_exactly(self.request, rows * cols * 4)
+            inputs = np.frombuffer(payload, dtype="<i4").reshape(rows, cols)
+            # The version sent back is the one of the model that made these predictions
+            classifier = self.server.classifier
+            if hasattr(classifier, "current"):
+                classifier = classifier.current()
+            try:
+                if rows:
+                    outputs = np.ascontiguousarray(classifier.predict(inputs), dtype="<f4")
+                else:
+                    outputs = np.zeros((0, 0), dtype="<f4")
+            except Exception as e:
+                message = str(e).encode("utf-8")
+                self.request.sendall(RESPONSE_HEADER.pack(STATUS_ERROR, len(message), 0, 0) + message)
+                continue
+            version = (getattr(classifier, "version", None) or "").encode("utf-8")
+            self.request.sendall(RESPONSE_HEADER.pack(STATUS_OK, *outputs.shape, len(version)) + version +
+                                 outputs.tobytes())
+
+
+class InferenceServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, classifier):
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        self.classifier = classifier
+        super().__init__(socket_path, _InferenceHandler)
+
+
+class SidecarClassifier(EmotionClassifier):
+    """Client of the sidecar, it falls back to the in-process model if the sidecar can not be reached"""
+
+    backend = "sidecar"
+
+    def __init__(self, socket_path: str, fallback=None, timeout: float = 30):
+        self.socket_path = socket_path
+        self.fallback = fallback
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        # Connections are per thread and are never shared with a forked child
+        sock = getattr(self._local, "sock", None)
+        if sock is None or self._local.pid != os.getpid():
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            self._local.sock = sock
+            self._local.pid = os.getpid()
+        return sock
+
+    def _close(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is not None:
+            sock.close()
+        self._local.sock = None
+
+    def _request(self, inputs: np.ndarray):
+        inputs = np.ascontiguousarray(inputs, dtype="<i4")
+        sock = self._connection()
+        sock.sendall(REQUEST_HEADER.pack(MAGIC, *inputs.shape) + inputs.tobytes())
+        status, rows, cols, version_length = RESPONSE_HEADER.unpack(recv_exactly(sock, RESPONSE_HEADER.size))
+        if status == STATUS_ERROR:
+            raise SidecarError(recv_exactly(sock, rows).decode("utf-8"))
+        version = recv_exactly(sock, version_length).decode("utf-8") or None
+        payload = recv_exactly(sock, rows * cols * 4)
+        return np.frombuffer(payload, dtype="<f4").reshape(rows, cols), version
+
+    @property
+    def version(self):
+        """Version of the model that answered the last request of this thread, asked to the sidecar if none did yet"""
+        if not hasattr(self._local, "version"):
+            self.predict(np.zeros((0, 0), dtype="<i4"))
+        return self._local.version
+
+    def predict(self, inputs: np.ndarray) -> np.ndarray:
+        try:
+            outputs, self._local.version = self._request(inputs)
+            metrics.increment("sidecar.requests")
+            return outputs
+        except OSError as e:
+            self._close()
+            if self.fallback is None:
+                raise
+            metrics.increment("sidecar.fallbacks")
+            logger.warning(f"Inference sidecar is not reachable ({e}), using the in-process model")
+            model = self.fallback()
+            if hasattr(model, "current"):
+                model = model.current()
+            self._local.version = getattr(model, "version", None)
+            return model.predict(inputs) if len(inputs) else np.zeros((0, 0), dtype="float32")
+
+
+def main():
+    from app.database import get_fs
+    from app.dependencies import get_model_registry
+    from app.services.model import start_model_sync
+    from config import get_settings
+
+    settings = get_settings()
+    # The registry is served as is, so every frame goes to the version that is active at that moment
+    registry = get_model_registry()
+    server = InferenceServer(settings.inference_sidecar_socket, registry)
+    if settings.model_sync_interval_seconds > 0:
+        start_model_sync(registry, next(get_fs()), settings.model_version, settings.model_sync_interval_seconds)
+    logger.info(f"Inference sidecar is listening on {settings.inference_sidecar_socket}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
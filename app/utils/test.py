@@ -14,6 +14,8 @@ DIARY_RESPONSE_KEYS = [
     "content",
     "translatedContent",
     "emotion",
+    "emotionScores",
+    "status",
     "timeCreated",
     "timeUpdated",
     "userId"]
@@ -0,0 +1,93 @@
+import numpy as np
+
+from app.utils.vocabulary import Vocabulary
+
+
+class BatchTokenizer:
+    """Tokenize a batch of sentences straight into the padded array the model takes.
+
+    It gives the same ids as keras `texts_to_sequences` followed by `pad_sequences(padding="post",
+    truncating="post")`, but the filters are compiled once into a translation table, every distinct
+    word of the batch is looked up only once and the ids are scattered into a preallocated array.
+    Works on top of the keras Tokenizer or the memory-mapped Vocabulary.
+    """
+
+    def __init__(self, tokenizer, cache_size: int = 16384):
+        self.tokenizer = tokenizer
+        self.lower = tokenizer.lower
+        self.split = tokenizer.split
+        self.num_words = tokenizer.num_words
+        self._translate_map = str.maketrans({c: tokenizer.split for c in tokenizer.filters})
+        self._cache: dict[str, int] = {}
+        self._cache_size = cache_size
+
+        if isinstance(tokenizer, Vocabulary):
+            self.oov_index = tokenizer.oov_index
+            self._lookup = tokenizer.word_id
+        else:
+            if tokenizer.char_level or getattr(tokenizer, "analyzer", None) is not None:
+                raise ValueError("Only word level tokenizer without custom analyzer is supported")
+            self.oov_index = tokenizer.word_index.get(tokenizer.oov_token)
+            self._lookup = self._lookup_word_index
+
+    def _lookup_word_index(self, word: str):
+        index = self.tokenizer.word_index.get(word)
+        if index is not None and self.num_words and index >= self.num_words:
+            return None
+        return index
+
+    def _split(self, text: str):
+        if self.lower:
+            text = text.lower()
+        return [word for word in text.translate(self._translate_map).split(self.split) if word]
+
+    def _word_ids(self, words: list[str]):
+        # Only the words that were never seen go through the (binary search) lookup
+        cache = self._cache
+        unique_words = dict.fromkeys(words)
+        missing = [word for word in unique_words if word not in cache]
+        if len(cache) + len(missing) > self._cache_size:
+            cache = self._cache = {}
+            missing = unique_words
+        for word in missing:
+            index = self._lookup(word)
+            cache[word] = self.oov_index if index is None else index
+
+        ids = [cache[word] for word in words]
+        if self.oov_index is None:
+            ids = [index for index in ids if index is not None]
+        return ids
+
+    def tokenize(self, texts: list[str]):
+        """Return the ids of all texts concatenated and the number of ids of every text"""
+        split_texts = [self._split(text) for text in texts]
+        words = [word for split_text in split_texts for word in split_text]
+        if self.oov_index is None:
+            # Unknown words are dropped, so the lengths can only be known per text
+            sequences = [self._word_ids(split_text) for split_text in split_texts]
+            lengths = np.array([len(sequence) for sequence in sequences], dtype=np.int64)
+            ids = np.fromiter((index for sequence in sequences for index in sequence), dtype=np.int64)
+            return ids, lengths
+
+        lengths = np.array([len(split_text) for split_text in split_texts], dtype=np.int64)
+        return np.array(self._word_ids(words), dtype=np.int64), lengths
+
+    def encode(self, texts: list[str], maxlen: int, dtype="int32"):
+        ids, lengths = self.tokenize(texts)
+        padded = np.zeros((len(texts), maxlen), dtype=dtype)
+        if len(ids) == 0:
+            return padded
+
+        kept = np.minimum(lengths, maxlen)
+        starts = np.cumsum(lengths) - lengths
+        kept_starts = np.cumsum(kept) - kept
+        rows = np.repeat(np.arange(len(texts)), kept)
+        cols = np.arange(kept.sum()) - np.repeat(kept_starts, kept)
+        padded[rows, cols] = ids[np.repeat(starts, kept) + cols]
+        return padded
+
+    def texts_to_sequences(self, texts: list[str]):
+        ids, lengths = self.tokenize(texts)
+        ids = ids.tolist()
+        ends = np.cumsum(lengths).tolist()
+        return [ids[end - length:end] for end, length in zip(ends, lengths.tolist())]
@@ -0,0 +1,143 @@
+"""Compact vocabulary that replaces the pickled keras Tokenizer at serving time
+
+The file only keeps what `texts_to_sequences` needs: the words whose id is below `num_words`,
+sorted by their utf-8 bytes, and the tokenizer options. It is memory-mapped read-only, so every
+worker on the instance shares the same pages instead of holding its own copy of the dictionaries.
+
+Layout (little endian):
+    header      magic, version, num_words (0 = no limit), oov id (-1 = no oov), lower,
+                word count, string table size, split and filters as length-prefixed utf-8
+    offsets     uint32[word count + 1], start of every word in the string table
+    ids         int32[word count]
+    strings     the sorted words concatenated
+"""
+import mmap
+import struct
+
+import numpy as np
+
+MAGIC = b"EMOVOCAB"
+VERSION = 1
+HEADER = struct.Struct("<8sIiiBII")
+TEXT_LENGTH = struct.Struct("<H")
+
+
+def _pack_text(text: str):
+    data = text.encode("utf-8")
+    return TEXT_LENGTH.pack(len(data)) + data
+
+
+def _align(size: int):
+    return (4 - size % 4) % 4
+
+
+def write_vocabulary(tokenizer, path: str):
+    """Convert a fitted keras Tokenizer (or anything with the same attributes) into the compact format"""
+    if tokenizer.char_level or getattr(tokenizer, "analyzer", None) is not None:
+        raise ValueError("Only word level tokenizer without custom analyzer is supported")
+
+    num_words = tokenizer.num_words or 0
+    words = sorted((word.encode("utf-8"), index) for word, index in tokenizer.word_index.items()
+                   if not num_words or index < num_words)
+    oov_index = tokenizer.word_index.get(tokenizer.oov_token) if tokenizer.oov_token is not None else None
+
+    offsets = np.zeros(len(words) + 1, dtype="<u4")
+    offsets[1:] = np.cumsum([len(word) for word, _ in words])
+    ids = np.array([index for _, index in words], dtype="<i4")
+    strings = b"".join(word for word, _ in words)
+
+    header = HEADER.pack(MAGIC, VERSION, num_words, -1 if oov_index is None else oov_index,
+                         int(bool(tokenizer.lower)), len(words), len(strings))
+    header += _pack_text(tokenizer.split) + _pack_text(tokenizer.filters)
+    header += b"\0" * _align(len(header))
+
+    with open(path, "wb") as f:
+        f.write(header)
+        f.write(offsets.tobytes())
+        f.write(ids.tobytes())
+        f.write(strings)
+    return path
+
+
+class Vocabulary:
+    """Read-only tokenizer that produces the same ids as keras `Tokenizer.texts_to_sequences`"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, num_words, oov_index, lower, word_count, strings_size = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a vocabulary file version {VERSION}")
+        self.num_words = num_words or None
+        self.oov_index = None if oov_index < 0 else oov_index
+        self.lower = bool(lower)
+
+        position = HEADER.size
+        self.split, position = self._read_text(position)
+        self.filters, position = self._read_text(position)
+        position += _align(position)
+
+        self._word_count = word_count
+        self._offsets = np.frombuffer(self._mmap, dtype="<u4", count=word_count + 1, offset=position)
+        position += self._offsets.nbytes
+        self._ids = np.frombuffer(self._mmap, dtype="<i4", count=word_count, offset=position)
+        position += self._ids.nbytes
+        self._strings_start = position
+        self._translate_map = str.maketrans({c: self.split for c in self.filters})
+
+    def _read_text(self, position: int):
+        (length,) = TEXT_LENGTH.unpack_from(self._mmap, position)
+        position += TEXT_LENGTH.size
+        return self._mmap[position:position + length].decode("utf-8"), position + length
+
+    def __len__(self):
+        return self._word_count
+
+    def _word_at(self, i: int):
+        start = self._strings_start + int(self._offsets[i])
+        end = self._strings_start + int(self._offsets[i + 1])
+        return self._mmap[start:end]
+
+    def words_by_id(self):
+        """Every word ordered by id, the ids of a keras tokenizer are the frequency ranks of the words"""
+        return [self._word_at(int(i)).decode("utf-8") for i in np.argsort(self._ids, kind="stable")
+                if self.oov_index is None or self._ids[i] != self.oov_index]
+
+    def word_id(self, word: str):
+        key = word.encode("utf-8")
+        low, high = 0, self._word_count
+        while low < high:
+            middle = (low + high) // 2
+            if self._word_at(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self._word_count and self._word_at(low) == key:
+            return int(self._ids[low])
+        return None
+
+    def text_to_word_sequence(self, text: str):
+        if self.lower:
+            text = text.lower()
+        return [word for word in text.translate(self._translate_map).split(self.split) if word]
+
+    def texts_to_sequences(self, texts: list[str]):
+        sequences = []
+        for text in texts:
+            if isinstance(text, list):
+                words = [word.lower() for word in text] if self.lower else text
+            else:
+                words = self.text_to_word_sequence(text)
+
+            sequence = []
+            for word in words:
+                # Words above num_words are not in the file, so they end up as oov like in keras
+                index = self.word_id(word)
+                if index is None:
+                    index = self.oov_index
+                if index is not None:
+                    sequence.append(index)
+            sequences.append(sequence)
+        return sequences
@@ -0,0 +1,115 @@
+"""Compare latency and resident memory of the classifier backends
+
+Every backend runs in its own process so the RSS only counts what the backend itself loads.
+Run `python convert-model.py` first to create the tflite model, and
+`python convert-model.py --quantize int8 --held-out diaries.txt` for the tflite-int8 one.
+
+Usage: python -m benchmarks.classifier --iterations 50
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+DIARY_SIZES = [1, 5, 10, 20]
+
+
+def measure(function, iterations: int):
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {"mean": statistics.mean(timings), "p99": timings[min(len(timings) - 1, int(len(timings) * 0.99))]}
+
+
+def model_size_mb(backend: str):
+    from app.dependencies import get_model_path
+    from config import ClassifierBackend, get_settings
+
+    settings = get_settings()
+    filename = {
+        ClassifierBackend.KERAS: "model.h5",
+        ClassifierBackend.TFLITE: settings.classifier_tflite_model,
+        ClassifierBackend.TFLITE_INT8: settings.classifier_quantized_model}[ClassifierBackend(backend)]
+    return os.path.getsize(get_model_path(filename)) / 1024 / 1024
+
+
+def run_child(backend: str, inputs_path: str, iterations: int):
+    from app.dependencies import load_classifier
+    from config import get_settings
+
+    settings = get_settings()
+    settings.classifier_backend = backend
+    start = time.perf_counter()
+    classifier = load_classifier()
+    load_ms = (time.perf_counter() - start) * 1000
+
+    inputs = np.load(inputs_path)
+    latency = {}
+    for size in DIARY_SIZES:
+        batch = inputs[f"size_{size}"]
+        classifier.predict(batch)
+        latency[size] = measure(lambda: classifier.predict(batch), iterations)
+
+    print(json.dumps({
+        "backend": backend,
+        "size_mb": model_size_mb(backend),
+        "load_ms": load_ms,
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "tensorflow_imported": "tensorflow" in sys.modules,
+        "latency": latency,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--backends", nargs="+", default=["keras", "tflite", "tflite-int8"])
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--inputs", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.inputs, args.iterations)
+        return
+
+    from essential_generators import DocumentGenerator
+
+    from app.dependencies import get_tokenizer
+    from app.services.diary import MAX_SEQUENCE_LENGTH
+
+    generator = DocumentGenerator()
+    tokenizer = get_tokenizer()
+    inputs = {}
+    for size in DIARY_SIZES:
+        inputs[f"size_{size}"] = tokenizer.encode([generator.sentence() for _ in range(size)], MAX_SEQUENCE_LENGTH)
+
+    with tempfile.NamedTemporaryFile(suffix=".npz") as f:
+        np.savez(f.name, **inputs)
+        results = []
+        for backend in args.backends:
+            output = subprocess.run(
+                [sys.executable, "-m", "benchmarks.classifier", "--child", backend,
+                 "--inputs", f.name, "--iterations", str(args.iterations)],
+                check=True, capture_output=True, text=True).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(f"{'backend':>11} {'size MB':>8} {'load ms':>9} {'rss MB':>8} {'tf':>5} " +
+          " ".join(f"{f'{size} sent ms':>11}" for size in DIARY_SIZES))
+    for result in results:
+        latency = " ".join(f"{result['latency'][str(size)]['mean']:>11.2f}" for size in DIARY_SIZES)
+        print(f"{result['backend']:>11} {result['size_mb']:>8.2f} {result['load_ms']:>9.0f} "
+              f"{result['max_rss_mb']:>8.0f} {str(result['tensorflow_imported']):>5} {latency}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""Compare the serving paths of the emotion model on typical diary sizes
+
+Usage: python -m benchmarks.inference --iterations 50
+
+The sweep mode starts --workers processes like gunicorn does, every one predicting from
+--concurrency threads at the same time, once for every combination of the thread settings:
+
+    python -m benchmarks.inference --sweep --workers 4 --intra-op 0 1 2 --inter-op 0 1 --cpu-cores 0 1
+"""
+import argparse
+import itertools
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+from essential_generators import DocumentGenerator
+
+from app.dependencies import get_inference_model, get_model, get_tokenizer
+from app.services.diary import prediction
+from app.utils.classifier import KerasClassifier
+from config import InferenceMode, get_settings
+
+DIARY_SIZES = [1, 5, 10, 20]
+
+
+def generate_diary(generator: DocumentGenerator, sentences: int):
+    return " ".join(generator.sentence() for _ in range(sentences))
+
+
+def measure(function, iterations: int):
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        "mean": statistics.mean(timings),
+        "p50": percentile(timings, 0.5),
+        "p99": percentile(timings, 0.99),
+    }
+
+
+def percentile(timings: list[float], fraction: float):
+    return timings[min(len(timings) - 1, int(len(timings) * fraction))] if timings else 0.0
+
+
+def run_load_child(duration: float, concurrency: int, start_at: float):
+    # Every diary is predicted again and again, the prediction cache would answer instead of the model
+    get_settings().prediction_cache = False
+    generator = DocumentGenerator()
+    tokenizer = get_tokenizer()
+    model = get_inference_model()
+    diaries = [generate_diary(generator, size) for size in DIARY_SIZES]
+    for diary in diaries:
+        prediction(diary, tokenizer, model)
+
+    late = time.time() > start_at
+    time.sleep(max(0.0, start_at - time.time()))
+    end = time.monotonic() + duration
+    timings = [[] for _ in range(concurrency)]
+
+    def run(thread_timings: list[float], offset: int):
+        i = offset
+        while time.monotonic() < end:
+            start = time.perf_counter()
+            prediction(diaries[i % len(diaries)], tokenizer, model)
+            thread_timings.append((time.perf_counter() - start) * 1000)
+            i += 1
+
+    threads = [threading.Thread(target=run, args=(timings[i], i)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print(json.dumps({"late": late, "timings": [timing for thread_timings in timings for timing in thread_timings]}))
+
+
+def sweep(args):
+    print(f"{'intra':>5} {'inter':>5} {'cores':>5} {'diary/s':>9} {'p50 ms':>9} {'p99 ms':>9}")
+    for intra_op, inter_op, cpu_cores in itertools.product(args.intra_op, args.inter_op, args.cpu_cores):
+        env = dict(os.environ, TF_INTRA_OP_THREADS=str(intra_op), TF_INTER_OP_THREADS=str(inter_op),
+                   WORKER_CPU_CORES=str(cpu_cores))
+        # Every worker loads its model first, then they all start the load at the same time
+        start_at = time.time() + args.warm_up
+        workers = [subprocess.Popen(
+            [sys.executable, "-m", "benchmarks.inference", "--load-child", "--duration", str(args.duration),
+             "--concurrency", str(args.concurrency), "--start-at", str(start_at)],
+            env=env, stdout=subprocess.PIPE, text=True) for _ in range(args.workers)]
+        results = [json.loads(worker.communicate()[0].strip().splitlines()[-1]) for worker in workers]
+
+        timings = sorted(timing for result in results for timing in result["timings"])
+        print(f"{intra_op:>5} {inter_op:>5} {cpu_cores:>5} {len(timings) / args.duration:>9.1f} "
+              f"{percentile(timings, 0.5):>9.2f} {percentile(timings, 0.99):>9.2f}")
+        if any(result["late"] for result in results):
+            print(f"Warning: a worker was not warm after {args.warm_up}s, increase --warm-up")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--sweep", action="store_true", help="Sweep the thread settings under a concurrent load")
+    parser.add_argument("--workers", type=int, default=4, help="Worker processes of the sweep")
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent requests of every worker")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds of load for every combination")
+    parser.add_argument("--warm-up", type=float, default=30, help="Seconds given to the workers to load the model")
+    parser.add_argument("--intra-op", type=int, nargs="+", default=[0, 1, 2], help="tf_intra_op_threads values")
+    parser.add_argument("--inter-op", type=int, nargs="+", default=[0, 1], help="tf_inter_op_threads values")
+    parser.add_argument("--cpu-cores", type=int, nargs="+", default=[0, 1], help="worker_cpu_cores values")
+    parser.add_argument("--load-child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--start-at", type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.load_child:
+        run_load_child(args.duration, args.concurrency, args.start_at)
+        return
+    if args.sweep:
+        sweep(args)
+        return
+
+    generator = DocumentGenerator()
+    tokenizer = get_tokenizer()
+    models = {mode.value: KerasClassifier(get_model(), mode) for mode in InferenceMode}
+
+    print(f"{'sentences':>9} {'mode':>9} {'mean ms':>9} {'p50 ms':>9} {'p99 ms':>9}")
+    for size in DIARY_SIZES:
+        diary = generate_diary(generator, size)
+        results = {}
+        for mode, model in models.items():
+            # Warm up so tracing and first call allocations are not measured
+            results[mode] = prediction(diary, tokenizer, model)
+            timing = measure(lambda: prediction(diary, tokenizer, model), args.iterations)
+            print(f"{size:>9} {mode:>9} {timing['mean']:>9.2f} {timing['p50']:>9.2f} {timing['p99']:>9.2f}")
+        if len(set(results.values())) != 1:
+            print(f"Warning: serving paths disagree on a {size} sentence diary: {results}")
+
+
+if __name__ == "__main__":
+    main()
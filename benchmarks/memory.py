@@ -0,0 +1,114 @@
+"""Compare the peak memory of classifying very long diaries in one shot and in chunks
+
+Every run is its own process so the max RSS is not left over from a previous run. The one-shot
+run predicts every sentence of the diary in one padded matrix like before, the chunked runs use
+--chunk-sentences rows at a time. Translation goes through an echo client, so only the
+chunking of the text is measured and not the translate api.
+
+Usage: python -m benchmarks.memory --sizes-kb 100 1000 5000 --chunk-sentences 0 256
+"""
+import argparse
+import json
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ONE_SHOT = 0
+
+
+class EchoTranslateClient:
+    def __init__(self):
+        self.calls = 0
+
+    def translate(self, values, target_language: str = "en", **kwargs):
+        # Same shape as the real client, a list of values gives one result per value
+        self.calls += 1
+        single = isinstance(values, str)
+        results = [{"translatedText": value, "detectedSourceLanguage": "en", "input": value}
+                   for value in ([values] if single else values)]
+        return results[0] if single else results
+
+
+def run_child(diary_path: str, chunk_sentences: int):
+    from app.dependencies import get_inference_model, get_tokenizer
+    from app.services.diary import predict_emotion, translate_content
+    from config import get_settings
+
+    # The warm up sentences must not come from the prediction cache in the measured run
+    get_settings().prediction_cache = False
+    tokenizer = get_tokenizer()
+    model = get_inference_model()
+    # Warm up so the model weights and graph are in the baseline and not in the measured peak
+    predict_emotion("warm up. the model", tokenizer, model)
+    with open(diary_path, encoding="utf-8") as f:
+        diary = f.read()
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    translate_client = EchoTranslateClient()
+    tracemalloc.start()
+    start = time.perf_counter()
+    translate_response = translate_content(diary, translate_client, translate=True)
+    emotion, _ = predict_emotion(translate_response.translated_text, tokenizer, model,
+                                 chunk_sentences=chunk_sentences or len(diary) + 1)
+    elapsed = time.perf_counter() - start
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(json.dumps({
+        "emotion": emotion,
+        "seconds": elapsed,
+        "translate_calls": translate_client.calls,
+        "traced_peak_mb": traced_peak / 1024 / 1024,
+        "rss_growth_mb": (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline_rss) / 1024,
+    }))
+
+
+def generate_diary(size_kb: int, sentences: list[str]):
+    parts = []
+    length = 0
+    while length < size_kb * 1024:
+        sentence = random.choice(sentences) + " "
+        parts.append(sentence)
+        length += len(sentence)
+    return "".join(parts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes-kb", nargs="+", type=int, default=[100, 1000, 5000])
+    parser.add_argument("--chunk-sentences", nargs="+", type=int, default=[ONE_SHOT, 256],
+                        help="Sentences predicted together, 0 predicts the whole diary at once")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.chunk_sentences[0])
+        return
+
+    from essential_generators import DocumentGenerator
+
+    generator = DocumentGenerator()
+    sentences = [generator.sentence() for _ in range(500)]
+
+    print(f"{'size KB':>8} {'chunk':>8} {'seconds':>8} {'calls':>6} {'traced MB':>10} {'rss +MB':>8} emotion")
+    for size_kb in args.sizes_kb:
+        with tempfile.NamedTemporaryFile("w", suffix=".txt", encoding="utf-8") as f:
+            f.write(generate_diary(size_kb, sentences))
+            f.flush()
+            for chunk_sentences in args.chunk_sentences:
+                output = subprocess.run(
+                    [sys.executable, "-m", "benchmarks.memory", "--child", f.name,
+                     "--chunk-sentences", str(chunk_sentences)],
+                    check=True, capture_output=True, text=True).stdout
+                result = json.loads(output.strip().splitlines()[-1])
+                chunk = "one-shot" if chunk_sentences == ONE_SHOT else chunk_sentences
+                print(f"{size_kb:>8} {chunk:>8} {result['seconds']:>8.2f} {result['translate_calls']:>6} "
+                      f"{result['traced_peak_mb']:>10.1f} {result['rss_growth_mb']:>8.1f} {result['emotion']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Compare the cost of a deep page with offset paging and with cursor paging
+
+The diaries of one user are listed page by page down to the deepest --depths page, once with
+page/size (offset) and once with the nextCursor of the previous page. The documents read are
+what Firestore bills: the offset page reads every skipped diary too, the cursor page only reads
+its own diaries plus one. The FakeFirestore sorts the whole collection in memory on every query,
+so its milliseconds grow with the collection anyway, use --live (against the diaries of
+--user-id) to see the latency of the real Firestore.
+
+Usage: python -m benchmarks.pagination [--diaries 20000] [--size 20] [--depths 1 10 100 500] [--live --user-id ID]
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+
+from app.services.diary import get_user_diary, get_user_diary_page
+from app.utils.fake_firestore import FakeFirestore
+
+USER_ID = "benchmark-user"
+
+
+def create_fake_diaries(count: int):
+    fs = FakeFirestore()
+    time_created = datetime.now()
+    for i in range(count):
+        fs.collection('diary').document(f"diary-{i:06d}").set({
+            "title": f"Diary {i}",
+            "content": "Aku senang hari ini",
+            "translated_content": "I happy day this",
+            "emotion": "joy",
+            "user_id": USER_ID,
+            "time_created": time_created - timedelta(seconds=i),
+            "time_updated": time_created})
+    return fs
+
+
+def measure_page(fs, function, *args):
+    # The real Firestore client does not count its reads
+    reads = getattr(fs, "reads", None)
+    start = time.perf_counter()
+    result = function(*args)
+    elapsed = (time.perf_counter() - start) * 1000
+    return result, elapsed, None if reads is None else fs.reads - reads
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--diaries", type=int, default=20000, help="Number of fake diaries of the user")
+    parser.add_argument("--size", type=int, default=20, help="Diaries per page")
+    parser.add_argument("--depths", type=int, nargs="+", default=[1, 10, 100, 500], help="Pages to measure")
+    parser.add_argument("--live", action="store_true", help="List the diaries of --user-id in the real Firestore")
+    parser.add_argument("--user-id", default=USER_ID, help="User whose diaries are listed with --live")
+    args = parser.parse_args()
+
+    if args.live:
+        from app.database import get_fs
+        fs = next(get_fs())
+    else:
+        fs = create_fake_diaries(args.diaries)
+    depths = set(args.depths)
+
+    results = {}
+    cursor = None
+    for page in range(1, max(depths) + 1):
+        (_, cursor), cursor_ms, cursor_reads = measure_page(
+            fs, get_user_diary_page, args.size, cursor, args.user_id, fs)
+        if page in depths:
+            _, offset_ms, offset_reads = measure_page(fs, get_user_diary, page, args.size, args.user_id, fs)
+            results[page] = (offset_reads, offset_ms, cursor_reads, cursor_ms)
+        if cursor is None:
+            break
+
+    print(f"{'page':>6} {'offset reads':>13} {'offset ms':>10} {'cursor reads':>13} {'cursor ms':>10}")
+    for page, (offset_reads, offset_ms, cursor_reads, cursor_ms) in sorted(results.items()):
+        print(f"{page:>6} {offset_reads if offset_reads is not None else '-':>13} {offset_ms:>10.2f} "
+              f"{cursor_reads if cursor_reads is not None else '-':>13} {cursor_ms:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Measure how much text skips the translate api thanks to the local language identifier, and what it saves
+
+Every diary goes through translate_content with the language detection off and on, the language
+is detected per sentence so only the characters of the sentences in english are saved. The api is
+the FakeTranslateClient with --round-trip-ms of sleep per call, or the real translate client with
+--live. Without --diaries the diaries are generated: english paragraphs and indonesian sentences
+made of the words of app/utils/words-id.txt, --english-share of them english.
+
+Usage: python -m benchmarks.translation [--diaries diaries.txt] [--round-trip-ms 80] [--live]
+"""
+import argparse
+import os
+import random
+import time
+
+from app.services.diary import translate_content
+from app.utils.fake_translate import FakeTranslateClient
+from app.utils.language import UTILS_DIRECTORY, get_language_identifier
+from app.utils.metrics import metrics
+from benchmarks.inference import percentile
+from config import get_settings
+
+
+def generate_diaries(count: int, english_share: float):
+    from essential_generators import DocumentGenerator
+
+    generator = DocumentGenerator()
+    with open(os.path.join(UTILS_DIRECTORY, "words-id.txt"), encoding="utf-8") as f:
+        indonesian_words = [line.strip() for line in f if line.strip()]
+    diaries = []
+    for _ in range(count):
+        if random.random() < english_share:
+            diaries.append(generator.paragraph())
+        else:
+            diaries.append(". ".join(" ".join(random.choices(indonesian_words, k=random.randint(5, 15)))
+                                     for _ in range(random.randint(1, 5))))
+    return diaries
+
+
+def measure(diaries: list[str], translate_client):
+    """Milliseconds per diary, the diaries that did not call the api at all and the characters sent to it"""
+    timings = []
+    skipped = 0
+    characters = metrics.get_counter("translate.characters")
+    for diary in diaries:
+        requests = metrics.get_counter("translate.requests")
+        start = time.perf_counter()
+        translate_content(diary, translate_client, translate=True)
+        timings.append((time.perf_counter() - start) * 1000)
+        skipped += metrics.get_counter("translate.requests") == requests
+    return timings, skipped, metrics.get_counter("translate.characters") - characters
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--diaries", help="Diaries to translate, one per line")
+    parser.add_argument("--count", type=int, default=200, help="Number of generated diaries")
+    parser.add_argument("--english-share", type=float, default=0.3, help="Share of the generated diaries in english")
+    parser.add_argument("--round-trip-ms", type=float, default=80, help="Latency of one call of the fake api")
+    parser.add_argument("--live", action="store_true", help="Call the real translate api")
+    args = parser.parse_args()
+
+    if args.diaries:
+        with open(args.diaries, encoding="utf-8") as f:
+            diaries = [line.strip() for line in f if line.strip()]
+    else:
+        diaries = generate_diaries(args.count, args.english_share)
+
+    if args.live:
+        from app.database import get_translate_client
+        translate_client = next(get_translate_client())
+    else:
+        translate_client = FakeTranslateClient(delay_seconds=args.round_trip_ms / 1000)
+
+    settings = get_settings()
+    identifier = get_language_identifier()
+    detect_timings = []
+    for diary in diaries:
+        start = time.perf_counter()
+        identifier.detect(diary)
+        detect_timings.append((time.perf_counter() - start) * 1000)
+
+    settings.language_detection = False
+    without_detection, _, all_characters = measure(diaries, translate_client)
+    settings.language_detection = True
+    with_detection, skipped, characters = measure(diaries, translate_client)
+
+    print(f"{len(diaries)} diaries, {skipped} skipped the translate api ({skipped / len(diaries):.1%}), "
+          f"{characters} of {all_characters} characters sent ({1 - characters / max(all_characters, 1):.1%} saved)")
+    print(f"{'':>18} {'mean ms':>9} {'p50 ms':>9} {'p99 ms':>9}")
+    for name, timings in [("detect only", detect_timings), ("without detection", without_detection),
+                          ("with detection", with_detection)]:
+        timings = sorted(timings)
+        print(f"{name:>18} {sum(timings) / len(timings):>9.2f} {percentile(timings, 0.5):>9.2f} "
+              f"{percentile(timings, 0.99):>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
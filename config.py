@@ -14,6 +14,17 @@ class RunningENV(Enum):
     TEST_PRODUCTION = "test-production"
 
 
+class InferenceMode(Enum):
+    PREDICT = "predict"  # keras model.predict
+    COMPILED = "compiled"  # traced tf.function with a fixed signature per sequence length bucket
+
+
+class ClassifierBackend(Enum):
+    KERAS = "keras"  # app/utils/model.h5 loaded with the full tensorflow
+    TFLITE = "tflite"  # converted flatbuffer run by the tflite interpreter
+    TFLITE_INT8 = "tflite-int8"  # int8 quantized flatbuffer that passed the accuracy gate of convert-model.py
+
+
 class DefaultSettings(BaseSettings):
     env: RunningENV = RunningENV.DEVELOPMENT
     db_user: str = "postgres"
@@ -40,6 +51,72 @@ class DefaultSettings(BaseSettings):
     bucket_name: str = "emodiary-app-photo-profile"
     static_file_routes: str = "https://storage.googleapis.com/emodiary-app-photo-profile/"
     production_base_url: str = "https://emodiary-app.et.r.appspot.com"
+    # Memory-mapped vocabulary inside app/utils generated by convert-vocabulary.py, empty to unpickle tokenizer.pickle
+    tokenizer_vocabulary: str = "vocabulary.bin"
+    classifier_backend: ClassifierBackend = ClassifierBackend.KERAS
+    classifier_tflite_model: str = "model.tflite"  # Generated by convert-model.py inside app/utils
+    classifier_quantized_model: str = "model-int8.tflite"  # Generated by convert-model.py --quantize int8
+    # Micro-batching of concurrent emotion predictions, see app/utils/batching.py
+    inference_batching: bool = False
+    inference_batch_window_ms: float = 5
+    inference_max_batch_size: int = 64
+    inference_mode: InferenceMode = InferenceMode.PREDICT
+    inference_sequence_buckets: list[int] = [32, 64, 128, 400]
+    # Unix socket of the inference sidecar (app/utils/sidecar.py), empty to load the model in every worker
+    inference_sidecar_socket: str = ""
+    # Pad every sentence only up to its length bucket, only used for a model that masks the padding (an Embedding
+    # with mask_zero), any other model keeps the fixed padding with a warning on load, so does the sidecar client
+    inference_dynamic_padding: bool = False
+    # Threads used inside one tensorflow op (also the tflite interpreter threads) and to run independent ops
+    # in parallel, 0 lets tensorflow use every core of the instance in every worker
+    tf_intra_op_threads: int = 0
+    tf_inter_op_threads: int = 0
+    # Number of cores every worker is pinned to, each worker takes different cores, 0 to not pin the workers
+    worker_cpu_cores: int = 0
+    # Threads that translate and classify the diaries created with "Prefer: respond-async"
+    diary_classification_workers: int = 2
+    # Add the translate and prediction stage durations to the /diaries responses as a Server-Timing header
+    server_timing_header: bool = False
+    # Emotion model loaded on start, "default" is app/utils/model.h5, other versions are in app/utils/models/<version>/
+    model_version: str = "default"
+    # Seconds between two checks of the model version selected by the admin, 0 to never check
+    model_sync_interval_seconds: float = 30
+    # Longest diary content accepted in characters, longer ones are rejected with 400
+    diary_content_max_length: int = 50000
+    # Diaries per page of /diaries and /diaries/all when a cursor is sent without a size
+    diary_page_size: int = 20
+    # Longest text sent in one translate call, longer diaries are translated chunk by chunk on sentence boundaries
+    translate_chunk_length: int = 5000
+    # Most values and characters sent in one translate request, texts translated together are packed up to these
+    translate_batch_max_segments: int = 128
+    translate_batch_max_characters: int = 30000
+    # Skip the translate api for a diary the local language identifier finds english with at least this confidence
+    language_detection: bool = True
+    language_detection_min_confidence: float = 0.9
+    # Seconds a translate call may take before the diary is classified untranslated and flagged for re-translation
+    translate_deadline_seconds: float = 5
+    # Send a second translate request when the first is slower than this percentile of the recent ones, 0 to never
+    translate_hedge_percentile: float = 0
+    # Consecutive translate failures that open the circuit breaker, and seconds before it tries the api again
+    translate_breaker_failures: int = 5
+    translate_breaker_reset_seconds: float = 30
+    # Translate calls running at the same time in a worker, the calls over it wait for their deadline
+    translate_max_concurrency: int = 16
+    # Sentences predicted together, a long diary is predicted in chunks of this many padded rows
+    prediction_chunk_sentences: int = 256
+    # Keep the predictions of every sentence by model version, so an edited diary only predicts its new sentences,
+    # off by default as every cached sentence costs about 450 bytes of the worker memory
+    prediction_cache: bool = False
+    # Sentences kept in the prediction cache of every worker (100000 is about 45MB), least recently used are evicted first
+    prediction_cache_max_sentences: int = 100000
+    # Keep the translate api results in memory and in the translation table, so the same text is translated once
+    translation_cache: bool = True
+    # Characters of translated text kept in the memory cache of every worker, least recently used are evicted first
+    translation_cache_memory_characters: int = 5000000
+    # Rows kept in the translation table, least recently used are deleted first
+    translation_cache_max_rows: int = 100000
+    # Inserts into the translation table between two evictions of the least recently used rows
+    translation_cache_eviction_interval: int = 100
 
     class Config:
         use_enum_values = True
@@ -0,0 +1,75 @@
+"""Convert app/utils/model.h5 into the flatbuffer used by the tflite classifier backends
+
+Usage: python convert-model.py [--output model.tflite]
+       python convert-model.py --quantize int8 --held-out diaries.txt [--min-agreement 0.97]
+
+With --quantize the held-out file (one translated diary per line) calibrates the quantization
+with its first --calibration-size diaries and the rest are the accuracy gate: the quantized
+model has to give the same emotion as model.h5 to at least --min-agreement of them, otherwise
+the converted file is removed and the command fails.
+"""
+import argparse
+import os
+import sys
+
+from app.dependencies import get_model, get_model_path, get_tokenizer
+from app.services.diary import (MAX_SEQUENCE_LENGTH, label_agreement,
+                                split_sentences)
+from app.utils.classifier import (QUANTIZATIONS, KerasClassifier,
+                                  TFLiteClassifier, convert_to_tflite)
+
+
+def read_held_out(path: str):
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", help="File name of the converted model inside app/utils, "
+                        "model.tflite or model-int8.tflite by default")
+    parser.add_argument("--quantize", choices=QUANTIZATIONS, help="Post-training quantization of the model")
+    parser.add_argument("--held-out", help="Translated diaries, one per line, that were not used for training")
+    parser.add_argument("--calibration-size", type=int, default=100,
+                        help="Number of held-out diaries used to calibrate the int8 activations")
+    parser.add_argument("--min-agreement", type=float, default=0.97,
+                        help="Minimum fraction of held-out diaries with the same emotion as model.h5")
+    args = parser.parse_args()
+
+    if args.quantize is None:
+        output_path = convert_to_tflite(get_model(), get_model_path(args.output or "model.tflite"))
+        print(f"Saved {output_path} ({os.path.getsize(output_path) / 1024:.1f} KB)")
+        return
+
+    if args.held_out is None:
+        parser.error("--quantize needs a --held-out set for the accuracy gate")
+    diaries = read_held_out(args.held_out)
+    calibration, gate = diaries[:args.calibration_size], diaries[args.calibration_size:]
+    if not gate:
+        parser.error(f"{args.held_out} has no diary left for the accuracy gate after the calibration ones")
+
+    tokenizer = get_tokenizer()
+    sentences = [sentence for diary in calibration for sentence in split_sentences(diary)]
+    representative_inputs = tokenizer.encode(sentences, maxlen=MAX_SEQUENCE_LENGTH)
+    output_path = convert_to_tflite(get_model(), get_model_path(args.output or "model-int8.tflite"),
+                                    quantization=args.quantize, representative_inputs=representative_inputs)
+
+    agreement, disagreements = label_agreement(gate, tokenizer, KerasClassifier(get_model()),
+                                               TFLiteClassifier(output_path))
+    float_size = os.path.getsize(get_model_path("model.h5"))
+    quantized_size = os.path.getsize(output_path)
+    print(f"model.h5 {float_size / 1024:.1f} KB, {os.path.basename(output_path)} {quantized_size / 1024:.1f} KB "
+          f"({quantized_size / float_size:.0%})")
+    print(f"Same emotion on {agreement:.2%} of {len(gate)} held-out diaries (minimum {args.min_agreement:.2%})")
+    for diary, expected, actual in disagreements[:10]:
+        print(f"  {expected} -> {actual}: {diary[:80]}")
+
+    if agreement < args.min_agreement:
+        os.remove(output_path)
+        print(f"Removed {output_path}, the quantized model did not pass the accuracy gate")
+        sys.exit(1)
+    print(f"Saved {output_path}")
+
+
+if __name__ == "__main__":
+    main()
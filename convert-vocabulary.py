@@ -0,0 +1,24 @@
+"""Convert app/utils/tokenizer.pickle into the memory-mapped vocabulary used at serving time
+
+Usage: python convert-vocabulary.py [--output vocabulary.bin]
+"""
+import argparse
+import os
+
+from app.dependencies import get_model_path, get_pickle_tokenizer
+from app.utils.vocabulary import Vocabulary, write_vocabulary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--output", default="vocabulary.bin", help="File name of the vocabulary inside app/utils")
+    args = parser.parse_args()
+
+    tokenizer = get_pickle_tokenizer()
+    output_path = write_vocabulary(tokenizer, get_model_path(args.output))
+    vocabulary = Vocabulary(output_path)
+    print(f"Saved {len(vocabulary)} words to {output_path} ({os.path.getsize(output_path) / 1024:.1f} KB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Re-classify the emotion of every diary with the current model
+
+Usage: python reclassify-diary.py [--page-size 500] [--batch-size 256] [--checkpoint reclassify.json] [--dry-run]
+       python reclassify-diary.py --retranslate [--page-size 500]
+       python reclassify-diary.py --retry-pending [--older-than-minutes 10] [--page-size 500]
+
+With --retranslate only the diaries classified untranslated while the translate api was not
+available are translated and classified again. With --retry-pending only the diaries left pending
+or failed by the background classification are translated and classified.
+
+Set FIRESTORE_EMULATOR_HOST to run the job against a local Firestore emulator.
+"""
+import argparse
+import os
+
+from app.database import get_fs, get_translate_client
+from app.dependencies import get_local_inference_model, get_tokenizer
+from app.services.reclassify import (reclassify_diaries, retranslate_diaries,
+                                     retry_pending_diaries)
+from app.services.translation import (get_cached_translate_client,
+                                      get_resilient_translate_client)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--page-size", type=int, default=500, help="Number of diaries read per query")
+    parser.add_argument("--batch-size", type=int, default=256, help="Number of diaries predicted per model call")
+    parser.add_argument("--checkpoint", default="reclassify.json", help="File that keeps the position of the job")
+    parser.add_argument("--reset", action="store_true", help="Ignore the checkpoint and start from the first diary")
+    parser.add_argument("--dry-run", action="store_true", help="Count the changed diaries without writing them")
+    parser.add_argument("--retranslate", action="store_true",
+                        help="Translate and classify again the diaries flagged for re-translation")
+    parser.add_argument("--retry-pending", action="store_true",
+                        help="Translate and classify the diaries left pending or failed by the background classification")
+    parser.add_argument("--older-than-minutes", type=float, default=10,
+                        help="Only retry the pending or failed diaries not updated for this long")
+    args = parser.parse_args()
+
+    if args.retry_pending:
+        translate_client = get_cached_translate_client(get_resilient_translate_client(next(get_translate_client())))
+        report = retry_pending_diaries(next(get_fs()), translate_client, get_tokenizer(), get_local_inference_model(),
+                                       older_than_minutes=args.older_than_minutes, page_size=args.page_size)
+        print(f"Classified {report.updated} pending or failed diaries in {report.elapsed_seconds:.1f}s")
+        return
+
+    if args.retranslate:
+        translate_client = get_cached_translate_client(get_resilient_translate_client(next(get_translate_client())))
+        report = retranslate_diaries(next(get_fs()), translate_client, get_tokenizer(), get_local_inference_model(),
+                                     page_size=args.page_size)
+        print(f"Re-translated {report.updated} diaries in {report.elapsed_seconds:.1f}s, "
+              f"{'all done' if report.finished else 'some are left for the next run'}")
+        return
+
+    if args.reset and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+
+    fs = next(get_fs())
+    report = reclassify_diaries(
+        fs,
+        get_tokenizer(),
+        get_local_inference_model(),
+        page_size=args.page_size,
+        batch_size=args.batch_size,
+        checkpoint_path=None if args.dry_run else args.checkpoint,
+        dry_run=args.dry_run)
+
+    print(f"Processed {report.processed} diaries in {report.elapsed_seconds:.1f}s "
+          f"({report.documents_per_second:.1f} docs/sec), {report.updated} updated, {report.invalid} invalid, "
+          f"{report.stale} skipped because they were edited meanwhile")
+
+
+if __name__ == "__main__":
+    main()